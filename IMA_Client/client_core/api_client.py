@@ -1,12 +1,22 @@
 import requests
 import os
 import json
+import time
+import hashlib
 import urllib.parse
 from requests.exceptions import RequestException
+from client_core.audio_codec import UPLOAD_CODEC, DOWNLOAD_ACCEPT, encode_for_upload, ext_for_media_type
+
+# [新增] 超过该大小 (字节) 的录音走分片续传上传
+RESUMABLE_UPLOAD_THRESHOLD = 8 * 1024 * 1024
+# 单个分片失败后的重试次数
+UPLOAD_RETRIES = 5
 
 class APIClient:
-    def __init__(self, base_url="http://127.0.0.1:8001"):
+    def __init__(self, base_url="http://127.0.0.1:8001", upload_codec=UPLOAD_CODEC):
         self.base_url = base_url
+        # [新增] 上传前压缩录音的格式 (flac / opus / wav)
+        self.upload_codec = upload_codec
         self.token = None
         self.headers = {}
 
@@ -73,22 +83,175 @@ class APIClient:
 
     # --- Task Methods ---
     def create_meeting_task(self, audio_path, pipeline_config):
+        # [新增] 先压缩再上传，服务器入库时解码
+        audio_path, is_temp = encode_for_upload(audio_path, self.upload_codec)
         try:
-            with open(audio_path, 'rb') as f:
-                files = {'file': f}
-                data = {'config': json.dumps(pipeline_config)}
-                resp = requests.post(f"{self.base_url}/tasks/create", headers=self.headers, data=data, files=files)
-                if resp.status_code == 200: return resp.json().get("task_id")
+            data = {'config': json.dumps(pipeline_config)}
+            # [修改] 大文件先分片续传，网络不稳定时只需重传失败的分片
+            if os.path.getsize(audio_path) > RESUMABLE_UPLOAD_THRESHOLD:
+                upload_id = self.upload_resumable(audio_path)
+                if not upload_id: return None
+                data['upload_id'] = upload_id
+                resp = requests.post(f"{self.base_url}/tasks/create", headers=self.headers, data=data)
+            else:
+                with open(audio_path, 'rb') as f:
+                    files = {'file': f}
+                    resp = requests.post(f"{self.base_url}/tasks/create", headers=self.headers, data=data, files=files)
+            if resp.status_code == 200: return resp.json().get("task_id")
         except: pass
+        finally:
+            if is_temp and os.path.exists(audio_path):
+                try: os.remove(audio_path)
+                except OSError: pass
         return None
 
-    def get_task_status(self, task_id):
+    def upload_resumable(self, file_path, progress_cb=None):
+        """
+        [新增] 分片上传文件，返回 upload_id (失败返回 None)。
+        每个分片失败后查询服务器已接收的偏移量并从该处继续。
+        """
+        h = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        size = os.path.getsize(file_path)
+        payload = {"filename": os.path.basename(file_path), "size": size, "sha256": h.hexdigest()}
+        resp = requests.post(f"{self.base_url}/uploads", headers=self.headers, json=payload, timeout=30)
+        if resp.status_code != 200:
+            print(f"[API] Upload session failed: {resp.text}")
+            return None
+        session = resp.json()
+        upload_id, offset, chunk_size = session["upload_id"], session["offset"], session["chunk_size"]
+
+        url = f"{self.base_url}/uploads/{upload_id}"
+        failures = 0
+        with open(file_path, 'rb') as f:
+            while offset < size:
+                f.seek(offset)
+                chunk = f.read(chunk_size)
+                server_offset = None
+                try:
+                    r = requests.put(url, headers=self.headers, params={"offset": offset}, data=chunk, timeout=(10, 120))
+                    if r.status_code == 200:
+                        offset = r.json()["offset"]
+                        failures = 0
+                        if progress_cb: progress_cb(offset / size)
+                        continue
+                    if r.status_code != 409 and r.status_code < 500:
+                        print(f"[API] Upload rejected: {r.text}")
+                        return None
+                    server_offset = r.headers.get("Upload-Offset")
+                except RequestException as e:
+                    print(f"[API] Chunk upload failed at {offset}: {e}")
+                failures += 1
+                if failures > UPLOAD_RETRIES:
+                    return None
+                time.sleep(min(2 ** failures, 30))
+                # 以服务器记录的偏移量为准继续 ([新增] 409 已附带 Upload-Offset 时不必再查询)
+                if server_offset and server_offset.isdigit():
+                    offset = int(server_offset)
+                    continue
+                try:
+                    r = requests.get(url, headers=self.headers, timeout=10)
+                    if r.status_code == 200: offset = r.json()["offset"]
+                except RequestException: pass
+        return upload_id
+
+    # --- [新增] Live Session Methods ---
+    def create_live_session(self, pipeline_config):
+        """开始实时会议，返回会话信息 (task_id、采样率等)，服务器不支持或失败时返回 None"""
+        try:
+            resp = requests.post(f"{self.base_url}/live/sessions", headers=self.headers,
+                                 json={"config": pipeline_config}, timeout=60)
+            if resp.status_code == 200: return resp.json()
+            print(f"[API] Live session unavailable: {resp.status_code}")
+        except RequestException as e:
+            print(f"[API] Live session failed: {e}")
+        return None
+
+    def push_live_chunk(self, task_id, offset, data, content_type):
+        """
+        推送一块录音
+        :return: (HTTP 状态码, 服务器已接收的偏移量)；网络错误时为 (None, None)
+        """
+        try:
+            headers = dict(self.headers, **{"Content-Type": content_type})
+            r = requests.put(f"{self.base_url}/live/sessions/{task_id}", headers=headers,
+                             params={"offset": offset}, data=data, timeout=(10, 30))
+            if r.status_code == 200:
+                return 200, r.json()["offset"]
+            server_offset = r.headers.get("Upload-Offset")
+            return r.status_code, int(server_offset) if server_offset and server_offset.isdigit() else None
+        except RequestException as e:
+            print(f"[API] Live chunk failed at {offset}: {e}")
+            return None, None
+
+    def finish_live_session(self, task_id):
+        try:
+            resp = requests.post(f"{self.base_url}/live/sessions/{task_id}/finish", headers=self.headers, timeout=30)
+            return resp.status_code == 200
+        except RequestException: return False
+
+    def get_task_status(self, task_id, since=None):
+        """since: 日志游标，传入上次返回的 cursor 时只拉取新增日志"""
         try:
-            resp = requests.get(f"{self.base_url}/tasks/{task_id}", headers=self.headers)
+            params = {"since": since} if since is not None else None
+            resp = requests.get(f"{self.base_url}/tasks/{task_id}", headers=self.headers, params=params)
             if resp.status_code == 200: return resp.json() 
         except: pass
         return None
 
+    def get_artifact(self, task_id, kind, max_bytes=None):
+        """
+        [新增] 获取任务结果文本 (kind: transcript / summary)
+        :param max_bytes: 只取前 max_bytes 字节 (Range 请求)，用于大转写的预览
+        :return: (text, total_size)，失败时返回 (None, 0)
+        """
+        try:
+            headers = dict(self.headers)
+            if max_bytes: headers["Range"] = f"bytes=0-{max_bytes - 1}"
+            resp = requests.get(f"{self.base_url}/tasks/{task_id}/artifacts/{kind}", headers=headers)
+            if resp.status_code in (200, 206):
+                total = len(resp.content)
+                content_range = resp.headers.get("Content-Range", "")
+                if "/" in content_range:
+                    total = int(content_range.rsplit("/", 1)[1])
+                # 截断处可能落在多字节字符中间
+                return resp.content.decode("utf-8", errors="ignore"), total
+        except: pass
+        return None, 0
+
+    def stream_task_events(self, task_id, since=0):
+        """
+        [新增] 订阅服务器推送 (Server-Sent Events)，逐条产出 {"seq", "type", "data"}。
+        type 为 log / progress / transcript / state，收到 state 表示任务结束。
+        连接失败或中途断开时抛出 RequestException，调用方可改用轮询。
+        """
+        url = f"{self.base_url}/tasks/{task_id}/events"
+        # 读超时需大于服务器心跳间隔 (15s)
+        with requests.get(url, headers=self.headers, params={"since": since}, stream=True, timeout=(5, 60)) as resp:
+            resp.raise_for_status()
+            seq, kind, data = None, "message", []
+            for line in resp.iter_lines(decode_unicode=True):
+                if line is None:
+                    continue
+                if line == "":
+                    # 空行表示一条事件结束
+                    if data:
+                        yield {"seq": seq, "type": kind, "data": json.loads("\n".join(data))}
+                    seq, kind, data = None, "message", []
+                elif line.startswith(":"):
+                    continue  # 心跳
+                else:
+                    field, _, value = line.partition(":")
+                    value = value[1:] if value.startswith(" ") else value
+                    if field == "id" and value.isdigit():
+                        seq = int(value)
+                    elif field == "event":
+                        kind = value
+                    elif field == "data":
+                        data.append(value)
+
     def cancel_task(self, task_id):
         try:
             resp = requests.post(f"{self.base_url}/tasks/{task_id}/cancel", headers=self.headers)
@@ -96,18 +259,26 @@ class APIClient:
         except: return False
 
     # --- History & Audio Methods ---
-    def get_history(self):
-        if not self.token: return []
+    def get_history(self, cursor=None, limit=50):
+        """[修改] 分页获取历史记录，返回 (items, next_cursor)；next_cursor 为 None 表示没有更多"""
+        if not self.token: return [], None
         try:
-            resp = requests.get(f"{self.base_url}/history", headers=self.headers)
-            if resp.status_code == 200: return resp.json()
+            params = {"limit": limit}
+            if cursor: params["cursor"] = cursor
+            resp = requests.get(f"{self.base_url}/history", headers=self.headers, params=params)
+            if resp.status_code == 200:
+                data = resp.json()
+                return data.get("items", []), data.get("next_cursor")
         except: pass
-        return []
+        return [], None
 
     def download_audio(self, task_id, save_path):
+        """[修改] 优先下载压缩格式；save_path 的扩展名按服务器返回的格式修正，返回 (成功, 实际路径)"""
         try:
-            with requests.get(f"{self.base_url}/tasks/{task_id}/audio", headers=self.headers, stream=True) as r:
+            headers = dict(self.headers, Accept=DOWNLOAD_ACCEPT)
+            with requests.get(f"{self.base_url}/tasks/{task_id}/audio", headers=headers, stream=True) as r:
                 r.raise_for_status()
+                save_path = os.path.splitext(save_path)[0] + ext_for_media_type(r.headers.get("Content-Type"))
                 with open(save_path, 'wb') as f:
                     for chunk in r.iter_content(chunk_size=8192):
                         f.write(chunk)
@@ -0,0 +1,92 @@
+import io
+import os
+import time
+from math import gcd
+import numpy as np
+import soundfile as sf
+
+from client_core.wav_spill import wav_header
+
+# 上传前的压缩格式：flac (无损，默认) / opus (有损，体积约为 wav 的 1/10) / wav (不压缩)
+UPLOAD_CODEC = os.environ.get("IMA_UPLOAD_CODEC", "flac").lower()
+
+# 格式 -> (soundfile 容器, 编码, 扩展名)
+CODECS = {
+    "flac": ("FLAC", "PCM_16", ".flac"),
+    "opus": ("OGG", "OPUS", ".opus"),
+}
+# Opus 编码器只接受这些采样率
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+# 对 Opus 即码率档位，0.9 约合 30 kbps
+OPUS_COMPRESSION_LEVEL = 0.9
+# 下载录音时的 Accept 头：优先 FLAC，服务器不支持时退回 wav
+DOWNLOAD_ACCEPT = "audio/flac, audio/wav;q=0.5"
+# Content-Type -> 本地文件扩展名
+MEDIA_EXTS = {"audio/flac": ".flac", "audio/ogg": ".opus", "audio/wav": ".wav"}
+# 实时上传的音频块格式 -> Content-Type (wav 表示直接发送 PCM16)
+CHUNK_MEDIA_TYPES = {"flac": "audio/flac", "opus": "audio/ogg", "wav": "application/octet-stream"}
+# 服务器直接接收的原始 PCM16 采样率；其他采样率的未压缩块带 wav 文件头发送，由服务器重采样
+LIVE_PCM_SR = 16000
+
+
+def encode_for_upload(audio_path, codec=UPLOAD_CODEC):
+    """
+    [新增] 把 wav 录音压缩为 codec 格式的临时文件 (与原文件同目录)。
+    codec 为 wav、源文件不是 wav 或编码失败时返回原路径。
+    :return: (上传用的路径, 是否为临时文件)
+    """
+    if codec not in CODECS or not audio_path.lower().endswith(".wav"):
+        return audio_path, False
+    container, subtype, ext = CODECS[codec]
+    out_path = os.path.splitext(audio_path)[0] + ext
+    try:
+        t0 = time.perf_counter()
+        samples, sr = sf.read(audio_path, dtype='float32')
+        extra = {}
+        if codec == "opus":
+            extra["compression_level"] = OPUS_COMPRESSION_LEVEL
+            if sr not in OPUS_RATES:
+                from scipy.signal import resample_poly
+                g = gcd(sr, 48000)
+                samples, sr = resample_poly(samples, 48000 // g, sr // g, axis=0), 48000
+        sf.write(out_path, samples, sr, format=container, subtype=subtype, **extra)
+        before, after = os.path.getsize(audio_path), os.path.getsize(out_path)
+        print(f"[Codec] {os.path.basename(audio_path)} -> {codec}: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB "
+              f"in {time.perf_counter() - t0:.1f}s")
+        return out_path, True
+    except Exception as e:
+        print(f"[Codec] Encode failed, uploading original: {e}")
+        if os.path.exists(out_path):
+            try: os.remove(out_path)
+            except OSError: pass
+        return audio_path, False
+
+
+def encode_chunk(pcm, sr, codec=UPLOAD_CODEC):
+    """
+    [新增] 把一段 PCM16 录音编码为自包含的小文件 (内存中)，供边录边传使用
+    :return: (bytes, Content-Type)；codec 为 wav 或编码失败时返回原始 PCM
+    """
+    if codec not in CODECS or (codec == "opus" and sr not in OPUS_RATES):
+        return _pcm_chunk(pcm, sr)
+    container, subtype, _ = CODECS[codec]
+    try:
+        samples = np.frombuffer(pcm, dtype="<i2")
+        buf = io.BytesIO()
+        extra = {"compression_level": OPUS_COMPRESSION_LEVEL} if codec == "opus" else {}
+        sf.write(buf, samples, sr, format=container, subtype=subtype, **extra)
+        return buf.getvalue(), CHUNK_MEDIA_TYPES[codec]
+    except Exception as e:
+        print(f"[Codec] Chunk encode failed, sending PCM: {e}")
+        return _pcm_chunk(pcm, sr)
+
+
+def _pcm_chunk(pcm, sr):
+    """[新增] 未压缩的音频块：16 kHz 直接发送 PCM16，其他采样率加上 wav 文件头 (audio/wav)"""
+    if sr == LIVE_PCM_SR:
+        return bytes(pcm), CHUNK_MEDIA_TYPES["wav"]
+    return wav_header(sr, data_bytes=len(pcm)) + bytes(pcm), "audio/wav"
+
+
+def ext_for_media_type(content_type, default=".wav"):
+    return MEDIA_EXTS.get((content_type or "").split(";")[0].strip().lower(), default)
@@ -8,10 +8,13 @@ from tkinter import filedialog
 
 from client_core.app_state import api, recorder, log, GLOBAL_SUMMARY_CACHE, render_markdown
 from client_core.components.node_editor import get_current_pipeline_config 
+from client_core.live_uploader import LiveUploader
 
 # 模块状态
 IS_POLLING = False
 CURRENT_TASK_ID = None
+# [新增] 当前录音的实时上传 (服务器不支持实时会话时为 None)
+LIVE_UPLOADER = None
 
 # ================= 任务轮询逻辑 =================
 def start_polling(tid):
@@ -21,11 +24,69 @@ def start_polling(tid):
     dpg.configure_item("btn_cancel", show=True)
     threading.Thread(target=poll_task_thread, args=(tid,), daemon=True).start()
 
-def poll_task_thread(tid):
+def is_polling(tid):
+    """[新增] 轮询线程按任务区分：开始轮询另一个任务后，旧线程收到的事件一律忽略"""
+    return IS_POLLING and CURRENT_TASK_ID == tid
+
+def stop_polling(tid):
+    """[新增] 停止指定任务的轮询 (不影响之后开始的任务)"""
+    global IS_POLLING
+    if CURRENT_TASK_ID == tid:
+        IS_POLLING = False
+
+def finish_task(tid, state, artifacts=None):
     global IS_POLLING
-    last_idx = 0
-    while IS_POLLING:
-        st = api.get_task_status(tid)
+    if not is_polling(tid):
+        return
+    log(f"Task {state.upper()}!")
+    IS_POLLING = False
+    dpg.configure_item("btn_cancel", show=False)
+    # [修改] 状态中只有结果清单，摘要正文单独下载
+    if artifacts and "summary" in artifacts:
+        summary, _ = api.get_artifact(tid, "summary")
+        if summary:
+            render_markdown("SummaryContainer", summary)
+            dpg.set_value("ResultTabs", "tab_summary")
+
+def stream_task(tid):
+    """
+    [新增] 通过服务器推送实时接收日志/进度/分段转写。
+    :return: (done, last_seq) done=False 表示推送不可用或中途断开，需要改用轮询；
+             last_seq 为最后收到的事件序号，轮询时作为日志游标继续
+    """
+    last_seq = 0
+    for _ in range(3):
+        try:
+            for ev in api.stream_task_events(tid, since=last_seq):
+                if not is_polling(tid):
+                    return True, last_seq
+                if ev["seq"] is not None:
+                    last_seq = ev["seq"]
+                if ev["type"] == "progress":
+                    dpg.set_value("ProgressBar", ev["data"])
+                elif ev["type"] in ("log", "transcript"):
+                    log(f"[Server] {ev['data']}", is_result=True)
+                elif ev["type"] == "state":
+                    st = ev["data"] or {}
+                    if st.get("state") in ["completed", "failed", "cancelled"]:
+                        dpg.set_value("ProgressBar", st.get("progress", 1.0))
+                        finish_task(tid, st["state"], st.get("artifacts"))
+                        return True, last_seq
+                    return False, last_seq
+        except Exception as e:
+            print(f"[Dashboard] Event stream interrupted: {e}")
+            time.sleep(1)
+    return False, last_seq
+
+def poll_task_thread(tid):
+    # 优先使用推送，不可用时退回轮询
+    done, cursor = stream_task(tid)
+    if done or not is_polling(tid):
+        return
+    log("Event stream unavailable, falling back to polling.")
+    while is_polling(tid):
+        # [优化] 带游标轮询，服务器只返回新增日志
+        st = api.get_task_status(tid, since=cursor)
         if not st: 
             time.sleep(2)
             continue
@@ -33,38 +94,54 @@ def poll_task_thread(tid):
         if "progress" in st: 
             dpg.set_value("ProgressBar", st["progress"])
             
-        logs = st.get("logs", [])
-        if len(logs) > last_idx:
-            for l in logs[last_idx:]: 
-                log(f"[Server] {l}", is_result=True)
-            last_idx = len(logs)
-            
-        if st.get("markdown"): 
-            render_markdown("SummaryContainer", st["markdown"])
-            dpg.set_value("ResultTabs", "tab_summary")
+        if st.get("dropped_events"):
+            log(f"[Server] ... {st['dropped_events']} event(s) skipped (log lines and progress updates) ...")
+        for l in st.get("logs", []): 
+            log(f"[Server] {l}", is_result=True)
+        cursor = st.get("cursor", cursor)
             
         if st.get("state") in ["completed", "failed", "cancelled"]: 
-            log(f"Task {st.get('state').upper()}!")
-            IS_POLLING = False
-            dpg.configure_item("btn_cancel", show=False)
+            finish_task(tid, st.get("state"), st.get("artifacts"))
             break
             
         time.sleep(1)
 
 # ================= 按钮回调 =================
 def btn_rec_click(s):
+    global LIVE_UPLOADER
     if "Start" in dpg.get_item_label(s):
         dpg.set_item_label(s, "Stop & Upload")
         dpg.bind_item_theme(s, "theme_red")
         dpg.configure_item("btn_cancel", show=False)
         
-        recorder.start(f"meet_{int(time.time())}")
-        log("Recording meeting...")
+        # [新增] 优先边录边传：服务器在录音过程中降噪、断句、识别说话人并转写
+        LIVE_UPLOADER = None
+        session = api.create_live_session(get_current_pipeline_config())
+        if session:
+            # 推送的是录音器的原始 PCM，按录音采样率标注，由服务器重采样
+            LIVE_UPLOADER = LiveUploader(api, session["task_id"], sr=recorder.sr).start()
+            recorder.start(f"meet_{int(time.time())}", on_frame=LIVE_UPLOADER.push)
+            log(f"Recording meeting (live task {session['task_id']})...")
+            start_polling(session["task_id"])
+        else:
+            recorder.start(f"meet_{int(time.time())}")
+            log("Recording meeting...")
     else:
         dpg.set_item_label(s, "Start Recording")
         dpg.bind_item_theme(s, "theme_green")
         
         recorder.stop()
+        uploader, LIVE_UPLOADER = LIVE_UPLOADER, None
+        if uploader is not None:
+            # 录音已在服务器上，只需发送最后一块并让服务器处理收尾阶段
+            if uploader.close() and api.finish_live_session(uploader.task_id):
+                log(f"Live upload done ({uploader.sent_bytes / 1e6:.1f} MB sent), finalizing...")
+                return
+            log("Live upload failed, uploading the recording instead...")
+            # [修复] 先停止实时任务的轮询线程，它收到 cancelled 状态时不会再结束新任务的轮询
+            stop_polling(uploader.task_id)
+            api.cancel_task(uploader.task_id)
+            
         log("Uploading meeting audio...")
         if recorder.last_file:
             cfg = get_current_pipeline_config()
@@ -7,39 +7,83 @@ from client_core.app_state import api, log, render_markdown
 # 状态存储
 HISTORY_DATA = []  # 存储列表原始数据
 CURRENT_HISTORY_TASK_ID = None
+# [新增] 分页状态：下一页游标 / 是否还有更多 / 是否正在加载
+HISTORY_PAGE_SIZE = 50
+HISTORY_CURSOR = None
+HISTORY_HAS_MORE = False
+HISTORY_LOADING = False
+# 刷新代数：刷新后丢弃旧请求返回的页
+HISTORY_GENERATION = 0
+# [新增] 历史详情中转写预览的最大字节数 (超长转写不一次性载入文本框)
+TRANSCRIPT_PREVIEW_BYTES = 256 * 1024
+
+def _format_item(item):
+    # 格式化显示：[时间] 文件名 (状态)
+    time_str = item.get('created_at', 'N/A').split(' ')[0] # 只取日期
+    fname = item.get('file_name', 'Unknown')
+    status = item.get('status', 'Unknown')
+    
+    icon = "T" if status == 'completed' else "F" if status == 'failed' else "U"
+    return f"{icon} [{time_str}] {fname}"
+
+def _set_sentinel():
+    if HISTORY_LOADING:
+        dpg.set_value("HistoryMore", "Loading...")
+    elif HISTORY_HAS_MORE:
+        dpg.set_value("HistoryMore", "Scroll for more...")
+    else:
+        dpg.set_value("HistoryMore", f"{len(HISTORY_DATA)} records")
+
+def load_next_history_page():
+    """[新增] 拉取下一页并追加到列表末尾 (后台线程，避免阻塞渲染)"""
+    global HISTORY_LOADING
+    if HISTORY_LOADING or not HISTORY_HAS_MORE: return
+    HISTORY_LOADING = True
+    _set_sentinel()
+    generation, cursor = HISTORY_GENERATION, HISTORY_CURSOR
+
+    def _fetch():
+        global HISTORY_CURSOR, HISTORY_HAS_MORE, HISTORY_LOADING
+        items, next_cursor = api.get_history(cursor, HISTORY_PAGE_SIZE)
+        if generation != HISTORY_GENERATION: return
+        for item in items:
+            dpg.add_selectable(label=_format_item(item), parent="HistoryList", before="HistoryMore",
+                               user_data=len(HISTORY_DATA), callback=on_history_selected)
+            HISTORY_DATA.append(item)
+        HISTORY_CURSOR = next_cursor
+        HISTORY_HAS_MORE = next_cursor is not None
+        HISTORY_LOADING = False
+        _set_sentinel()
+
+    threading.Thread(target=_fetch, daemon=True).start()
 
 def refresh_history_list():
-    """从服务器拉取最新历史记录并刷新列表"""
-    global HISTORY_DATA
+    """[修改] 清空列表并从第一页重新加载，后续页在滚动到底部时按需加载"""
+    global HISTORY_DATA, HISTORY_CURSOR, HISTORY_HAS_MORE, HISTORY_LOADING, HISTORY_GENERATION
     log("Refreshing history...")
-    data = api.get_history() # 返回 [{task_id, file_name, status, created_at}, ...]
-    HISTORY_DATA = data
-    
-    display_items = []
-    for item in data:
-        # 格式化显示：[时间] 文件名 (状态)
-        time_str = item.get('created_at', 'N/A').split(' ')[0] # 只取日期
-        fname = item.get('file_name', 'Unknown')
-        status = item.get('status', 'Unknown')
-        
-        icon = "T" if status == 'completed' else "F" if status == 'failed' else "U"
-        display_items.append(f"{icon} [{time_str}] {fname}")
-    
-    dpg.configure_item("HistoryList", items=display_items)
-    log(f"History refreshed. {len(data)} records found.")
+    HISTORY_GENERATION += 1
+    HISTORY_DATA = []
+    HISTORY_CURSOR = None
+    HISTORY_HAS_MORE = True
+    HISTORY_LOADING = False
+    dpg.delete_item("HistoryList", children_only=True)
+    dpg.add_text("", tag="HistoryMore", parent="HistoryList", color=(150, 150, 150))
+    dpg.bind_item_handler_registry("HistoryMore", "HistoryMoreHandler")
+    load_next_history_page()
+
+def on_history_visible(sender, app_data):
+    """列表底部的占位文本进入可视区域时加载下一页"""
+    load_next_history_page()
 
-def on_history_selected(sender, app_data):
-    """当用户点击列表某一项时"""
+def on_history_selected(sender, app_data, user_data):
+    """当用户点击列表某一项时 (user_data 为该项在 HISTORY_DATA 中的索引)"""
     global CURRENT_HISTORY_TASK_ID
-    if not app_data: return
-    
-    # app_data 是选中的字符串，我们需要找到对应的 task_id
-    # 这里简单通过 index 来找（前提是列表顺序没变）
     try:
-        # 获取选中项的索引
-        all_items = dpg.get_item_configuration("HistoryList")["items"]
-        index = all_items.index(app_data)
-        task_info = HISTORY_DATA[index]
+        # 单选：取消其他项的选中状态
+        for child in dpg.get_item_children("HistoryList", 1):
+            if child != sender and dpg.get_item_type(child) == "mvAppItemType::mvSelectable":
+                dpg.set_value(child, False)
+        task_info = HISTORY_DATA[user_data]
         CURRENT_HISTORY_TASK_ID = task_info['task_id']
         
         # 加载详情
@@ -53,12 +97,21 @@ def load_task_details(task_id):
     
     # 异步获取，防止卡顿
     def _fetch():
-        details = api.get_task_status(task_id) # 获取完整详情（含 transcript, markdown）
+        details = api.get_task_status(task_id) # 状态 + 结果清单 (artifacts)
         if details:
             # 更新 UI 必须在主线程（DPG特性：大部分简单set_value可以跨线程，但复杂的最好注意）
             # 这里简单直接调用
-            transcript = details.get('transcript', '(No Transcript)')
-            summary = details.get('markdown', '(No Summary)')
+            # [修改] 转写/摘要按需下载；超长转写只取开头部分预览
+            artifacts = details.get('artifacts') or {}
+            transcript, summary = None, None
+            if 'transcript' in artifacts:
+                transcript, total = api.get_artifact(task_id, 'transcript', TRANSCRIPT_PREVIEW_BYTES)
+                if transcript is not None and total > TRANSCRIPT_PREVIEW_BYTES:
+                    transcript += f"\n\n... (showing the first {TRANSCRIPT_PREVIEW_BYTES // 1024} KB of {total // 1024} KB)"
+            if 'summary' in artifacts:
+                summary, _ = api.get_artifact(task_id, 'summary')
+            transcript = transcript or '(No Transcript)'
+            summary = summary or '(No Summary)'
             
             # 1. 填充 Transcript
             dpg.set_value("HistTranscriptBox", transcript)
@@ -88,9 +141,9 @@ def btn_download_play_click():
         success, msg = api.download_audio(CURRENT_HISTORY_TASK_ID, save_path)
         if success:
             dpg.set_value("hist_loading", "Opening player...")
-            # 调用系统默认播放器打开
+            # 调用系统默认播放器打开 (msg 为实际保存路径，扩展名随下载格式变化)
             try:
-                webbrowser.open(os.path.abspath(save_path))
+                webbrowser.open(os.path.abspath(msg))
             except Exception as e:
                 log(f"Play error: {e}")
             dpg.set_value("hist_loading", "")
@@ -111,8 +164,12 @@ def init_history_tab():
         
         with dpg.group(horizontal=True):
             # === 左侧：列表 ===
-            with dpg.child_window(width=300):
-                dpg.add_listbox(tag="HistoryList", width=-1, num_items=30, callback=on_history_selected)
+            # [修改] 可滚动列表，滚动到底部时懒加载下一页
+            with dpg.item_handler_registry(tag="HistoryMoreHandler"):
+                dpg.add_item_visible_handler(callback=on_history_visible)
+            with dpg.child_window(width=300, tag="HistoryList"):
+                dpg.add_text("", tag="HistoryMore", color=(150, 150, 150))
+            dpg.bind_item_handler_registry("HistoryMore", "HistoryMoreHandler")
             
             # === 右侧：详情 ===
             with dpg.child_window(width=-1):
@@ -0,0 +1,87 @@
+import os
+import time
+import queue
+import threading
+
+from client_core.audio_codec import UPLOAD_CODEC, encode_chunk
+
+# 边录边传时每个音频块的时长 (秒)：越短转写越及时，请求数越多
+LIVE_CHUNK_SEC = float(os.environ.get("IMA_LIVE_CHUNK_SEC", "2"))
+# 单个音频块失败后的重试次数，超过后放弃实时上传 (录音结束后改为整段上传)
+LIVE_RETRIES = 5
+
+
+class LiveUploader:
+    """
+    [新增] 录音过程中把音频分块压缩后推送到服务器的实时会话 (/live/sessions)。
+    - push() 由录音线程的 on_frame 回调调用，只做拼接，不阻塞录音
+    - 发送线程按顺序编码并上传，每块带上服务器已接收的偏移量；
+      失败时按服务器返回的偏移量判断该块是否已经送达，未送达则重发
+    - 连续失败超过 LIVE_RETRIES 次后标记 failed，调用方改用录音文件整段上传
+    """
+    def __init__(self, api, task_id, sr=16000, chunk_sec=LIVE_CHUNK_SEC, codec=UPLOAD_CODEC):
+        self.api = api
+        self.task_id = task_id
+        self.sr = sr
+        self.codec = codec
+        self.chunk_bytes = int(chunk_sec * sr) * 2
+        self.offset = 0             # 服务器已接收的 PCM 字节数
+        self.sent_bytes = 0         # 已发送的压缩字节数
+        self.failed = False
+        self._pending = bytearray()
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._send_loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def push(self, frame):
+        """录音线程回调：攒够一个块后交给发送线程"""
+        if self.failed:
+            return
+        self._pending += frame
+        if len(self._pending) >= self.chunk_bytes:
+            self._queue.put(bytes(self._pending))
+            self._pending = bytearray()
+
+    def _send_loop(self):
+        while True:
+            pcm = self._queue.get()
+            if pcm is None:
+                return
+            if not self.failed and not self._send(pcm):
+                self.failed = True
+                print(f"[Live] Streaming upload gave up at offset {self.offset}")
+
+    def _send(self, pcm):
+        data, content_type = encode_chunk(pcm, self.sr, self.codec)
+        for attempt in range(LIVE_RETRIES + 1):
+            status, server_offset = self.api.push_live_chunk(self.task_id, self.offset, data, content_type)
+            if status == 200:
+                self.offset = server_offset
+                self.sent_bytes += len(data)
+                return True
+            if status == 409 and server_offset is not None and server_offset > self.offset:
+                # 上一次请求其实已经送达 (响应丢失)，按服务器的偏移量继续
+                self.offset = server_offset
+                return True
+            if status is not None and status != 409 and status < 500:
+                print(f"[Live] Chunk rejected ({status})")
+                return False
+            time.sleep(min(2 ** attempt, 10))
+        return False
+
+    def close(self, timeout=60):
+        """
+        录音结束：发送最后不足一块的部分，等待发送队列清空
+        :return: 全部音频是否都已送达
+        """
+        if self._pending and not self.failed:
+            self._queue.put(bytes(self._pending))
+            self._pending = bytearray()
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return not self.failed and not (self._thread and self._thread.is_alive())
@@ -0,0 +1,192 @@
+import os
+import glob
+import struct
+import threading
+
+# 录音内存环形缓冲区的容量 (秒)，与会议时长无关
+RECORDER_BUFFER_SEC = float(os.environ.get("IMA_RECORDER_BUFFER_SEC", "10"))
+# 缓冲区积累到该时长 (秒) 就写入磁盘并 fsync，崩溃时最多丢失这么长的录音
+RECORDER_FLUSH_SEC = float(os.environ.get("IMA_RECORDER_FLUSH_SEC", "2"))
+# 录音进行中的文件后缀，正常结束时补写文件头并去掉
+PART_SUFFIX = ".part"
+WAV_HEADER_BYTES = 44
+
+
+def wav_header(sr, channels=1, sampwidth=2, data_bytes=0):
+    """标准 44 字节 PCM wav 文件头"""
+    block_align = channels * sampwidth
+    return struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + data_bytes, b"WAVE", b"fmt ", 16, 1, channels,
+                       sr, sr * block_align, block_align, sampwidth * 8, b"data", data_bytes)
+
+
+def patch_wav_header(f, data_bytes):
+    """按实际数据长度补写 RIFF 与 data 块的长度字段"""
+    f.seek(4)
+    f.write(struct.pack("<I", 36 + data_bytes))
+    f.seek(40)
+    f.write(struct.pack("<I", data_bytes))
+
+
+def recover_wav(path):
+    """
+    [新增] 修复未正常关闭的 wav (崩溃时文件头中的长度仍为 0)：按文件大小补写文件头，
+    末尾不完整的采样帧截掉。适用于 44 字节文件头的 PCM wav
+    :return: 修复后的数据字节数
+    """
+    with open(path, "r+b") as f:
+        head = f.read(WAV_HEADER_BYTES)
+        if len(head) < WAV_HEADER_BYTES or head[:4] != b"RIFF" or head[36:40] != b"data":
+            raise ValueError(f"Not a recoverable PCM wav: {path}")
+        block_align = struct.unpack("<H", head[32:34])[0] or 1
+        data_bytes = os.path.getsize(path) - WAV_HEADER_BYTES
+        data_bytes -= data_bytes % block_align
+        f.truncate(WAV_HEADER_BYTES + data_bytes)
+        patch_wav_header(f, data_bytes)
+    return data_bytes
+
+
+def recover_recordings(directory):
+    """
+    [新增] 找回目录下因崩溃 / 断电遗留的 .wav.part 录音：补写文件头后改名为 .wav
+    :return: 找回的文件路径列表
+    """
+    recovered = []
+    for part in glob.glob(os.path.join(directory, f"*.wav{PART_SUFFIX}")):
+        try:
+            if recover_wav(part) == 0:
+                os.remove(part)
+                continue
+            target = part[:-len(PART_SUFFIX)]
+            os.replace(part, target)
+            recovered.append(target)
+        except (OSError, ValueError) as e:
+            print(f"[Recorder] Could not recover {part}: {e}")
+    return recovered
+
+
+class RingBuffer:
+    """预分配的字节环形缓冲区：一个线程写入，另一个线程按 peek / consume 读出"""
+    def __init__(self, capacity):
+        self._buf = bytearray(capacity)
+        self.capacity = capacity
+        self._head = 0      # 读位置
+        self.size = 0       # 已写入未读出的字节数
+
+    @property
+    def free(self):
+        return self.capacity - self.size
+
+    def write(self, data):
+        n = len(data)
+        if n > self.free:
+            raise BufferError("Ring buffer overflow")
+        tail = (self._head + self.size) % self.capacity
+        first = min(n, self.capacity - tail)
+        self._buf[tail:tail + first] = data[:first]
+        if first < n:
+            self._buf[:n - first] = data[first:]
+        self.size += n
+
+    def peek(self):
+        """:return: 已写入部分的内存视图 (绕回时为两段)，不复制"""
+        view = memoryview(self._buf)
+        end = self._head + self.size
+        if end <= self.capacity:
+            return [view[self._head:end]]
+        return [view[self._head:], view[:end - self.capacity]]
+
+    def consume(self, n):
+        self._head = (self._head + n) % self.capacity
+        self.size -= n
+
+
+class SpillingWavWriter:
+    """
+    [新增] 内存占用固定的录音写入器：
+    - 录音线程把帧写入预分配的环形缓冲区 (容量 buffer_sec)，不再整场会议保存在列表里
+    - 后台线程每积累 flush_sec 就追加写入 <path>.part 并 fsync，文件头长度先写 0
+    - close() 写完剩余数据、补写文件头并改名为 path；崩溃遗留的 .part 用 recover_recordings 找回
+    磁盘写入跟不上时录音线程短暂等待 (背压)，不丢帧。
+    """
+    def __init__(self, path, sr, channels=1, sampwidth=2,
+                 buffer_sec=RECORDER_BUFFER_SEC, flush_sec=RECORDER_FLUSH_SEC):
+        self.path = path
+        self.part_path = path + PART_SUFFIX
+        self.sr, self.channels, self.sampwidth = sr, channels, sampwidth
+        bytes_per_sec = sr * channels * sampwidth
+        self.flush_bytes = max(1, int(flush_sec * bytes_per_sec))
+        self.flush_sec = flush_sec
+        self.ring = RingBuffer(max(int(buffer_sec * bytes_per_sec), self.flush_bytes * 2))
+        self.data_bytes = 0
+        self.overflow_waits = 0
+        self._closing = False
+        self._error = None
+        self._cond = threading.Condition()
+
+        self._f = open(self.part_path, "wb")
+        self._f.write(wav_header(sr, channels, sampwidth, 0))
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def write(self, data):
+        with self._cond:
+            while self.ring.free < len(data):
+                if self._error is not None:
+                    raise self._error
+                self.overflow_waits += 1
+                self._cond.notify_all()
+                self._cond.wait(0.1)
+            self.ring.write(data)
+            if self.ring.size >= self.flush_bytes:
+                self._cond.notify_all()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closing or self.ring.size >= self.flush_bytes, timeout=self.flush_sec)
+                views, closing = self.ring.peek(), self._closing
+            # 写入的是已填充区域，录音线程只会写空闲区域，可以在锁外进行磁盘 IO
+            n = sum(len(v) for v in views)
+            try:
+                if n:
+                    for v in views:
+                        self._f.write(v)
+                    self._f.flush()
+                    os.fsync(self._f.fileno())
+            except OSError as e:
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                print(f"[Recorder] Spill to disk failed: {e}")
+                return
+            finally:
+                del views
+            with self._cond:
+                self.ring.consume(n)
+                self.data_bytes += n
+                self._cond.notify_all()
+                if closing and self.ring.size == 0:
+                    return
+
+    @property
+    def duration(self):
+        return (self.data_bytes + self.ring.size) / (self.sr * self.channels * self.sampwidth)
+
+    def close(self):
+        """
+        写完剩余数据并补写文件头
+        :return: 最终文件路径；没有录到任何数据时删除文件并返回 None
+        """
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join()
+        patch_wav_header(self._f, self.data_bytes)
+        self._f.close()
+        if self._error is not None:
+            raise self._error
+        if self.data_bytes == 0:
+            os.remove(self.part_path)
+            return None
+        os.replace(self.part_path, self.path)
+        return self.path
@@ -0,0 +1,103 @@
+import zlib
+import hashlib
+
+# zlib 压缩级别：转写/摘要为纯文本，6 级在速度和压缩率之间较均衡
+ARTIFACT_COMPRESS_LEVEL = 6
+
+BLOB_INSERT_SQL = "INSERT OR IGNORE INTO artifact_blobs (digest, size, data) VALUES (?, ?, ?)"
+INDEX_INSERT_SQL = "INSERT OR REPLACE INTO task_artifacts (task_id, kind, digest, size, media_type) VALUES (?, ?, ?, ?, ?)"
+
+
+class ArtifactStore:
+    """
+    [新增] 任务结果 (转写全文、摘要等大文本) 的内容存储，与 tasks 元数据行分离：
+    - artifact_blobs: 按 sha256 内容寻址的 zlib 压缩块，相同内容只存一份
+    - task_artifacts: (task_id, kind) -> digest 的小索引行，附带原始大小与类型
+    状态轮询和历史列表只读 tasks 表，结果文本通过 /tasks/{id}/artifacts/{kind} 按需获取。
+    """
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def create_schema(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS artifact_blobs (
+                digest TEXT PRIMARY KEY,
+                size INTEGER,
+                data BLOB
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS task_artifacts (
+                task_id TEXT,
+                kind TEXT,
+                digest TEXT,
+                size INTEGER,
+                media_type TEXT,
+                PRIMARY KEY (task_id, kind)
+            )
+        ''')
+
+    @staticmethod
+    def _encode(content):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        return content, hashlib.sha256(content).hexdigest()
+
+    @staticmethod
+    def rows(task_id, kind, content, media_type="text/plain; charset=utf-8"):
+        """:return: (内容块行, 索引行)，供批量写入"""
+        raw, digest = ArtifactStore._encode(content)
+        return ((digest, len(raw), zlib.compress(raw, ARTIFACT_COMPRESS_LEVEL)),
+                (task_id, kind, digest, len(raw), media_type))
+
+    @staticmethod
+    def put_rows_with(conn, rows):
+        """[修改] 在调用方的连接/事务内批量写入 rows() 生成的行 (建表迁移时使用)"""
+        rows = list(rows)
+        conn.executemany(BLOB_INSERT_SQL, [blob for blob, _ in rows])
+        conn.executemany(INDEX_INSERT_SQL, [index for _, index in rows])
+
+    def put(self, task_id, artifacts):
+        """
+        写入一个任务的多个结果 (单个事务，每张表一次 executemany)
+        :param artifacts: {kind: str/bytes 或 (content, media_type)}
+        """
+        rows = [self.rows(task_id, kind, *(content if isinstance(content, tuple) else (content,)))
+                for kind, content in artifacts.items()]
+        with self.db.transaction():
+            self.db.executemany(BLOB_INSERT_SQL, [blob for blob, _ in rows])
+            self.db.executemany(INDEX_INSERT_SQL, [index for _, index in rows])
+
+    def list(self, task_id):
+        """:return: {kind: {"size", "digest", "media_type"}}，只读索引行，不触及内容块"""
+        rows = self.db.query("SELECT kind, size, digest, media_type FROM task_artifacts WHERE task_id=?", (task_id,))
+        return {r[0]: {"size": r[1], "digest": r[2], "media_type": r[3]} for r in rows}
+
+    def meta(self, task_id, kind):
+        row = self.db.query_one("SELECT size, digest, media_type FROM task_artifacts WHERE task_id=? AND kind=?",
+                                (task_id, kind))
+        if row:
+            return {"size": row[0], "digest": row[1], "media_type": row[2]}
+        return None
+
+    def read(self, digest, start=0, end=None):
+        """
+        读取内容块中 [start, end] (含 end) 的原始字节；end 为 None 时读到末尾。
+        流式解压，只解压到 end 为止，读取开头片段时不必解压整个块。
+        """
+        row = self.db.query_one("SELECT data FROM artifact_blobs WHERE digest=?", (digest,))
+        if row is None:
+            return None
+        d = zlib.decompressobj()
+        if end is None:
+            raw = d.decompress(row[0]) + d.flush()
+            return raw[start:]
+        raw = d.decompress(row[0], end + 1)
+        return raw[start:end + 1]
+
+    def read_text(self, task_id, kind, default=None):
+        meta = self.meta(task_id, kind)
+        if meta is None:
+            return default
+        return self.read(meta["digest"]).decode("utf-8")
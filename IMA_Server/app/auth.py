@@ -1,6 +1,4 @@
-import sqlite3
 import datetime
-import os
 from typing import Optional
 from fastapi import HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -8,6 +6,8 @@ from passlib.context import CryptContext
 from jose import jwt, JWTError
 from pydantic import BaseModel
 
+from utilities.database import get_database
+
 # === 配置 ===
 SECRET_KEY = "CHANGE_THIS_TO_A_SUPER_SECRET_KEY"
 ALGORITHM = "HS256"
@@ -30,13 +30,12 @@ class UserInDB(User):
 class UserDB:
     def __init__(self, db_path="resource/users.db"):
         self.db_path = db_path
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        self._init_db()
+        # [优化] 共享的线程本地 WAL 连接，建表只在启动时执行一次
+        self.db = get_database(db_path)
+        self.db.init_schema("users", self._init_db)
 
-    def _init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+    def _init_db(self, conn):
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 username TEXT UNIQUE NOT NULL,
@@ -46,23 +45,16 @@ class UserDB:
             )
         ''')
         
-        cursor.execute("SELECT id FROM users WHERE username='admin'")
-        if not cursor.fetchone():
+        if not conn.execute("SELECT id FROM users WHERE username='admin'").fetchone():
             print("[UserDB] Creating default admin account...")
             hashed = pwd_context.hash("123456")
-            cursor.execute(
+            conn.execute(
                 "INSERT INTO users (username, password_hash, role, created_at) VALUES (?, ?, ?, ?)",
                 ("admin", hashed, "admin", datetime.datetime.now().isoformat())
             )
-        conn.commit()
-        conn.close()
 
     def get_user(self, username: str) -> Optional[UserInDB]:
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, username, password_hash, role FROM users WHERE username=?", (username,))
-        row = cursor.fetchone()
-        conn.close()
+        row = self.db.query_one("SELECT id, username, password_hash, role FROM users WHERE username=?", (username,))
         if row:
             return UserInDB(id=row[0], username=row[1], password_hash=row[2], role=row[3])
         return None
@@ -73,14 +65,10 @@ class UserDB:
         
         hashed = pwd_context.hash(password)
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
+            self.db.execute(
                 "INSERT INTO users (username, password_hash, role, created_at) VALUES (?, ?, ?, ?)",
                 (username, hashed, role, datetime.datetime.now().isoformat())
             )
-            conn.commit()
-            conn.close()
             return True, "User created successfully"
         except Exception as e:
             return False, str(e)
@@ -89,11 +77,7 @@ class UserDB:
     
     def get_all_users(self):
         """获取所有用户列表 (仅返回安全字段)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT username, role, created_at FROM users")
-        rows = cursor.fetchall()
-        conn.close()
+        rows = self.db.query("SELECT username, role, created_at FROM users")
         return [{"username": r[0], "role": r[1], "created_at": r[2]} for r in rows]
 
     def delete_user(self, username):
@@ -101,12 +85,7 @@ class UserDB:
         if username == "admin":
             return False, "Cannot delete super admin."
             
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM users WHERE username=?", (username,))
-        deleted = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
+        deleted = self.db.execute("DELETE FROM users WHERE username=?", (username,)).rowcount > 0
         
         if deleted: return True, f"User {username} deleted."
         return False, "User not found."
@@ -114,12 +93,7 @@ class UserDB:
     def update_password(self, username, new_password):
         """更新密码 (直接覆盖，用于管理员重置或用户修改)"""
         hashed = pwd_context.hash(new_password)
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("UPDATE users SET password_hash=? WHERE username=?", (hashed, username))
-        updated = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
+        updated = self.db.execute("UPDATE users SET password_hash=? WHERE username=?", (hashed, username)).rowcount > 0
         
         if updated: return True, "Password updated."
         return False, "User not found."
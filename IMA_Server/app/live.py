@@ -0,0 +1,353 @@
+import os
+import time
+import datetime
+import threading
+import numpy as np
+from fastapi import HTTPException
+
+from utilities.database import get_database
+from utilities.ASR.model_pool import GLOBAL_WHISPER_POOL
+from utilities.audio_processor.audio_codec import decode_chunk, mime_format
+from utilities.audio_processor.wav_spill import SpillingWavWriter, recover_wav, PART_SUFFIX
+from core.streaming import StreamingPipeline
+from core.audio_buffer import CANONICAL_SR
+from core.cancellation import CancellationToken, TaskCancelled
+from core.processors import LLMProcessor
+from app.task_manager import TaskManager, DB_PATH
+from app.uploads import UPLOAD_DIR
+
+# 实时会议的录音目录
+LIVE_DIR = os.path.join(UPLOAD_DIR, "live")
+# 客户端推送的音频格式：16 kHz 单声道 PCM16 小端，或自包含的 FLAC / Ogg Opus / wav 小文件 (任意采样率)
+LIVE_FRAME_MS = 30
+LIVE_CHUNK_FORMATS = ("pcm_s16le", "flac", "opus", "wav")
+# 超过该时长 (秒) 没有收到音频的会话视为客户端已断开，按已收到的部分自动结束
+LIVE_IDLE_TIMEOUT_SEC = float(os.environ.get("IMA_LIVE_IDLE_TIMEOUT_SEC", "300"))
+# [新增] 空闲会话的巡检间隔 (秒)，以及结束时等待最后几句转写的上限 (秒)
+LIVE_SWEEP_INTERVAL_SEC = 30.0
+LIVE_CLOSE_TIMEOUT_SEC = 120.0
+# [新增] 实时会话在 API 进程内运行模型，不经过调度器：限制全局与单个用户同时进行的会话数
+LIVE_MAX_SESSIONS = int(os.environ.get("IMA_LIVE_MAX_SESSIONS", "4"))
+LIVE_MAX_SESSIONS_PER_USER = int(os.environ.get("IMA_LIVE_MAX_SESSIONS_PER_USER", "1"))
+
+
+class LiveSession:
+    """一个进行中的实时会议：边接收音频边写入 wav，同时送入 StreamingPipeline"""
+    def __init__(self, task_id, user_id, audio_path, config, speaker_engine=None):
+        self.task_id = task_id
+        self.user_id = user_id
+        self.audio_path = audio_path
+        self.config = config
+        self.offset = 0             # 已接收的字节数，客户端重试时据此去重
+        self.finishing = False
+        self.last_seen = time.time()
+        self.lock = threading.Lock()
+        self.token = CancellationToken(probe=lambda: TaskManager.is_cancelled(task_id))
+
+        # [修改] 配置键与默认值与 /tasks/create 的流水线配置一致
+        self.asr = GLOBAL_WHISPER_POOL.acquire(config.get("asr_model", "small")) if config.get("enable_asr", False) else None
+        self.wav = None
+        try:
+            # [修改] 与录音器相同的环形缓冲区写入器：定期 fsync，服务崩溃后录音可以找回
+            self.wav = SpillingWavWriter(audio_path, CANONICAL_SR)
+            self.pipeline = StreamingPipeline(
+                vad_agg=config.get("vad_agg", 3),
+                speaker_engine=speaker_engine if config.get("enable_spk", False) else None,
+                asr_engine=self.asr,
+                enhance=config.get("enable_enhancer", False),
+                on_line=lambda line, seg: TaskManager.mem_update_log(task_id, line, is_result=True)
+            ).start()
+        except Exception:
+            # [修复] 构造失败时归还模型引用 (否则模型永远无法被回收) 并删除空录音
+            if self.wav is not None:
+                self.wav.close()
+            if self.asr is not None:
+                GLOBAL_WHISPER_POOL.release(self.asr)
+                self.asr = None
+            raise
+
+    def append(self, data):
+        self.wav.write(data)
+        self.pipeline.push(data)
+        self.offset += len(data)
+        self.last_seen = time.time()
+
+    def close(self):
+        """结束输入：处理最后一句、等待在途转写，关闭 wav (补写文件头)"""
+        try:
+            return self.pipeline.close(timeout=LIVE_CLOSE_TIMEOUT_SEC)
+        finally:
+            self.wav.close()
+            if self.asr is not None:
+                GLOBAL_WHISPER_POOL.release(self.asr)
+                self.asr = None
+
+
+class LiveSessionManager:
+    """
+    [新增] 实时会议会话：客户端在录音过程中持续推送音频块 (PCM16 或压缩的 FLAC / Opus)，
+    服务器追加到会话录音并边收边做降噪、VAD 断句、说话人标注与转写，分段结果作为 transcript 事件经 /tasks/{id}/events 推送给客户端。
+    会议结束时只需处理最后一句和摘要，不再重新跑整条流水线。
+    - 会话对应一个普通任务 (task_id)，结束后同样出现在历史记录中
+    - 会话元数据记录在 tasks.db 的 live_sessions 表，服务重启后遗留的会话标记为 failed
+    """
+    _lock = threading.Lock()
+    _sessions = {}      # task_id -> LiveSession
+    _starting = {}      # user_id -> 正在创建的会话数 (计入并发上限)
+
+    @staticmethod
+    def _db():
+        db = get_database(DB_PATH)
+        db.init_schema("live_sessions", LiveSessionManager._create_schema)
+        return db
+
+    @staticmethod
+    def _create_schema(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS live_sessions (
+                task_id TEXT PRIMARY KEY,
+                user_id INTEGER,
+                audio_path TEXT,
+                created_at REAL
+            )
+        ''')
+
+    @staticmethod
+    def _reserve(user_id):
+        """
+        [新增] 占用一个会话名额：全局超过 LIVE_MAX_SESSIONS 返回 503，单个用户超过上限返回 429
+        (客户端收到非 200 时改为录音结束后整段上传，走调度器排队)
+        """
+        with LiveSessionManager._lock:
+            sessions = list(LiveSessionManager._sessions.values())
+            total = len(sessions) + sum(LiveSessionManager._starting.values())
+            mine = sum(1 for s in sessions if s.user_id == user_id) + LiveSessionManager._starting.get(user_id, 0)
+            if total >= LIVE_MAX_SESSIONS:
+                raise HTTPException(status_code=503, detail="Too many live sessions, try again later")
+            if mine >= LIVE_MAX_SESSIONS_PER_USER:
+                raise HTTPException(status_code=429, detail=f"At most {LIVE_MAX_SESSIONS_PER_USER} live session(s) per user")
+            LiveSessionManager._starting[user_id] = LiveSessionManager._starting.get(user_id, 0) + 1
+
+    @staticmethod
+    def _unreserve(user_id):
+        with LiveSessionManager._lock:
+            n = LiveSessionManager._starting.get(user_id, 0) - 1
+            if n > 0:
+                LiveSessionManager._starting[user_id] = n
+            else:
+                LiveSessionManager._starting.pop(user_id, None)
+
+    @staticmethod
+    def create(user_id, config, speaker_engine=None):
+        LiveSessionManager.cleanup_idle()
+        LiveSessionManager._reserve(user_id)
+        try:
+            os.makedirs(LIVE_DIR, exist_ok=True)
+            file_name = f"live_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.wav"
+            audio_path = os.path.join(LIVE_DIR, f"{int(time.time() * 1000)}_{user_id}_{file_name}")
+            task_id = TaskManager.create_task(user_id, file_name, audio_path)
+            TaskManager.init_mem_task(task_id)
+
+            try:
+                session = LiveSession(task_id, user_id, audio_path, config, speaker_engine)
+            except Exception as e:
+                # [修复] 已入库的任务不能停留在 processing
+                print(f"[Live] Session {task_id} could not start: {e}")
+                TaskManager.update_status(task_id, "failed")
+                TaskManager.mem_update_log(task_id, f"Error: {e}")
+                TaskManager.mem_cleanup(task_id)
+                raise HTTPException(status_code=500, detail=f"Could not start live session: {e}")
+            with LiveSessionManager._lock:
+                LiveSessionManager._sessions[task_id] = session
+        finally:
+            LiveSessionManager._unreserve(user_id)
+        LiveSessionManager._db().execute(
+            "INSERT INTO live_sessions (task_id, user_id, audio_path, created_at) VALUES (?, ?, ?, ?)",
+            (task_id, user_id, audio_path, time.time()))
+        TaskManager.mem_update_log(task_id, ">>> Live Session Started")
+        print(f"[Live] Session {task_id} started for user {user_id}")
+        return {"task_id": task_id, "sample_rate": CANONICAL_SR, "frame_ms": LIVE_FRAME_MS,
+                "format": "pcm_s16le", "formats": LIVE_CHUNK_FORMATS, "offset": 0}
+
+    @staticmethod
+    def get(task_id, user_id):
+        with LiveSessionManager._lock:
+            session = LiveSessionManager._sessions.get(task_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Live session not found")
+        if session.user_id != user_id:
+            raise HTTPException(status_code=403, detail="Permission denied")
+        return session
+
+    @staticmethod
+    def decode(data, content_type):
+        """
+        [新增] 把推送的音频块统一为 16 kHz PCM16 字节；audio/flac、audio/ogg、audio/wav 为自包含的小文件
+        (解码并重采样)，其余按 16 kHz 原始 PCM16 处理
+        """
+        fmt = mime_format(content_type)
+        if fmt not in ("flac", "opus", "wav"):
+            if len(data) % 2:
+                raise HTTPException(status_code=400, detail="PCM16 chunk must contain whole samples")
+            return data
+        try:
+            samples = decode_chunk(data, CANONICAL_SR)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Unsupported or corrupt audio chunk: {e}")
+        return (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+    @staticmethod
+    def append(task_id, user_id, offset, data, content_type=None):
+        """
+        追加一块音频。offset 为该块之前已接收的 PCM 字节数 (压缩块按解码后的长度计)，
+        不一致时返回 409 (附带正确的偏移量)；重发已接收过的块不会重复处理。
+        :return: 追加后的偏移量
+        """
+        session = LiveSessionManager.get(task_id, user_id)
+        data = LiveSessionManager.decode(data, content_type)
+        with session.lock:
+            if session.finishing:
+                raise HTTPException(status_code=409, detail="Live session is finishing")
+            if session.token.cancelled:
+                LiveSessionManager._finish(session, "cancelled")
+                raise HTTPException(status_code=409, detail="Task cancelled")
+            if offset != session.offset:
+                raise HTTPException(status_code=409, detail=f"Offset mismatch, expected {session.offset}",
+                                    headers={"Upload-Offset": str(session.offset)})
+            try:
+                session.append(data)
+            except Exception as e:
+                # [修复] 处理线程或录音写入已失败：结束会话 (任务记为 failed)，客户端收到 5xx 后改为整段上传
+                print(f"[Live] Session {task_id} append failed: {e}")
+                session.finishing = True
+                threading.Thread(target=LiveSessionManager._finish, args=(session, "failed"), daemon=True).start()
+                raise HTTPException(status_code=500, detail=f"Live processing failed: {e}")
+            return session.offset
+
+    @staticmethod
+    def finish(task_id, user_id):
+        """停止接收音频，后台完成收尾 (最后一句 + 可选的摘要)，客户端继续通过事件流等待最终状态"""
+        session = LiveSessionManager.get(task_id, user_id)
+        with session.lock:
+            if session.finishing:
+                raise HTTPException(status_code=409, detail="Live session is already finishing")
+            session.finishing = True
+        TaskManager.mem_update_log(task_id, f"[Live] Stopped after {session.pipeline.duration:.1f}s, finalizing...")
+        threading.Thread(target=LiveSessionManager._finish, args=(session, "completed"), daemon=True).start()
+        return {"task_id": task_id, "state": "finalizing", "offset": session.offset}
+
+    @staticmethod
+    def cancel(task_id):
+        """
+        [新增] 取消接口调用 (任务状态已置为 cancelled)：若是进行中的实时会话则立即停止
+        :return: 是否为实时会话
+        """
+        with LiveSessionManager._lock:
+            session = LiveSessionManager._sessions.get(task_id)
+        if session is None:
+            return False
+        # [修复] 会话已在收尾时同样生效：令牌立即置位，收尾线程跳过摘要，且不会再把任务写成 completed
+        session.token.cancel()
+        with session.lock:
+            if not session.finishing:
+                session.finishing = True
+                threading.Thread(target=LiveSessionManager._finish, args=(session, "cancelled"), daemon=True).start()
+        return True
+
+    @staticmethod
+    def _finish(session, status):
+        task_id = session.task_id
+        session.finishing = True
+        try:
+            segments = session.close()
+            # [修复] 收尾 (最后一句、LLM 摘要) 可能持续数十秒，每一步之后重新检查取消；
+            # 最终以条件更新为准，期间被取消的任务保持 cancelled，结果不落库
+            if status == "completed" and not session.token.cancelled:
+                transcript = session.pipeline.transcript()
+                summary = LiveSessionManager._summarize(session, transcript)
+                session.token.raise_if_cancelled()
+                if TaskManager.update_status(task_id, "completed", transcript, summary):
+                    TaskManager.mem_update_log(task_id, f">>> Live Session Finished ({len(segments)} segment(s))")
+            else:
+                TaskManager.update_status(task_id, "cancelled" if session.token.cancelled else status)
+        except TaskCancelled:
+            TaskManager.update_status(task_id, "cancelled")
+        except Exception as e:
+            print(f"[Live] Session {task_id} failed: {e}")
+            TaskManager.update_status(task_id, "failed")
+        finally:
+            status = TaskManager.get_status(task_id) or status
+            with LiveSessionManager._lock:
+                LiveSessionManager._sessions.pop(task_id, None)
+            LiveSessionManager._db().execute("DELETE FROM live_sessions WHERE task_id=?", (task_id,))
+            TaskManager.mem_cleanup(task_id)
+            print(f"[Live] Session {task_id} {status}")
+
+    @staticmethod
+    def _summarize(session, transcript):
+        """与离线流水线相同：转写保存为会议日志后交给 LLM 生成摘要"""
+        if not session.config.get("enable_llm", False):
+            return None
+        log_dir = os.path.join(UPLOAD_DIR, "meeting_logs")
+        os.makedirs(log_dir, exist_ok=True)
+        log_path = os.path.join(log_dir, f"Log_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+        with open(log_path, "w", encoding="utf-8") as f:
+            f.write(transcript)
+
+        def log_cb(msg, is_result=False):
+            TaskManager.mem_update_log(session.task_id, msg, is_result)
+
+        context = {"log_path": log_path}
+        LLMProcessor().process(context, {"enable": True, "backend": session.config.get("llm_backend", "Online")}, log_cb,
+                               session.token)
+        return context.get("summary")
+
+    @staticmethod
+    def cleanup_idle():
+        """结束超过 LIVE_IDLE_TIMEOUT_SEC 没有新音频的会话 (保留已转写的内容)"""
+        cutoff = time.time() - LIVE_IDLE_TIMEOUT_SEC
+        with LiveSessionManager._lock:
+            idle = [s for s in LiveSessionManager._sessions.values() if not s.finishing and s.last_seen < cutoff]
+        for session in idle:
+            # [修复] 与 finish() / cancel() 相同，在会话锁内检查并置位，避免同一会话启动两个收尾线程
+            with session.lock:
+                if session.finishing or session.last_seen >= cutoff:
+                    continue
+                session.finishing = True
+            print(f"[Live] Session {session.task_id} idle for {LIVE_IDLE_TIMEOUT_SEC:.0f}s, finishing")
+            TaskManager.mem_update_log(session.task_id, "[Live] No audio received, finishing with what was recorded.")
+            threading.Thread(target=LiveSessionManager._finish, args=(session, "completed"), daemon=True).start()
+
+    @staticmethod
+    def start_sweeper():
+        """[新增] 服务启动时调用：后台定期结束空闲会话，被遗弃的会话及时释放名额和模型引用"""
+        def sweep():
+            while True:
+                time.sleep(LIVE_SWEEP_INTERVAL_SEC)
+                try:
+                    LiveSessionManager.cleanup_idle()
+                except Exception as e:
+                    print(f"[Live] Idle sweep failed: {e}")
+        threading.Thread(target=sweep, name="live-sweeper", daemon=True).start()
+
+    @staticmethod
+    def fail_orphans():
+        """
+        服务启动时调用：上次退出时仍在进行的实时会话已无法继续，任务标记为 failed；
+        [修改] 已落盘的录音补写文件头后保留，仍可在历史记录中下载
+        """
+        db = LiveSessionManager._db()
+        rows = db.query("SELECT task_id, audio_path FROM live_sessions")
+        for task_id, audio_path in rows:
+            part = audio_path + PART_SUFFIX
+            if os.path.exists(part):
+                try:
+                    recover_wav(part)
+                    os.replace(part, audio_path)
+                    print(f"[Live] Recovered {os.path.basename(audio_path)}")
+                except (OSError, ValueError) as e:
+                    print(f"[Live] Could not recover {part}: {e}")
+            TaskManager.update_status(task_id, "failed")
+        db.execute("DELETE FROM live_sessions")
+        if rows:
+            print(f"[Live] Marked {len(rows)} interrupted live session(s) as failed")
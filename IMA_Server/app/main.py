@@ -1,10 +1,10 @@
 import os
 import sys
 import json
-import traceback
 import uuid
-from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse, FileResponse
+import asyncio
+from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
@@ -14,8 +14,14 @@ sys.path.append(BASE_DIR)
 
 # 导入业务组件
 from utilities.diarization.engine import SpeakerEngine
-from core.processors import EnhancerProcessor, VADProcessor, SpeakerIDProcessor, ASRProcessor, LLMProcessor
-from app.task_manager import TaskManager
+from utilities.ASR.model_pool import GLOBAL_WHISPER_POOL
+from utilities.model_lifecycle import lifecycle_metrics
+from utilities.audio_processor.enhance_cache import GLOBAL_ENHANCE_CACHE
+from app.task_manager import TaskManager, HISTORY_PAGE_SIZE
+from app.scheduler import GLOBAL_SCHEDULER
+from app.uploads import UploadManager, save_upload, reject_oversized, ingest_audio
+from app.live import LiveSessionManager
+from utilities.audio_processor.audio_codec import FORMATS, negotiate, get_representation
 
 # 导入鉴权组件
 from app.auth import (
@@ -42,6 +48,17 @@ print(">>> [Server] Initializing AI Engines...")
 GLOBAL_SPEAKER_ENGINE = SpeakerEngine()
 print(">>> [Server] AI Engines Ready.")
 
+# --- 流水线调度器 (独立 worker 进程执行会议任务) ---
+@app.on_event("startup")
+def start_scheduler():
+    GLOBAL_SCHEDULER.start()
+    LiveSessionManager.fail_orphans()
+    LiveSessionManager.start_sweeper()
+
+@app.on_event("shutdown")
+def stop_scheduler():
+    GLOBAL_SCHEDULER.shutdown()
+
 # --- 3. 请求模型定义 ---
 class AuthRequest(BaseModel):
     username: str
@@ -164,15 +181,17 @@ async def get_speakers(user: User = Depends(get_current_user)):
 
 @app.post("/speakers/register")
 async def register_speaker_endpoint(
+    request: Request,
     name: str = Form(...),
     title: str = Form(...),
     file: UploadFile = File(...),
     user: User = Depends(require_admin)
 ):
     """注册声纹 (仅管理员)"""
-    temp_path = os.path.join(UPLOAD_DIR, f"temp_reg_{file.filename}")
-    with open(temp_path, "wb") as f:
-        f.write(await file.read())
+    reject_oversized(request)
+    temp_path = os.path.join(UPLOAD_DIR, f"temp_reg_{uuid.uuid4().hex[:8]}_{os.path.basename(file.filename)}")
+    # [优化] 分块落盘，不再整体读入内存
+    await save_upload(file, temp_path)
     
     try:
         success, msg = GLOBAL_SPEAKER_ENGINE.db.add_speaker(name, title, temp_path)
@@ -211,144 +230,284 @@ async def delete_speaker_endpoint(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# ================= 会议任务流水线 =================
+# ================= 系统监控 (Admin Only) =================
 
-def run_pipeline_background(task_id: str, audio_path: str, config: dict):
-    # 1. 初始化内存状态
-    TaskManager.init_mem_task(task_id)
-    
-    print(f"[{task_id}] 📥 Config: {json.dumps(config, indent=2)}")
-    TaskManager.mem_update_log(task_id, ">>> Pipeline Started")
-    
-    def log_callback(msg, is_result=False):
-        print(f"[{task_id}] {msg}") 
-        TaskManager.mem_update_log(task_id, msg)
+@app.get("/system/metrics")
+async def get_system_metrics(user: User = Depends(require_admin)):
+    """模型常驻情况、命中/加载耗时、加载/卸载事件与降噪缓存统计 (workers 为各流水线进程上报的数据)"""
+    return {"whisper_pool": GLOBAL_WHISPER_POOL.stats(), "models": lifecycle_metrics(),
+            "enhance_cache": GLOBAL_ENHANCE_CACHE.stats(), "workers": GLOBAL_SCHEDULER.worker_metrics()}
 
-    context = {'audio_path': audio_path}
-    
-    try:
-        # 1. Enhancer
-        if config.get("enable_enhancer", False):
-            log_callback("[Pipeline] Running Enhancer...")
-            ctx = EnhancerProcessor().process(context, {"enable": True}, log_callback)
-        else:
-            log_callback("[Pipeline] Skipped Enhancer.")
-        TaskManager.mem_update_progress(task_id, 0.2)
-        
-        # 2. VAD
-        if config.get("enable_vad", False):
-            log_callback("[Pipeline] Running VAD...")
-            ctx = VADProcessor().process(context, {"aggressiveness": config.get("vad_agg", 3)}, log_callback)
-        else:
-            log_callback("[Pipeline] Skipped VAD.")
-        TaskManager.mem_update_progress(task_id, 0.4)
-        
-        # 3. Speaker ID
-        if config.get("enable_spk", False):
-            log_callback("[Pipeline] Running Speaker ID...")
-            ctx = SpeakerIDProcessor().process(context, {"window": config.get("spk_win", 1.5), "step": 0.75}, log_callback)
-        else:
-            log_callback("[Pipeline] Skipped Speaker ID.")
-            if 'timeline' not in context: context['timeline'] = []
-        TaskManager.mem_update_progress(task_id, 0.6)
-        
-        # 4. ASR
-        if config.get("enable_asr", False):
-            log_callback("[Pipeline] Running Whisper ASR...")
-            asr_cfg = {
-                "model": config.get("asr_model", "small"),
-                "full_text_correction": config.get("full_correction", True),
-                "enhanced_audio": config.get("enhanced_audio", True)
-            }
-            resource_dir = os.path.join(BASE_DIR, "resource")
-            ctx = ASRProcessor(resource_dir).process(context, asr_cfg, log_callback)
-        else:
-            log_callback("[Pipeline] Skipped ASR.")
-        TaskManager.mem_update_progress(task_id, 0.8)
-        
-        # 5. LLM
-        if config.get("enable_llm", False):
-            if context.get('log_path'):
-                log_callback("[Pipeline] Running LLM Summary...")
-                ctx = LLMProcessor().process(context, {"enable": True, "backend": config.get("llm_backend", "Online")}, log_callback)
-            else:
-                log_callback("[Pipeline] Skipped LLM (No Transcript).")
-        
-        # === 任务完成，写入数据库持久化 ===
-        transcript = context.get('transcript', "")
-        
-        # 如果内存中没有，尝试从 Log 文件读取完整转录
-        if not transcript and context.get('log_path') and os.path.exists(context['log_path']):
-             try:
-                 with open(context['log_path'], 'r', encoding='utf-8') as f:
-                     transcript = f.read()
-             except: pass
-        
-        # [修复] 优先从 context['summary'] 获取 LLM 生成的摘要
-        summary_text = context.get('summary', "Summary not generated.")
-        
-        TaskManager.update_status(task_id, "completed", transcript, summary_text)
-        
-    except Exception as e:
-        traceback.print_exc()
-        TaskManager.update_status(task_id, "failed")
-        TaskManager.mem_update_log(task_id, f"Error: {str(e)}")
-        
-    finally:
-        # === 清理逻辑：保留原始音频，只删中间文件 ===
-        if os.path.exists(UPLOAD_DIR):
-            for filename in os.listdir(UPLOAD_DIR):
-                file_path = os.path.join(UPLOAD_DIR, filename)
-                if os.path.abspath(file_path) == os.path.abspath(audio_path):
-                    continue
-                if task_id in filename:
-                    try: os.remove(file_path)
-                    except: pass
-        
-        TaskManager.mem_cleanup(task_id)
+@app.get("/scheduler/status")
+async def get_scheduler_status(user: User = Depends(get_current_user)):
+    """队列深度、等待时间统计，以及当前用户自己的排队位置"""
+    return GLOBAL_SCHEDULER.status(user)
+
+# ================= 会议任务流水线 =================
+
+class UploadSessionRequest(BaseModel):
+    filename: str
+    size: int
+    sha256: str = None
+
+@app.post("/uploads")
+async def create_upload_session(req: UploadSessionRequest, user: User = Depends(get_current_user)):
+    """[新增] 创建可续传的分片上传会话，完成后把 upload_id 传给 /tasks/create"""
+    return UploadManager.create_session(user.id, req.filename, req.size, req.sha256)
+
+@app.get("/uploads/{upload_id}")
+async def get_upload_session(upload_id: str, user: User = Depends(get_current_user)):
+    """查询已接收的字节数 (offset)，断线后从该位置继续上传"""
+    return UploadManager.get_session(upload_id, user.id)
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, offset: int, request: Request, user: User = Depends(get_current_user)):
+    """追加一个分片 (请求体为原始字节)，offset 必须等于已接收的字节数"""
+    new_offset = await UploadManager.append(upload_id, user.id, offset, request.stream())
+    return {"upload_id": upload_id, "offset": new_offset}
+
+@app.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str, user: User = Depends(get_current_user)):
+    UploadManager.abort(upload_id, user.id)
+    return {"status": "ok"}
 
 @app.post("/tasks/create")
 async def create_task(
+    request: Request,
     config: str = Form(...),
-    file: UploadFile = File(...),
-    user: User = Depends(get_current_user),
-    background_tasks: BackgroundTasks = None
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
+    priority: int = Form(0),
+    user: User = Depends(get_current_user)
 ):
+    """音频可以直接随表单上传 (file)，也可以先通过 /uploads 分片上传后传入 upload_id"""
     print(f"User {user.username} (ID: {user.id}) creating task...")
-    safe_filename = f"task_{uuid.uuid4().hex[:8]}_{file.filename}"
+    if upload_id:
+        file_name = UploadManager.get_session(upload_id, user.id)["filename"]
+    elif file is not None:
+        reject_oversized(request)
+        file_name = os.path.basename(file.filename)
+    else:
+        raise HTTPException(status_code=400, detail="Either file or upload_id is required")
+
+    safe_filename = f"task_{uuid.uuid4().hex[:8]}_{file_name}"
     file_path = os.path.join(UPLOAD_DIR, safe_filename)
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
+    # [优化] 分块落盘并同时计算内容哈希
+    if upload_id:
+        size, digest = await asyncio.to_thread(UploadManager.finalize, upload_id, user.id, file_path)
+    else:
+        size, digest = await save_upload(file, file_path)
+
+    # 相同内容已存储过时复用原文件，删除本次的副本
+    duplicate_of = TaskManager.find_duplicate(user.id, digest)
+    existing = TaskManager.find_audio(user.id, digest)
+    if existing:
+        os.remove(file_path)
+        file_path = existing
+        print(f"Duplicate upload ({size} bytes), reusing {existing}")
+    else:
+        # [新增] 压缩上传在入库时解码一次
+        try:
+            file_path = await asyncio.to_thread(ingest_audio, file_path)
+        except Exception as e:
+            os.remove(file_path)
+            raise HTTPException(status_code=400, detail=f"Unsupported or corrupt audio: {e}")
     
-    task_id = TaskManager.create_task(user.id, file.filename, file_path)
+    task_id = TaskManager.create_task(user.id, file_name, file_path, digest)
     
     try: pipeline_config = json.loads(config)
     except: pipeline_config = {}
         
-    background_tasks.add_task(run_pipeline_background, task_id, file_path, pipeline_config)
-    return {"task_id": task_id}
+    # 普通用户不能插队，只有管理员可以提高优先级
+    if user.role != 'admin':
+        priority = min(priority, 0)
+    GLOBAL_SCHEDULER.submit(task_id, user.id, file_path, pipeline_config, priority=priority)
+    return {"task_id": task_id, "sha256": digest, "duplicate_of": duplicate_of}
+
+class LiveSessionRequest(BaseModel):
+    config: dict = {}
+
+@app.post("/live/sessions")
+async def create_live_session(req: LiveSessionRequest, user: User = Depends(get_current_user)):
+    """
+    [新增] 开始实时会议：返回 task_id 与推送格式 (16 kHz 单声道 PCM16)。
+    转写结果在录音过程中作为 transcript 事件出现在 /tasks/{task_id}/events
+    """
+    return await asyncio.to_thread(LiveSessionManager.create, user.id, req.config, GLOBAL_SPEAKER_ENGINE)
+
+@app.put("/live/sessions/{task_id}")
+async def push_live_audio(task_id: str, offset: int, request: Request, user: User = Depends(get_current_user)):
+    """
+    追加一块音频 (请求体为原始 PCM16，或 Content-Type 为 audio/flac / audio/ogg 的压缩块)，
+    offset 必须等于已接收的 PCM 字节数
+    """
+    data = await request.body()
+    new_offset = await asyncio.to_thread(LiveSessionManager.append, task_id, user.id, offset, data,
+                                         request.headers.get("content-type"))
+    return {"task_id": task_id, "offset": new_offset}
+
+@app.post("/live/sessions/{task_id}/finish")
+async def finish_live_session(task_id: str, user: User = Depends(get_current_user)):
+    """停止录音：服务器只需处理最后一句 (及摘要)，完成后事件流发送最终 state"""
+    return LiveSessionManager.finish(task_id, user.id)
 
 @app.get("/tasks/{task_id}")
-async def get_task_status(task_id: str, user: User = Depends(get_current_user)):
-    status = TaskManager.mem_get_status(task_id)
+async def get_task_status(task_id: str, since: int = None, user: User = Depends(get_current_user)):
+    """since: 日志游标 (上次返回的 cursor)，只返回之后的新日志"""
+    status = TaskManager.mem_get_status(task_id, since)
     if not status: 
         raise HTTPException(status_code=404, detail="Task not found")
     return status
 
-@app.post("/tasks/{task_id}/cancel")
-async def cancel_task_endpoint(task_id: str, user: User = Depends(get_current_user)):
-    return {"status": "ok"}
+# 推送连接无新事件时发送心跳的间隔 (秒)，防止代理断开空闲连接
+SSE_HEARTBEAT_SEC = 15.0
 
-@app.get("/history")
-async def get_history(user: User = Depends(get_current_user)):
-    return TaskManager.get_user_history(user.id)
+def _sse(event, data, seq=None):
+    head = f"id: {seq}\n" if seq is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-@app.get("/tasks/{task_id}/audio")
-async def get_task_audio(task_id: str, user: User = Depends(get_current_user)):
+@app.get("/tasks/{task_id}/events")
+async def stream_task_events(task_id: str, request: Request, since: int = 0, user: User = Depends(get_current_user)):
+    """
+    [新增] Server-Sent Events 推送：log / progress / transcript 事件按 seq 递增发送，
+    任务结束时发送一条 state 事件 (含转写与摘要) 后关闭。断线重连时用 since 或 Last-Event-ID 续传。
+    """
     task = TaskManager.get_task(task_id)
     if not task: raise HTTPException(status_code=404, detail="Task not found")
     if task['user_id'] != user.id and user.role != 'admin':
         raise HTTPException(status_code=403, detail="Permission denied")
+    last_id = request.headers.get("last-event-id")
+    if last_id and last_id.isdigit():
+        since = max(since, int(last_id))
+
+    async def event_stream():
+        # [优化] 在事件循环中等待 asyncio.Event (由产生事件的线程唤醒)，不再为每个连接占用一个线程池线程
+        cursor = since
+        wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        TaskManager.mem_watch(task_id, loop, wakeup)
+        try:
+            while True:
+                # 先清除再读取：读取之后到达的事件会重新 set，不会漏掉
+                wakeup.clear()
+                events, active = TaskManager.mem_get_events(task_id, cursor)
+                for e in events:
+                    cursor = e["seq"]
+                    yield _sse(e["type"], e["data"], e["seq"])
+                if not active:
+                    yield _sse("state", TaskManager.mem_get_status(task_id))
+                    return
+                if events:
+                    continue
+                try:
+                    await asyncio.wait_for(wakeup.wait(), SSE_HEARTBEAT_SEC)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+        finally:
+            TaskManager.mem_unwatch(task_id, loop, wakeup)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _check_task_access(task_id, user):
+    task = TaskManager.get_task(task_id)
+    if not task: raise HTTPException(status_code=404, detail="Task not found")
+    if task['user_id'] != user.id and user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Permission denied")
+    return task
+
+def _parse_range(header, size):
+    """
+    解析单段 Range 头 (bytes=a-b / bytes=a- / bytes=-n)，返回闭区间 (start, end)；
+    无 Range 头时返回 None，无法满足时抛出 416
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        raise HTTPException(status_code=416, detail="Only a single byte range is supported",
+                            headers={"Content-Range": f"bytes */{size}"})
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start, end = max(0, size - int(last)), size - 1
+    except ValueError:
+        raise HTTPException(status_code=416, detail="Invalid range", headers={"Content-Range": f"bytes */{size}"})
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+@app.get("/tasks/{task_id}/artifacts")
+async def list_task_artifacts(task_id: str, user: User = Depends(get_current_user)):
+    """[新增] 任务结果清单：{kind: {size, digest, media_type}}"""
+    _check_task_access(task_id, user)
+    return TaskManager.artifacts().list(task_id)
+
+@app.get("/tasks/{task_id}/artifacts/{kind}")
+async def get_task_artifact(task_id: str, kind: str, request: Request, user: User = Depends(get_current_user)):
+    """
+    [新增] 下载任务结果 (transcript / summary)，支持 Range 分段读取；ETag 为内容哈希
+    """
+    _check_task_access(task_id, user)
+    store = TaskManager.artifacts()
+    meta = store.meta(task_id, kind)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    etag = f'"{meta["digest"]}"'
+    headers = {"Accept-Ranges": "bytes", "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    size = meta["size"]
+    byte_range = _parse_range(request.headers.get("range"), size) if size else None
+    if byte_range is None:
+        body = store.read(meta["digest"])
+        return Response(content=body, media_type=meta["media_type"], headers=headers)
+    start, end = byte_range
+    body = store.read(meta["digest"], start, end)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(content=body, status_code=206, media_type=meta["media_type"], headers=headers)
+
+@app.post("/tasks/{task_id}/cancel")
+async def cancel_task_endpoint(task_id: str, user: User = Depends(get_current_user)):
+    task = TaskManager.get_task(task_id)
+    if not task: raise HTTPException(status_code=404, detail="Task not found")
+    if task['user_id'] != user.id and user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Permission denied")
+    if not TaskManager.request_cancel(task_id):
+        raise HTTPException(status_code=409, detail=f"Task already {task['status']}")
+    # [新增] 实时会话不在调度队列中，直接停止
+    if LiveSessionManager.cancel(task_id):
+        return {"status": "ok", "action": "stopped"}
+    return {"status": "ok", "action": GLOBAL_SCHEDULER.cancel(task_id)}
+
+@app.get("/history")
+async def get_history(cursor: str = None, limit: int = HISTORY_PAGE_SIZE,
+                      user: User = Depends(get_current_user)):
+    """[修改] 分页返回历史任务：{items, next_cursor}，把 next_cursor 作为下一次请求的 cursor"""
+    try:
+        return TaskManager.get_user_history(user.id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/tasks/{task_id}/audio")
+async def get_task_audio(task_id: str, request: Request, format: str = None, user: User = Depends(get_current_user)):
+    """
+    [修改] 下载任务录音：按 Accept 头 (audio/flac、audio/ogg、audio/wav) 或 ?format= 选择传输格式，
+    默认 wav；压缩版本首次请求时编码并缓存
+    """
+    task = _check_task_access(task_id, user)
     if not os.path.exists(task['audio_path']):
         raise HTTPException(status_code=404, detail="Audio file lost")
-    return FileResponse(task['audio_path'], media_type="audio/wav", filename=task['file_name'])
\ No newline at end of file
+    fmt = format or negotiate(request.headers.get("accept"))
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format, choose from {list(FORMATS)}")
+    path = await asyncio.to_thread(get_representation, task['audio_path'], fmt)
+    _, _, ext, media_type = FORMATS[fmt]
+    filename = os.path.splitext(task['file_name'])[0] + ext
+    return FileResponse(path, media_type=media_type, filename=filename, headers={"Vary": "Accept"})
\ No newline at end of file
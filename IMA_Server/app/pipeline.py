@@ -0,0 +1,162 @@
+import os
+import json
+import traceback
+
+from utilities.diarization.engine import SpeakerEngine
+from core.processors import EnhancerProcessor, VADProcessor, SpeakerIDProcessor, ASRProcessor, LLMProcessor
+from core.cancellation import CancellationToken, TaskCancelled
+from core.audio_buffer import get_audio
+from app.task_manager import TaskManager
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 调试用：保留各阶段的中间 wav (_clean / _vad)，默认只在内存中传递
+SAVE_INTERMEDIATE = os.environ.get("IMA_SAVE_INTERMEDIATE", "0") == "1"
+
+# 每个流水线进程各自持有一个声纹引擎 (首次使用时创建)
+_SPEAKER_ENGINE = None
+
+
+def get_speaker_engine():
+    global _SPEAKER_ENGINE
+    if _SPEAKER_ENGINE is None:
+        _SPEAKER_ENGINE = SpeakerEngine()
+    return _SPEAKER_ENGINE
+
+
+class PipelineReporter:
+    """
+    流水线的日志/进度出口。默认直接写入本进程的 TaskManager 内存缓存；
+    在独立的 worker 进程中运行时由调度器替换为跨进程队列实现。
+    """
+    def __init__(self, task_id):
+        self.task_id = task_id
+
+    def log(self, msg, is_result=False):
+        TaskManager.mem_update_log(self.task_id, msg, is_result)
+
+    def progress(self, p):
+        TaskManager.mem_update_progress(self.task_id, p)
+
+
+def run_pipeline(task_id, audio_path, config, reporter=None, cancel_token=None):
+    """
+    执行完整的会议处理流水线，并把最终结果写入数据库。
+    :param cancel_token: 默认按任务在 tasks.db 中的状态判断是否被取消 (支持跨进程取消)
+    :return: 最终状态 "completed" / "failed" / "cancelled" (以数据库中实际生效的状态为准)
+    """
+    reporter = reporter or PipelineReporter(task_id)
+    token = cancel_token or CancellationToken(probe=lambda: TaskManager.is_cancelled(task_id))
+
+    print(f"[{task_id}] 📥 Config: {json.dumps(config, indent=2)}")
+    reporter.log(">>> Pipeline Started")
+
+    def log_callback(msg, is_result=False):
+        print(f"[{task_id}] {msg}")
+        reporter.log(msg, is_result)
+
+    context = {'audio_path': audio_path, 'save_intermediate': SAVE_INTERMEDIATE}
+    status = "failed"
+
+    try:
+        # 0. Ingest：解码 + 下混 + 重采样到 16 kHz，后续所有阶段共享同一个缓冲区
+        log_callback(f"[Pipeline] Ingested {get_audio(context)}")
+        token.raise_if_cancelled()
+
+        # 1. Enhancer
+        if config.get("enable_enhancer", False):
+            log_callback("[Pipeline] Running Enhancer...")
+            ctx = EnhancerProcessor().process(context, {"enable": True}, log_callback, token)
+        else:
+            log_callback("[Pipeline] Skipped Enhancer.")
+        reporter.progress(0.2)
+        token.raise_if_cancelled()
+
+        # 2. VAD
+        if config.get("enable_vad", False):
+            log_callback("[Pipeline] Running VAD...")
+            ctx = VADProcessor().process(context, {"aggressiveness": config.get("vad_agg", 3)}, log_callback, token)
+        else:
+            log_callback("[Pipeline] Skipped VAD.")
+        reporter.progress(0.4)
+        token.raise_if_cancelled()
+
+        # 3. Speaker ID
+        if config.get("enable_spk", False):
+            log_callback("[Pipeline] Running Speaker ID...")
+            ctx = SpeakerIDProcessor(get_speaker_engine()).process(context, {"window": config.get("spk_win", 1.5), "step": 0.75}, log_callback, token)
+        else:
+            log_callback("[Pipeline] Skipped Speaker ID.")
+            if 'timeline' not in context: context['timeline'] = []
+        reporter.progress(0.6)
+        token.raise_if_cancelled()
+
+        # 4. ASR
+        if config.get("enable_asr", False):
+            log_callback("[Pipeline] Running Whisper ASR...")
+            asr_cfg = {
+                "model": config.get("asr_model", "small"),
+                "full_text_correction": config.get("full_correction", True),
+                "enhanced_audio": config.get("enhanced_audio", True)
+            }
+            resource_dir = os.path.join(BASE_DIR, "resource")
+            ctx = ASRProcessor(resource_dir).process(context, asr_cfg, log_callback, token)
+        else:
+            log_callback("[Pipeline] Skipped ASR.")
+        reporter.progress(0.8)
+        token.raise_if_cancelled()
+
+        # 5. LLM
+        if config.get("enable_llm", False):
+            if context.get('log_path'):
+                log_callback("[Pipeline] Running LLM Summary...")
+                ctx = LLMProcessor().process(context, {"enable": True, "backend": config.get("llm_backend", "Online")}, log_callback, token)
+            else:
+                log_callback("[Pipeline] Skipped LLM (No Transcript).")
+
+        # === 任务完成，写入数据库持久化 ===
+        transcript = context.get('transcript', "")
+
+        # 如果内存中没有，尝试从 Log 文件读取完整转录
+        if not transcript and context.get('log_path') and os.path.exists(context['log_path']):
+             try:
+                 with open(context['log_path'], 'r', encoding='utf-8') as f:
+                     transcript = f.read()
+             except: pass
+
+        # [修复] 优先从 context['summary'] 获取 LLM 生成的摘要
+        summary_text = context.get('summary', "Summary not generated.")
+
+        token.raise_if_cancelled()
+        # [修复] 最后一次检查之后到达的取消 (按秒节流) 会让条件更新落空，此时按取消处理，结果不落库
+        if not TaskManager.update_status(task_id, "completed", transcript, summary_text):
+            raise TaskCancelled()
+        status = "completed"
+
+    except TaskCancelled:
+        TaskManager.update_status(task_id, "cancelled")
+        reporter.log(">>> Pipeline Cancelled")
+        status = TaskManager.get_status(task_id) or "cancelled"
+
+    except Exception as e:
+        traceback.print_exc()
+        reporter.log(f"Error: {str(e)}")
+        if not TaskManager.update_status(task_id, "failed"):
+            status = TaskManager.get_status(task_id) or "failed"
+
+    finally:
+        # 释放内存中的音频缓冲区
+        context.pop('audio', None)
+        context.pop('orig_audio', None)
+
+        # === 清理逻辑：保留原始音频，只删中间文件 (调试模式下全部保留) ===
+        upload_dir = os.path.dirname(audio_path)
+        if not SAVE_INTERMEDIATE and os.path.exists(upload_dir):
+            for filename in os.listdir(upload_dir):
+                file_path = os.path.join(upload_dir, filename)
+                if os.path.abspath(file_path) == os.path.abspath(audio_path):
+                    continue
+                if task_id in filename:
+                    try: os.remove(file_path)
+                    except: pass
+
+    return status
@@ -0,0 +1,364 @@
+import os
+import json
+import time
+import queue
+import signal
+import threading
+import traceback
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.task_manager import TaskManager, DB_PATH
+from utilities.database import get_database
+
+# 流水线 worker 进程数 (各自持有模型，内存占用按进程数线性增长)
+PIPELINE_WORKERS = int(os.environ.get("IMA_PIPELINE_WORKERS", "2"))
+# 单个用户同时运行的任务上限，其余任务排队
+MAX_JOBS_PER_USER = int(os.environ.get("IMA_MAX_JOBS_PER_USER", "1"))
+# 调度线程的兜底轮询间隔 (秒)，正常情况下由入队/完成事件唤醒
+DISPATCH_INTERVAL = 5.0
+# 计算平均等待时间时参考的最近任务数
+WAIT_STATS_WINDOW = 100
+
+# ---------------- worker 进程侧 ----------------
+_EVENT_QUEUE = None
+
+
+def _init_worker(event_queue):
+    """worker 进程初始化：保存事件队列，Ctrl+C 交给主进程处理"""
+    global _EVENT_QUEUE
+    _EVENT_QUEUE = event_queue
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class QueueReporter:
+    """把流水线日志/进度通过队列回传给 API 进程"""
+    def __init__(self, task_id):
+        self.task_id = task_id
+
+    def log(self, msg, is_result=False):
+        _EVENT_QUEUE.put(("result" if is_result else "log", self.task_id, msg))
+
+    def progress(self, p):
+        _EVENT_QUEUE.put(("progress", self.task_id, p))
+
+
+def _worker_metrics():
+    from utilities.ASR.model_pool import GLOBAL_WHISPER_POOL
+    from utilities.model_lifecycle import lifecycle_metrics
+    from utilities.audio_processor.enhance_cache import GLOBAL_ENHANCE_CACHE
+    return {"whisper_pool": GLOBAL_WHISPER_POOL.stats(), "models": lifecycle_metrics(),
+            "enhance_cache": GLOBAL_ENHANCE_CACHE.stats()}
+
+
+def _run_job(job):
+    """在 worker 进程中执行一个任务 (模块级函数，便于 spawn 方式序列化)"""
+    from app.pipeline import run_pipeline
+    task_id = job["task_id"]
+    _EVENT_QUEUE.put(("started", task_id, os.getpid()))
+    status = "failed"
+    try:
+        status = run_pipeline(task_id, job["audio_path"], job["config"], QueueReporter(task_id))
+    finally:
+        try:
+            _EVENT_QUEUE.put(("metrics", os.getpid(), _worker_metrics()))
+        except Exception:
+            pass
+        _EVENT_QUEUE.put(("finished", task_id, status))
+    return status
+
+
+# ---------------- API 进程侧 ----------------
+class JobScheduler:
+    """
+    会议任务调度器：
+    - 任务持久化在 tasks.db 的 jobs 表，按 priority 降序、入队顺序升序出队 (服务重启后自动恢复)
+    - 固定数量的 worker 进程执行流水线，不与 API 进程共享 GIL
+    - 每个用户同时运行的任务数受 max_per_user 限制，保证用户间公平
+    """
+    def __init__(self, workers=PIPELINE_WORKERS, max_per_user=MAX_JOBS_PER_USER, db_path=DB_PATH):
+        self.workers = max(1, int(workers))
+        self.max_per_user = max(1, int(max_per_user))
+        self.db_path = db_path
+
+        self._cond = threading.Condition()
+        self._running = {}      # job_id -> job
+        self._executor = None
+        self._events = None
+        self._threads = []
+        self._stop = threading.Event()
+        self._worker_stats = {}  # pid -> 最近一次上报的模型/缓存统计
+        self._counters = {"completed": 0, "failed": 0, "cancelled": 0, "crashed": 0}
+
+    # --- 数据库 ---
+    @property
+    def db(self):
+        return get_database(self.db_path)
+
+    def _init_db(self):
+        TaskManager._init_db()
+        self.db.init_schema("jobs", self._create_schema)
+
+    @staticmethod
+    def _create_schema(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id TEXT UNIQUE,
+                user_id INTEGER,
+                priority INTEGER DEFAULT 0,
+                status TEXT,
+                audio_path TEXT,
+                config TEXT,
+                enqueued_at REAL,
+                started_at REAL,
+                finished_at REAL,
+                worker_pid INTEGER
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority DESC, job_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_started ON jobs (started_at)")
+
+    # --- 生命周期 ---
+    def start(self):
+        self._init_db()
+        ctx = mp.get_context("spawn")
+        self._events = ctx.Queue()
+        self._executor = self._new_executor()
+
+        # 上次退出时仍在运行的任务重新排队
+        with self.db.transaction() as conn:
+            conn.execute("UPDATE jobs SET status='queued', started_at=NULL, worker_pid=NULL WHERE status='running'")
+            queued = conn.execute("SELECT task_id FROM jobs WHERE status='queued' ORDER BY job_id").fetchall()
+        for (task_id,) in queued:
+            TaskManager.init_mem_task(task_id)
+            TaskManager.mem_update_log(task_id, "[Scheduler] Re-queued after server restart.")
+        if queued:
+            print(f"[Scheduler] Recovered {len(queued)} queued job(s)")
+
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._dispatch_loop, name="job-dispatcher", daemon=True),
+            threading.Thread(target=self._event_loop, name="job-events", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+        print(f"[Scheduler] Started with {self.workers} worker process(es), max {self.max_per_user} running job(s) per user")
+
+    def shutdown(self):
+        """停止调度；正在运行的任务在数据库中保持 running，下次启动时重新排队"""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._events:
+            self._events.put(None)
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=mp.get_context("spawn"),
+                                   initializer=_init_worker, initargs=(self._events,))
+
+    # --- 入队 ---
+    def submit(self, task_id, user_id, audio_path, config, priority=0):
+        priority = int(priority)
+        cur = self.db.execute(
+            "INSERT INTO jobs (task_id, user_id, priority, status, audio_path, config, enqueued_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (task_id, user_id, priority, "queued", audio_path, json.dumps(config), time.time())
+        )
+        # 排在前面的任务数：优先级更高，或同优先级且更早入队
+        position = self.db.query_one(
+            "SELECT COUNT(*) FROM jobs WHERE status='queued' AND (priority > ? OR (priority = ? AND job_id < ?))",
+            (priority, priority, cur.lastrowid)
+        )[0]
+
+        TaskManager.init_mem_task(task_id)
+        TaskManager.mem_update_log(task_id, f"[Scheduler] Queued (position {position + 1}).")
+        with self._cond:
+            self._cond.notify_all()
+
+    def cancel(self, task_id):
+        """
+        取消任务 (调用前 tasks.db 中的任务状态应已置为 cancelled)：
+        排队中的任务直接出队；运行中的任务由 worker 内的 CancellationToken 查库发现后自行停止。
+        :return: "dequeued" / "signalled"
+        """
+        cur = self.db.execute("UPDATE jobs SET status='cancelled', finished_at=? WHERE task_id=? AND status='queued'",
+                              (time.time(), task_id))
+        if cur.rowcount > 0:
+            TaskManager.mem_cleanup(task_id)
+            with self._cond:
+                self._counters["cancelled"] += 1
+            return "dequeued"
+        TaskManager.mem_update_log(task_id, "[Scheduler] Cancellation requested, stopping current stage...")
+        return "signalled"
+
+    # --- 调度 ---
+    def _next_job(self):
+        """取出下一个可运行的任务并标记为 running (需持有 self._cond)"""
+        if len(self._running) >= self.workers:
+            return None
+        per_user = {}
+        for job in self._running.values():
+            per_user[job["user_id"]] = per_user.get(job["user_id"], 0) + 1
+        saturated = [uid for uid, n in per_user.items() if n >= self.max_per_user]
+
+        sql = "SELECT job_id, task_id, user_id, audio_path, config, enqueued_at FROM jobs WHERE status='queued'"
+        if saturated:
+            sql += f" AND user_id NOT IN ({','.join('?' * len(saturated))})"
+        sql += " ORDER BY priority DESC, job_id ASC LIMIT 1"
+        # 取出与标记在同一事务内完成，避免与取消操作交错
+        with self.db.transaction() as conn:
+            row = conn.execute(sql, saturated).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            conn.execute("UPDATE jobs SET status='running', started_at=? WHERE job_id=?", (now, row[0]))
+
+        job = {"job_id": row[0], "task_id": row[1], "user_id": row[2], "audio_path": row[3],
+               "config": json.loads(row[4] or "{}"), "enqueued_at": row[5], "started_at": now}
+        self._running[job["job_id"]] = job
+        return job
+
+    def _dispatch_loop(self):
+        while not self._stop.is_set():
+            with self._cond:
+                job = self._next_job()
+                if job is None:
+                    self._cond.wait(timeout=DISPATCH_INTERVAL)
+                    continue
+            wait = job["started_at"] - job["enqueued_at"]
+            executor = self._executor
+            try:
+                future = executor.submit(_run_job, job)
+            except (BrokenProcessPool, RuntimeError) as e:
+                # [修复] 进程池已损坏 (或正在关闭)：任务本身没有运行过，放回队列而不是记为失败
+                print(f"[Scheduler] Could not dispatch {job['task_id']}: {e}")
+                self._requeue(job)
+                if isinstance(e, BrokenProcessPool):
+                    self._replace_executor(executor)
+                continue
+            TaskManager.mem_update_log(job["task_id"], f"[Scheduler] Dispatched after {wait:.1f}s in queue.")
+            future.add_done_callback(lambda f, job=job, executor=executor: self._on_job_done(job, future=f, executor=executor))
+
+    def _requeue(self, job):
+        self.db.execute("UPDATE jobs SET status='queued', started_at=NULL, worker_pid=NULL WHERE job_id=?", (job["job_id"],))
+        TaskManager.mem_update_log(job["task_id"], "[Scheduler] Worker pool unavailable, re-queued.")
+        with self._cond:
+            self._running.pop(job["job_id"], None)
+            self._cond.notify_all()
+
+    def _replace_executor(self, broken):
+        """
+        [修复] 重建损坏的进程池：同一次崩溃会让所有在途任务的回调都走到这里，
+        只有 self._executor 仍是该任务所用的进程池时才重建，并关闭旧池
+        """
+        with self._cond:
+            if self._stop.is_set() or self._executor is not broken:
+                return
+            self._executor = self._new_executor()
+            print("[Scheduler] Worker pool restarted")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _on_job_done(self, job, future=None, error=None, executor=None):
+        if future is not None and error is None:
+            try:
+                status = future.result()
+            except Exception as e:
+                status, error = "failed", e
+        else:
+            status = "failed"
+
+        if error is not None:
+            # worker 进程崩溃 (如 OOM) 或提交失败：任务记为失败，必要时重建进程池
+            print(f"[Scheduler] Job {job['task_id']} crashed: {error}")
+            TaskManager.mem_update_log(job["task_id"], f"Error: worker crashed ({error})")
+            # [修复] 崩溃前已被取消的任务保持 cancelled
+            if not TaskManager.update_status(job["task_id"], "failed"):
+                status = TaskManager.get_status(job["task_id"]) or "failed"
+            TaskManager.mem_cleanup(job["task_id"])
+            if isinstance(error, BrokenProcessPool) and executor is not None:
+                self._replace_executor(executor)
+
+        self.db.execute("UPDATE jobs SET status=?, finished_at=? WHERE job_id=?", (status, time.time(), job["job_id"]))
+
+        with self._cond:
+            self._running.pop(job["job_id"], None)
+            self._counters[status if status in ("completed", "cancelled") else "failed"] += 1
+            if error is not None:
+                self._counters["crashed"] += 1
+            self._cond.notify_all()
+
+    def _event_loop(self):
+        """接收 worker 进程回传的日志/进度事件，写入 API 进程的内存缓存"""
+        while True:
+            try:
+                event = self._events.get(timeout=1.0)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            except (EOFError, OSError):
+                return
+            if event is None:
+                return
+            kind, key, payload = event
+            try:
+                if kind == "log":
+                    TaskManager.mem_update_log(key, payload)
+                elif kind == "result":
+                    TaskManager.mem_update_log(key, payload, is_result=True)
+                elif kind == "progress":
+                    TaskManager.mem_update_progress(key, payload)
+                elif kind == "started":
+                    self.db.execute("UPDATE jobs SET worker_pid=? WHERE task_id=?", (payload, key))
+                elif kind == "finished":
+                    TaskManager.mem_cleanup(key)
+                elif kind == "metrics":
+                    self._worker_stats[key] = payload
+            except Exception:
+                traceback.print_exc()
+
+    # --- 监控 ---
+    def status(self, user=None):
+        """
+        队列深度与等待时间统计；传入 user 时附带该用户自己的排队情况
+        """
+        now = time.time()
+        queued = self.db.query(
+            "SELECT task_id, user_id, enqueued_at FROM jobs WHERE status='queued' ORDER BY priority DESC, job_id ASC"
+        )
+        recent = self.db.query(
+            "SELECT started_at - enqueued_at FROM jobs WHERE started_at IS NOT NULL ORDER BY started_at DESC LIMIT ?",
+            (WAIT_STATS_WINDOW,)
+        )
+
+        waits = sorted(w for (w,) in recent if w is not None)
+        with self._cond:
+            running = list(self._running.values())
+            counters = dict(self._counters)
+
+        data = {
+            "workers": self.workers,
+            "max_jobs_per_user": self.max_per_user,
+            "running": len(running),
+            "queue_depth": len(queued),
+            "oldest_wait_sec": round(now - min(e for _, _, e in queued), 1) if queued else 0.0,
+            "avg_wait_sec": round(sum(waits) / len(waits), 1) if waits else 0.0,
+            "p95_wait_sec": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 1) if waits else 0.0,
+            "totals": counters,
+        }
+        if user is not None:
+            data["my_running"] = [j["task_id"] for j in running if j["user_id"] == user.id]
+            data["my_queued"] = [{"task_id": t, "position": i + 1, "wait_sec": round(now - e, 1)}
+                                 for i, (t, u, e) in enumerate(queued) if u == user.id]
+        return data
+
+    def worker_metrics(self):
+        """各 worker 进程最近一次上报的模型池/缓存统计"""
+        return dict(self._worker_stats)
+
+
+# 全局单例 (在 FastAPI startup 事件中启动)
+GLOBAL_SCHEDULER = JobScheduler()
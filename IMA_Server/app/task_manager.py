@@ -1,20 +1,36 @@
-import sqlite3
 import uuid
 import datetime
 import os
 import json
+import base64
+import threading
+from collections import deque
+
+from utilities.database import get_database
+from app.artifact_store import ArtifactStore
 
 # 数据库路径
 DB_PATH = "resource/tasks.db"
+# 任务结束后内存事件的保留时间 (秒)，让推送连接能取走最后几条日志
+MEM_RETAIN_SEC = 30.0
+# 每个任务在内存中保留的事件条数上限 (环形缓冲区，超出后丢弃最早的条目)
+MEM_EVENT_LIMIT = int(os.environ.get("IMA_TASK_LOG_LIMIT", "2000"))
+# 历史记录分页：默认每页条数 / 单页上限
+HISTORY_PAGE_SIZE = int(os.environ.get("IMA_HISTORY_PAGE_SIZE", "50"))
+HISTORY_PAGE_MAX = 200
 
 class TaskManager:
     @staticmethod
-    def _init_db():
-        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
+    def _db():
+        """[优化] 共享的线程本地 WAL 连接，schema 在本进程首次访问时初始化一次"""
+        db = get_database(DB_PATH)
+        db.init_schema("tasks", TaskManager._create_schema)
+        return db
+
+    @staticmethod
+    def _create_schema(conn):
         # 创建任务表
-        c.execute('''
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS tasks (
                 task_id TEXT PRIMARY KEY,
                 user_id INTEGER,
@@ -27,26 +43,78 @@ class TaskManager:
                 logs TEXT
             )
         ''')
-        conn.commit()
-        conn.close()
+        # [优化] 历史列表按 (user_id, created_at) 倒序分页，task_id 作为同一秒内的决胜键
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_tasks_user_created ON tasks (user_id, created_at, task_id)")
+        # [新增] 上传音频的内容哈希，用于识别重复上传并复用已存储的文件
+        columns = {r[1] for r in conn.execute("PRAGMA table_info(tasks)")}
+        if "audio_sha256" not in columns:
+            conn.execute("ALTER TABLE tasks ADD COLUMN audio_sha256 TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_audio_sha256 ON tasks (audio_sha256)")
+        # [新增] 转写/摘要存放在独立的内容存储中，tasks 表只保留元数据
+        ArtifactStore.create_schema(conn)
+        TaskManager._migrate_inline_results(conn)
+
+    @staticmethod
+    def _migrate_inline_results(conn):
+        """把旧版本直接存在 tasks 行内的 transcript / summary 移到内容存储"""
+        rows = conn.execute(
+            "SELECT task_id, transcript, summary FROM tasks WHERE transcript IS NOT NULL OR summary IS NOT NULL").fetchall()
+        artifacts = []
+        for task_id, transcript, summary in rows:
+            if transcript:
+                artifacts.append(ArtifactStore.rows(task_id, "transcript", transcript))
+            if summary:
+                artifacts.append(ArtifactStore.rows(task_id, "summary", summary, "text/markdown; charset=utf-8"))
+        if rows:
+            # [优化] 所有行一次 executemany 写入，而不是每个结果两条 INSERT
+            ArtifactStore.put_rows_with(conn, artifacts)
+            conn.execute("UPDATE tasks SET transcript=NULL, summary=NULL WHERE transcript IS NOT NULL OR summary IS NOT NULL")
+            print(f"[TaskManager] Moved results of {len(rows)} task(s) into the artifact store")
+
+    @staticmethod
+    def artifacts():
+        """任务结果内容存储 (与任务表同库)"""
+        return ArtifactStore(TaskManager._db())
+
+    @staticmethod
+    def _init_db():
+        """服务启动时调用，提前建表"""
+        TaskManager._db()
 
     @staticmethod
-    def create_task(user_id, file_name, audio_path):
+    def create_task(user_id, file_name, audio_path, audio_sha256=None):
         """创建新任务入库"""
-        TaskManager._init_db()
         task_id = str(uuid.uuid4())
         created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute(
-            "INSERT INTO tasks (task_id, user_id, file_name, audio_path, status, created_at, logs) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (task_id, user_id, file_name, audio_path, "processing", created_at, "[]")
+        TaskManager._db().execute(
+            "INSERT INTO tasks (task_id, user_id, file_name, audio_path, status, created_at, logs, audio_sha256) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (task_id, user_id, file_name, audio_path, "processing", created_at, "[]", audio_sha256)
         )
-        conn.commit()
-        conn.close()
         return task_id
 
+    @staticmethod
+    def find_audio(user_id, audio_sha256):
+        """
+        [新增] 查找该用户内容相同、文件仍然存在的已上传音频路径
+        [修复] 只在同一用户的任务之间复用，其他用户的任务被清理时不会影响本用户的录音
+        """
+        rows = TaskManager._db().query(
+            "SELECT DISTINCT audio_path FROM tasks WHERE user_id=? AND audio_sha256=?", (user_id, audio_sha256))
+        for (path,) in rows:
+            if path and os.path.exists(path):
+                return path
+        return None
+
+    @staticmethod
+    def find_duplicate(user_id, audio_sha256):
+        """[新增] 该用户最近一次上传相同音频的任务 ID (没有则返回 None)"""
+        row = TaskManager._db().query_one(
+            "SELECT task_id FROM tasks WHERE user_id=? AND audio_sha256=? ORDER BY created_at DESC LIMIT 1",
+            (user_id, audio_sha256))
+        return row[0] if row else None
+
     @staticmethod
     def update_log(task_id, message, is_result=False):
         """追加日志（为了性能，日志可以只存内存或定期刷入，这里简化为实时更新）"""
@@ -58,25 +126,50 @@ class TaskManager:
 
     @staticmethod
     def update_status(task_id, status, transcript=None, summary=None):
-        """更新任务状态和结果"""
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        if transcript and summary:
-            c.execute("UPDATE tasks SET status=?, transcript=?, summary=? WHERE task_id=?", 
-                     (status, transcript, summary, task_id))
-        else:
-            c.execute("UPDATE tasks SET status=? WHERE task_id=?", (status, task_id))
-        conn.commit()
-        conn.close()
+        """
+        [修改] 把处理中的任务置为最终状态；转写和摘要写入内容存储，与状态在同一事务内提交。
+        [修复] 只有任务仍为 processing 时才生效，已被取消 (或已结束) 的任务不会被覆盖，结果也不会写入
+        :return: 状态是否实际更新
+        """
+        db = TaskManager._db()
+        results = {}
+        if transcript:
+            results["transcript"] = transcript
+        if summary:
+            results["summary"] = (summary, "text/markdown; charset=utf-8")
+        with db.transaction():
+            cur = db.execute("UPDATE tasks SET status=? WHERE task_id=? AND status='processing'", (status, task_id))
+            if cur.rowcount == 0:
+                return False
+            if results:
+                TaskManager.artifacts().put(task_id, results)
+        return True
+
+    @staticmethod
+    def get_status(task_id):
+        """[新增] 任务在数据库中的当前状态 (不存在时返回 None)"""
+        row = TaskManager._db().query_one("SELECT status FROM tasks WHERE task_id=?", (task_id,))
+        return row[0] if row else None
+
+    @staticmethod
+    def request_cancel(task_id):
+        """[新增] 将处理中的任务标记为 cancelled；任务已结束时返回 False"""
+        cur = TaskManager._db().execute(
+            "UPDATE tasks SET status='cancelled' WHERE task_id=? AND status='processing'", (task_id,))
+        return cur.rowcount > 0
+
+    @staticmethod
+    def is_cancelled(task_id):
+        """[新增] 供 worker 进程中的 CancellationToken 轮询"""
+        return TaskManager.get_status(task_id) == "cancelled"
 
     @staticmethod
     def get_task(task_id):
         """获取单个任务详情"""
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT * FROM tasks WHERE task_id=?", (task_id,))
-        row = c.fetchone()
-        conn.close()
+        # [修改] 只读元数据列，转写/摘要通过 artifacts() 按需读取
+        row = TaskManager._db().query_one(
+            "SELECT task_id, user_id, file_name, audio_path, status, created_at "
+            "FROM tasks WHERE task_id=?", (task_id,))
         if row:
             return {
                 "task_id": row[0],
@@ -84,75 +177,181 @@ class TaskManager:
                 "file_name": row[2],
                 "audio_path": row[3], # 原始音频路径
                 "status": row[4],
-                "created_at": row[5],
-                "transcript": row[6],
-                "summary": row[7]
+                "created_at": row[5]
             }
         return None
 
     @staticmethod
-    def get_user_history(user_id):
-        """获取某用户的所有历史任务"""
-        TaskManager._init_db()
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        # 按时间倒序
-        c.execute("SELECT task_id, file_name, status, created_at FROM tasks WHERE user_id=? ORDER BY created_at DESC", (user_id,))
-        rows = c.fetchall()
-        conn.close()
-        
+    def _encode_cursor(created_at, task_id):
+        raw = f"{created_at}|{task_id}".encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        """游标无效时抛出 ValueError"""
+        try:
+            created_at, task_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", 1)
+        except Exception:
+            raise ValueError("Invalid cursor")
+        return created_at, task_id
+
+    @staticmethod
+    def get_user_history(user_id, cursor=None, limit=HISTORY_PAGE_SIZE):
+        """
+        [修改] 按时间倒序分页获取某用户的历史任务 (keyset 分页，走 idx_tasks_user_created 索引)
+        :param cursor: 上一页返回的 next_cursor，为空时从最新一条开始
+        :return: {"items": [...], "next_cursor": 下一页游标，没有更多时为 None}
+        """
+        limit = max(1, min(int(limit), HISTORY_PAGE_MAX))
+        sql = "SELECT task_id, file_name, status, created_at FROM tasks WHERE user_id=?"
+        params = [user_id]
+        if cursor:
+            created_at, task_id = TaskManager._decode_cursor(cursor)
+            sql += " AND (created_at, task_id) < (?, ?)"
+            params += [created_at, task_id]
+        # 多取一条用于判断是否还有下一页
+        sql += " ORDER BY created_at DESC, task_id DESC LIMIT ?"
+        params.append(limit + 1)
+        rows = TaskManager._db().query(sql, params)
+
         history = []
-        for r in rows:
+        for r in rows[:limit]:
             history.append({
                 "task_id": r[0],
                 "file_name": r[1],
                 "status": r[2],
                 "created_at": r[3]
             })
-        return history
+        next_cursor = None
+        if len(rows) > limit:
+            last = history[-1]
+            next_cursor = TaskManager._encode_cursor(last["created_at"], last["task_id"])
+        return {"items": history, "next_cursor": next_cursor}
 
     # --- 内存缓存用于实时轮询 (Progress Polling) ---
     # 由于前端 dashboard 需要轮询 logs 和 progress，直接查库太慢且不方便存进度条 float
     # 我们维护一个简单的内存字典，仅用于“正在进行中”的任务
+    # [新增] 每条日志/进度/转写结果都记为带递增 seq 的事件，供 SSE 推送与断点续传
     _active_tasks = {} 
+    _events_cond = threading.Condition()
+    _watchers = {}      # task_id -> {(事件循环, asyncio.Event)}
 
     @staticmethod
     def init_mem_task(task_id):
-        TaskManager._active_tasks[task_id] = {"progress": 0.0, "logs": []}
+        with TaskManager._events_cond:
+            TaskManager._active_tasks[task_id] = {"progress": 0.0, "seq": 0, "done": False,
+                                                  "events": deque(maxlen=MEM_EVENT_LIMIT)}
 
     @staticmethod
-    def mem_update_log(task_id, msg):
-        if task_id in TaskManager._active_tasks:
-            TaskManager._active_tasks[task_id]["logs"].append(msg)
+    def _mem_push(task_id, kind, data):
+        """追加一条事件并唤醒等待中的推送连接"""
+        with TaskManager._events_cond:
+            task = TaskManager._active_tasks.get(task_id)
+            if task is None or task["done"]:
+                return
+            task["seq"] += 1
+            task["events"].append({"seq": task["seq"], "type": kind, "data": data})
+            TaskManager._notify_watchers(task_id)
+
+    @staticmethod
+    def mem_update_log(task_id, msg, is_result=False):
+        """is_result=True 的行 (分段转写、摘要) 记为 transcript 事件"""
+        TaskManager._mem_push(task_id, "transcript" if is_result else "log", msg)
 
     @staticmethod
     def mem_update_progress(task_id, p):
-        if task_id in TaskManager._active_tasks:
-            TaskManager._active_tasks[task_id]["progress"] = p
+        with TaskManager._events_cond:
+            if task_id in TaskManager._active_tasks:
+                TaskManager._active_tasks[task_id]["progress"] = p
+        TaskManager._mem_push(task_id, "progress", p)
+
+    @staticmethod
+    def mem_get_events(task_id, since=0):
+        """
+        [修改] 取出 seq > since 的事件，不阻塞 (SSE 推送在事件循环中调用，等待交给 mem_watch 的 asyncio.Event)
+        :return: (events, active) active=False 表示任务已结束或不在内存中
+        """
+        with TaskManager._events_cond:
+            task = TaskManager._active_tasks.get(task_id)
+            if task is None:
+                return [], False
+            return [e for e in task["events"] if e["seq"] > since], not task["done"]
+
+    @staticmethod
+    def mem_watch(task_id, loop, event):
+        """
+        [新增] 登记一个推送连接：任务有新事件或结束时在其事件循环中 set() 该 asyncio.Event，
+        等待期间不占用线程池线程
+        """
+        with TaskManager._events_cond:
+            TaskManager._watchers.setdefault(task_id, set()).add((loop, event))
+
+    @staticmethod
+    def mem_unwatch(task_id, loop, event):
+        with TaskManager._events_cond:
+            watchers = TaskManager._watchers.get(task_id)
+            if watchers is not None:
+                watchers.discard((loop, event))
+                if not watchers:
+                    del TaskManager._watchers[task_id]
 
     @staticmethod
-    def mem_get_status(task_id):
+    def _notify_watchers(task_id):
+        """唤醒该任务的推送连接 (需持有 _events_cond)"""
+        for loop, event in TaskManager._watchers.get(task_id, ()):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass    # 事件循环已关闭
+
+    @staticmethod
+    def mem_get_status(task_id, since=None):
+        """
+        :param since: [新增] 日志游标，只返回 seq > since 的日志；None 时返回缓冲区内的全部日志
+        返回值中的 cursor 为当前最新 seq，下次轮询时作为 since 传入；
+        dropped_events 为游标之后已被环形缓冲区淘汰、无法再取回的事件数
+        ([修改] 日志与进度事件共用序号并一起淘汰，因此该数包含进度事件，不等于丢失的日志行数)
+        """
         # 优先查内存（正在运行），如果内存没有，查 DB（已完成/历史）
-        if task_id in TaskManager._active_tasks:
-            return {
-                "state": "processing",
-                "progress": TaskManager._active_tasks[task_id]["progress"],
-                "logs": TaskManager._active_tasks[task_id]["logs"]
-            }
+        with TaskManager._events_cond:
+            task = TaskManager._active_tasks.get(task_id)
+            if task is not None and not task["done"]:
+                since = since or 0
+                events = task["events"]
+                oldest = events[0]["seq"] if events else task["seq"] + 1
+                return {
+                    "state": "processing",
+                    "progress": task["progress"],
+                    "logs": [e["data"] for e in events if e["seq"] > since and e["type"] != "progress"],
+                    "cursor": task["seq"],
+                    "dropped_events": max(0, oldest - since - 1)
+                }
         
         # 查 DB
         task = TaskManager.get_task(task_id)
         if task:
+            # [修改] 不再内联转写全文/摘要，只返回结果清单 (大小、摘要哈希)，内容走 artifacts 接口
             return {
                 "state": task["status"],
                 "progress": 1.0 if task["status"]=="completed" else 0.0,
-                "transcript": task["transcript"],
-                "markdown": task["summary"]
+                "artifacts": TaskManager.artifacts().list(task_id)
             }
         return None
 
     @staticmethod
     def mem_cleanup(task_id):
-        """任务完成后清理内存缓存"""
-        if task_id in TaskManager._active_tasks:
-            del TaskManager._active_tasks[task_id]
\ No newline at end of file
+        """任务完成后标记结束并通知推送连接发送最终状态，内存事件延迟 MEM_RETAIN_SEC 后清理"""
+        with TaskManager._events_cond:
+            task = TaskManager._active_tasks.get(task_id)
+            if task is None:
+                return
+            task["done"] = True
+            TaskManager._notify_watchers(task_id)
+
+        def drop():
+            with TaskManager._events_cond:
+                if TaskManager._active_tasks.get(task_id) is task:
+                    del TaskManager._active_tasks[task_id]
+        timer = threading.Timer(MEM_RETAIN_SEC, drop)
+        timer.daemon = True
+        timer.start()
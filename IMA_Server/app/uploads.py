@@ -0,0 +1,265 @@
+import os
+import time
+import uuid
+import asyncio
+import hashlib
+import threading
+from fastapi import HTTPException, Request, UploadFile
+
+from utilities.database import get_database
+from utilities.audio_processor.audio_codec import COMPRESSED_EXTS, decode_to_wav
+from app.task_manager import DB_PATH
+
+UPLOAD_DIR = os.path.join("resource", "uploads")
+# 分片上传会话的临时文件目录
+SESSION_DIR = os.path.join(UPLOAD_DIR, "sessions")
+# 单个上传文件的大小上限 (MB)
+MAX_UPLOAD_MB = int(os.environ.get("IMA_MAX_UPLOAD_MB", "2048"))
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+# 落盘时每次读取的块大小
+COPY_CHUNK_BYTES = 1024 * 1024
+# 建议客户端使用的分片大小 (MB)
+UPLOAD_CHUNK_MB = int(os.environ.get("IMA_UPLOAD_CHUNK_MB", "8"))
+# 未完成的上传会话保留时间 (小时)，过期后清理临时文件
+UPLOAD_SESSION_TTL_H = float(os.environ.get("IMA_UPLOAD_SESSION_TTL_H", "24"))
+
+
+def _too_large():
+    return HTTPException(status_code=413, detail=f"Upload exceeds the {MAX_UPLOAD_MB} MB limit")
+
+
+def reject_oversized(request: Request, max_bytes=MAX_UPLOAD_BYTES):
+    """根据 Content-Length 提前拒绝超限的请求"""
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise _too_large()
+
+
+def copy_stream(src, dest_path, max_bytes=MAX_UPLOAD_BYTES):
+    """
+    分块把文件对象写入 dest_path，同时计算 sha256，内存占用只有一个块。
+    超过 max_bytes 时删除已写入的部分并抛出 413。
+    :return: (size, sha256)
+    """
+    h = hashlib.sha256()
+    size = 0
+    tmp_path = dest_path + ".part"
+    try:
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = src.read(COPY_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large()
+                h.update(chunk)
+                f.write(chunk)
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            try: os.remove(tmp_path)
+            except OSError: pass
+        raise
+    return size, h.hexdigest()
+
+
+async def save_upload(file: UploadFile, dest_path, max_bytes=MAX_UPLOAD_BYTES):
+    """[新增] 流式保存表单上传的文件 (在线程中执行磁盘 IO，不阻塞事件循环)"""
+    await file.seek(0)
+    return await asyncio.to_thread(copy_stream, file.file, dest_path, max_bytes)
+
+
+def ingest_audio(path):
+    """
+    [新增] 入库：压缩上传 (FLAC / Opus) 在这里解码一次为同名 wav 供流水线使用，
+    压缩原件保留在旁边，下载时可直接作为压缩版本返回
+    :return: 流水线使用的音频路径
+    """
+    base, ext = os.path.splitext(path)
+    if ext.lower() not in COMPRESSED_EXTS:
+        return path
+    t0 = time.perf_counter()
+    wav_path = decode_to_wav(path, base + ".wav")
+    print(f"[Ingest] Decoded {os.path.basename(path)} ({os.path.getsize(path) / 1e6:.1f} MB -> "
+          f"{os.path.getsize(wav_path) / 1e6:.1f} MB wav) in {time.perf_counter() - t0:.2f}s")
+    return wav_path
+
+
+class UploadManager:
+    """
+    [新增] 可续传的分片上传会话：
+    - 会话元数据存放在 tasks.db 的 upload_sessions 表，数据追加写入 sessions/<upload_id>.part
+    - 已接收的字节数以 .part 文件大小为准，断线或服务重启后客户端查询偏移量继续上传
+    - sha256 随分片增量计算；服务重启后首次续传时重新计算一次已接收部分
+    """
+    _lock = threading.Lock()
+    _busy = set()       # 正在写入分片的会话，同一会话不允许并发追加
+    _hashers = {}       # upload_id -> (offset, hasher)
+
+    @staticmethod
+    def _db():
+        db = get_database(DB_PATH)
+        db.init_schema("upload_sessions", UploadManager._create_schema)
+        return db
+
+    @staticmethod
+    def _create_schema(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS upload_sessions (
+                upload_id TEXT PRIMARY KEY,
+                user_id INTEGER,
+                filename TEXT,
+                size INTEGER,
+                sha256 TEXT,
+                created_at REAL
+            )
+        ''')
+
+    @staticmethod
+    def _part_path(upload_id):
+        return os.path.join(SESSION_DIR, f"{upload_id}.part")
+
+    @staticmethod
+    def create_session(user_id, filename, size, sha256=None):
+        """
+        :param size: 文件总字节数
+        :param sha256: 可选，客户端预先计算的哈希，完成时校验
+        """
+        if size <= 0:
+            raise HTTPException(status_code=400, detail="Invalid upload size")
+        if size > MAX_UPLOAD_BYTES:
+            raise _too_large()
+        UploadManager.cleanup_expired()
+        upload_id = uuid.uuid4().hex
+        os.makedirs(SESSION_DIR, exist_ok=True)
+        open(UploadManager._part_path(upload_id), "wb").close()
+        UploadManager._db().execute(
+            "INSERT INTO upload_sessions (upload_id, user_id, filename, size, sha256, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (upload_id, user_id, os.path.basename(filename), size, sha256.lower() if sha256 else None, time.time()))
+        return UploadManager.get_session(upload_id, user_id)
+
+    @staticmethod
+    def get_session(upload_id, user_id):
+        row = UploadManager._db().query_one(
+            "SELECT user_id, filename, size, sha256 FROM upload_sessions WHERE upload_id=?", (upload_id,))
+        if not row:
+            raise HTTPException(status_code=404, detail="Upload session not found")
+        if row[0] != user_id:
+            raise HTTPException(status_code=403, detail="Permission denied")
+        part = UploadManager._part_path(upload_id)
+        return {
+            "upload_id": upload_id,
+            "filename": row[1],
+            "size": row[2],
+            "sha256": row[3],
+            "offset": os.path.getsize(part) if os.path.exists(part) else 0,
+            "chunk_size": UPLOAD_CHUNK_MB * 1024 * 1024
+        }
+
+    @staticmethod
+    def _hasher_for(upload_id, offset):
+        cached = UploadManager._hashers.get(upload_id)
+        if cached and cached[0] == offset:
+            return cached[1]
+        # 服务重启过 (或缓存失效)，重新计算已接收部分
+        h = hashlib.sha256()
+        with open(UploadManager._part_path(upload_id), "rb") as f:
+            for chunk in iter(lambda: f.read(COPY_CHUNK_BYTES), b""):
+                h.update(chunk)
+        return h
+
+    @staticmethod
+    def _write(f, hasher, data):
+        hasher.update(data)
+        f.write(data)
+
+    @staticmethod
+    async def append(upload_id, user_id, offset, stream):
+        """
+        把请求体追加到会话文件。offset 必须等于服务器已接收的字节数，否则返回 409 (附带正确的偏移量)。
+        :param stream: request.stream()
+        :return: 追加后的偏移量
+        """
+        session = UploadManager.get_session(upload_id, user_id)
+        with UploadManager._lock:
+            if upload_id in UploadManager._busy:
+                # [修复] 与偏移量不符时一样附带 Upload-Offset，客户端据此重试而不是放弃上传
+                raise HTTPException(status_code=409, detail="Another chunk is being uploaded",
+                                    headers={"Upload-Offset": str(session["offset"])})
+            UploadManager._busy.add(upload_id)
+        try:
+            current = session["offset"]
+            if offset != current:
+                raise HTTPException(status_code=409, detail=f"Offset mismatch, expected {current}",
+                                    headers={"Upload-Offset": str(current)})
+            hasher = await asyncio.to_thread(UploadManager._hasher_for, upload_id, current)
+            # [修复] 打开、写入、哈希都在线程中进行，不阻塞事件循环；网络小块先拼成 COPY_CHUNK_BYTES 再写
+            f = await asyncio.to_thread(open, UploadManager._part_path(upload_id), "ab")
+            try:
+                pending = bytearray()
+                async for piece in stream:
+                    if current + len(pending) + len(piece) > session["size"]:
+                        raise HTTPException(status_code=413, detail="Chunk exceeds the declared upload size")
+                    pending += piece
+                    if len(pending) >= COPY_CHUNK_BYTES:
+                        await asyncio.to_thread(UploadManager._write, f, hasher, bytes(pending))
+                        current += len(pending)
+                        pending.clear()
+                if pending:
+                    await asyncio.to_thread(UploadManager._write, f, hasher, bytes(pending))
+                    current += len(pending)
+            finally:
+                await asyncio.to_thread(f.close)
+                # 中途断开时已写入的部分仍然有效，哈希状态与文件保持一致
+                UploadManager._hashers[upload_id] = (current, hasher)
+            return current
+        finally:
+            with UploadManager._lock:
+                UploadManager._busy.discard(upload_id)
+
+    @staticmethod
+    def finalize(upload_id, user_id, dest_path):
+        """
+        完成上传：校验大小与哈希，把会话文件移动到 dest_path 并删除会话
+        :return: (size, sha256)
+        """
+        session = UploadManager.get_session(upload_id, user_id)
+        if session["offset"] != session["size"]:
+            raise HTTPException(status_code=409, detail=f"Upload incomplete ({session['offset']}/{session['size']} bytes)",
+                                headers={"Upload-Offset": str(session["offset"])})
+        digest = UploadManager._hasher_for(upload_id, session["offset"]).hexdigest()
+        if session["sha256"] and session["sha256"] != digest:
+            UploadManager.abort(upload_id, user_id)
+            raise HTTPException(status_code=400, detail="Checksum mismatch, please upload again")
+        os.replace(UploadManager._part_path(upload_id), dest_path)
+        UploadManager._drop(upload_id)
+        return session["size"], digest
+
+    @staticmethod
+    def abort(upload_id, user_id):
+        UploadManager.get_session(upload_id, user_id)
+        part = UploadManager._part_path(upload_id)
+        if os.path.exists(part):
+            try: os.remove(part)
+            except OSError: pass
+        UploadManager._drop(upload_id)
+
+    @staticmethod
+    def _drop(upload_id):
+        UploadManager._hashers.pop(upload_id, None)
+        UploadManager._db().execute("DELETE FROM upload_sessions WHERE upload_id=?", (upload_id,))
+
+    @staticmethod
+    def cleanup_expired():
+        """清理超过 UPLOAD_SESSION_TTL_H 仍未完成的会话"""
+        cutoff = time.time() - UPLOAD_SESSION_TTL_H * 3600
+        rows = UploadManager._db().query("SELECT upload_id FROM upload_sessions WHERE created_at < ?", (cutoff,))
+        for (upload_id,) in rows:
+            part = UploadManager._part_path(upload_id)
+            if os.path.exists(part):
+                try: os.remove(part)
+                except OSError: pass
+            UploadManager._drop(upload_id)
+        if rows:
+            print(f"[Uploads] Removed {len(rows)} expired upload session(s)")
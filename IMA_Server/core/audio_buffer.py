@@ -0,0 +1,93 @@
+import os
+import numpy as np
+import soundfile as sf
+
+from utilities.audio_processor.audio_codec import resample
+
+# [新增] 流水线统一的工作格式：16 kHz 单声道 float32
+# (ECAPA 与 Whisper 的训练采样率，也是 WebRTC VAD 支持的采样率)
+CANONICAL_SR = 16000
+
+
+class AudioBuffer:
+    """
+    流水线各阶段之间传递的内存音频：单声道 float32 样本 + 采样率 + 处理来源记录。
+    每个任务只解码一次，后续阶段直接在样本上处理，不再反复读写中间 wav。
+    """
+    def __init__(self, samples, sr, source_path=None, provenance=None):
+        samples = np.asarray(samples)
+        if samples.ndim > 1:
+            samples = samples.mean(axis=1)
+        self.samples = samples.astype(np.float32, copy=False)
+        self.sr = int(sr)
+        self.source_path = source_path
+        # 处理链，例如 ["decode:meeting.wav", "enhance", "vad"]
+        self.provenance = list(provenance or [])
+
+    @classmethod
+    def from_file(cls, path, target_sr=CANONICAL_SR):
+        """
+        [修改] 入库解码：任意 soundfile 支持的容器 (wav / flac / ogg ...)，多声道取平均，
+        再用多相滤波器重采样到 target_sr (为 None 时保持原采样率)。每个任务只做一次。
+        """
+        samples, sr = sf.read(path, dtype='float32', always_2d=True)
+        provenance = [f"decode:{os.path.basename(path)}"]
+        if samples.shape[1] > 1:
+            provenance.append(f"downmix:{samples.shape[1]}ch")
+            samples = samples.mean(axis=1)
+        else:
+            samples = samples[:, 0]
+        if target_sr and sr != target_sr:
+            provenance.append(f"resample:{sr}->{target_sr}")
+            samples, sr = resample(samples, sr, target_sr), target_sr
+        return cls(samples, sr, source_path=path, provenance=provenance)
+
+    def derive(self, samples, step, sr=None):
+        """基于当前缓冲区生成处理后的新缓冲区，并追加处理步骤"""
+        return AudioBuffer(samples, sr or self.sr, source_path=self.source_path,
+                           provenance=self.provenance + [step])
+
+    def has_step(self, step):
+        return step in self.provenance
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sr if self.sr else 0.0
+
+    def __len__(self):
+        return len(self.samples)
+
+    def save(self, path):
+        sf.write(path, self.samples, self.sr)
+        return path
+
+    def __repr__(self):
+        return f"AudioBuffer({self.duration:.1f}s @ {self.sr}Hz, {' -> '.join(self.provenance)})"
+
+
+def get_audio(context):
+    """
+    取出 context 中的当前音频；首次调用时从 context['audio_path'] 解码一次
+    (转换为 16 kHz 单声道)，同时记为 context['orig_audio'] (供 ASR 全文校对使用)。
+    """
+    buf = context.get('audio')
+    if buf is None:
+        buf = AudioBuffer.from_file(context['audio_path'])
+        context['audio'] = buf
+        context.setdefault('orig_audio', buf)
+    return buf
+
+
+def set_audio(context, buf, suffix, log_cb=None):
+    """
+    更新 context 中的当前音频；仅在 context['save_intermediate'] 打开时
+    (调试用) 才把中间结果写到 <原文件名><suffix>.wav。
+    """
+    context['audio'] = buf
+    if context.get('save_intermediate') and context.get('audio_path'):
+        base, _ = os.path.splitext(context['audio_path'])
+        out_path = buf.save(f"{base}{suffix}.wav")
+        context['audio_path'] = out_path
+        if log_cb:
+            log_cb(f"[Debug] Saved intermediate: {os.path.basename(out_path)}")
+    return buf
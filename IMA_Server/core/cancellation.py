@@ -0,0 +1,47 @@
+import time
+import threading
+
+
+class TaskCancelled(Exception):
+    """任务被用户取消时由各阶段抛出，流水线捕获后记录 cancelled 状态"""
+
+
+class CancellationToken:
+    """
+    协作式取消令牌：各阶段在循环中调用 raise_if_cancelled() 检查。
+    cancel() 用于同进程内取消；probe 为可选的外部检查函数 (如查询数据库中的任务状态)，
+    用于跨进程取消，按 probe_interval 节流，避免在热循环中频繁查库。
+    """
+    def __init__(self, probe=None, probe_interval=1.0):
+        self._event = threading.Event()
+        self._probe = probe
+        self._probe_interval = probe_interval
+        self._last_probe = 0.0
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        if self._event.is_set():
+            return True
+        if self._probe is not None:
+            now = time.monotonic()
+            if now - self._last_probe >= self._probe_interval:
+                self._last_probe = now
+                try:
+                    if self._probe():
+                        self._event.set()
+                except Exception as e:
+                    print(f"[Cancel] Probe failed: {e}")
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise TaskCancelled()
+
+
+def check_cancelled(token):
+    """token 可以为 None (不可取消)"""
+    if token is not None:
+        token.raise_if_cancelled()
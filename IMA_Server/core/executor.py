@@ -2,6 +2,7 @@ import dearpygui.dearpygui as dpg
 import time
 import traceback
 from .processors import *
+from .cancellation import CancellationToken, TaskCancelled
 from .ui_utils import NodeThemeManager
 
 class GraphExecutor:
@@ -20,16 +21,19 @@ class GraphExecutor:
         
         # [新增] 中断控制标志
         self.stop_flag = False
+        self.cancel_token = CancellationToken()
 
     def stop(self):
-        """外部调用此方法来中断执行"""
+        """外部调用此方法来中断执行 (正在运行的节点也会在内部检查点停止)"""
         self.stop_flag = True
+        self.cancel_token.cancel()
 
     def execute(self, start_id, nodes, links, context, log_cb, prog_cb):
         if not self.theme_mgr: self.theme_mgr = NodeThemeManager()
         
         # [新增] 开始执行前重置标志
         self.stop_flag = False
+        self.cancel_token = CancellationToken()
         
         curr_id = start_id
         link_map = {l[0]: l[1] for l in links.values()}
@@ -55,10 +59,13 @@ class GraphExecutor:
             proc = self.processors.get(label)
             if proc:
                 try:
-                    # [优化] 如果是耗时操作，理论上 Processor 内部也应该支持检查 stop_flag
-                    # 这里暂时只支持"节点级"中断（即做完当前节点后停止）
-                    context = proc.process(context, node['config'], log_cb)
+                    # [优化] 耗时节点在内部检查 cancel_token，无需等当前节点跑完
+                    context = proc.process(context, node['config'], log_cb, self.cancel_token)
                     self.theme_mgr.set_status(curr_id, 'idle')
+                except TaskCancelled:
+                    log_cb(">>> 🛑 Process Interrupted by User.", is_result=True)
+                    self.theme_mgr.set_status(curr_id, 'idle')
+                    break
                 except Exception as e:
                     log_cb(f"!!! Error in {label}: {e}")
                     traceback.print_exc()
@@ -1,9 +1,7 @@
 import os
 import shutil
 import datetime
-import time
-import soundfile as sf
-import numpy as np
+from concurrent.futures import wait, FIRST_COMPLETED
 import gc
 
 # 尝试导入 torch 用于显存清理
@@ -20,43 +18,15 @@ except ImportError:
     RealTimeAudioProvider = None
 
 from utilities.audio_processor.enhancer import AudioEnhancer
+from utilities.audio_processor.enhance_cache import GLOBAL_ENHANCE_CACHE
 from utilities.diarization.engine import SpeakerEngine
-from utilities.ASR.whisper_engine import AsyncWhisperEngine
+from utilities.ASR.model_pool import GLOBAL_WHISPER_POOL
+from core.audio_buffer import AudioBuffer, get_audio, set_audio
+from core.cancellation import TaskCancelled, check_cancelled
 
 # --- VAD 模块导入 ---
-try:
-    import webrtcvad
-    class WebRTCVADWrapper:
-        def __init__(self, aggressiveness=3, sr=16000):
-            self.vad = webrtcvad.Vad(aggressiveness)
-            self.sr = sr
-        def process(self, audio_np, sr=16000):
-            pcm_data = (audio_np * 32767).astype(np.int16).tobytes()
-            frame_ms = 30
-            n_samples = int(sr * frame_ms / 1000)
-            n_bytes = n_samples * 2
-            voiced = []
-            for i in range(0, len(pcm_data) - n_bytes, n_bytes):
-                chunk = pcm_data[i:i+n_bytes]
-                if self.vad.is_speech(chunk, sr):
-                    idx_start = i // 2
-                    idx_end = idx_start + n_samples
-                    voiced.append(audio_np[idx_start:idx_end])
-            return np.concatenate(voiced) if voiced else np.array([])
-    AdvancedVAD = WebRTCVADWrapper
-except ImportError:
-    AdvancedVAD = None
-
-class SimpleEnergyVAD:
-    def __init__(self, threshold=0.01): self.threshold = threshold
-    def process(self, audio_np, sr=16000):
-        frame_len = int(sr * 0.03)
-        n_frames = len(audio_np) // frame_len
-        speech = []
-        for i in range(n_frames):
-            frame = audio_np[i*frame_len : (i+1)*frame_len]
-            if np.mean(frame**2) > self.threshold: speech.append(frame)
-        return np.concatenate(speech) if speech else np.array([])
+# [优化] WebRTC / 能量两种判决统一由向量化的 VADEngine 实现
+from utilities.audio_processor.vad_engine import VADEngine, VAD_HANGOVER_MS, VAD_PAD_MS, gather_intervals
 
 # --- LLM 模块导入 ---
 try:
@@ -66,10 +36,15 @@ try:
 except ImportError:
     HAS_LLM = False
 
+# ASR 等待 Whisper 结果时检查取消的间隔 (秒)
+CANCEL_CHECK_SEC = 0.5
+
 # ================= 核心处理器类 =================
 
 class NodeProcessor:
-    def process(self, context, config, log_cb): raise NotImplementedError
+    def process(self, context, config, log_cb, cancel_token=None):
+        """cancel_token: 可选的 CancellationToken，耗时阶段在内部循环中检查"""
+        raise NotImplementedError
 
 class SourceProcessor(NodeProcessor):
     def __init__(self, resource_dir):
@@ -82,7 +57,7 @@ class SourceProcessor(NodeProcessor):
         else:
             self.recorder = None
 
-    def process(self, context, config, log_cb):
+    def process(self, context, config, log_cb, cancel_token=None):
         path = config.get('file_path')
         if not path: path = context.get('audio_path')
         
@@ -104,68 +79,81 @@ class SourceProcessor(NodeProcessor):
         
         context['audio_path'] = target
         context['orig_audio_path'] = target
+        # 解码一次，后续阶段都在内存缓冲区上处理
+        context['audio'] = AudioBuffer.from_file(target)
+        context['orig_audio'] = context['audio']
         
         mode_label = "Recorded" if config.get('mode') == 'mic' else "Loaded"
         log_cb(f"[Source] {mode_label}: {os.path.basename(target)}")
         return context
 
 class EnhancerProcessor(NodeProcessor):
-    def process(self, context, config, log_cb):
+    def process(self, context, config, log_cb, cancel_token=None):
         if not config.get('enable', True): 
             log_cb("[Enhancer] Skipped")
             return context
         
-        path = context['audio_path']
+        check_cancelled(cancel_token)
         log_cb("[Enhancer] Denoising...")
         
         try:
-            audio, sr = sf.read(path)
-            if len(audio.shape) > 1: audio = np.mean(audio, axis=1)
-            
-            clean = AudioEnhancer(sr=sr).reduce_noise(audio)
+            buf = get_audio(context)
+            clean = AudioEnhancer(sr=buf.sr, cache=GLOBAL_ENHANCE_CACHE).reduce_noise(buf.samples)
             
-            # 自动在同目录下生成 _clean 文件
-            out_path = path.replace(".wav", "_clean.wav")
-            sf.write(out_path, clean, sr)
-            context['audio_path'] = out_path
+            # 调试模式下才会在同目录下生成 _clean 文件
+            set_audio(context, buf.derive(clean, "enhance"), "_clean", log_cb)
         except Exception as e:
             log_cb(f"[Enhancer] Error: {e}. Skipping.")
         
         return context
 
 class VADProcessor(NodeProcessor):
-    def process(self, context, config, log_cb):
-        path = context['audio_path']
+    def process(self, context, config, log_cb, cancel_token=None):
+        """
+        [修改] 只检测语音区间并写入 context['speech_intervals'] (原始时间轴)，不再拼接生成 _vad 音频；
+        后续的说话人识别与 ASR 只在这些区间内计算
+        """
+        check_cancelled(cancel_token)
         agg = int(config.get('aggressiveness', 3))
         log_cb(f"[VAD] Processing (Agg={agg})...")
         
         try:
-            audio, sr = sf.read(path)
-            if len(audio.shape) > 1: audio = np.mean(audio, axis=1)
-            
-            vad = AdvancedVAD(aggressiveness=agg, sr=sr) if AdvancedVAD else SimpleEnergyVAD(0.005 * (agg + 1))
-            clean_speech = vad.process(audio, sr=sr)
+            buf = get_audio(context)
+            vad = VADEngine(aggressiveness=agg, sr=buf.sr)
+            intervals = vad.speech_intervals(buf.samples,
+                                             hangover_ms=config.get('hangover_ms', VAD_HANGOVER_MS),
+                                             pad_ms=config.get('pad_ms', VAD_PAD_MS))
             
-            if len(clean_speech) == 0:
+            if not intervals:
                 log_cb("[VAD] Warning: All silence. Keeping original.")
                 return context
             
-            out_path = path.replace(".wav", "_vad.wav")
-            sf.write(out_path, clean_speech, sr)
-            context['audio_path'] = out_path
+            context['speech_intervals'] = intervals
+            speech_sec = sum(e - s for s, e in intervals)
+            log_cb(f"[VAD] {vad.backend}: {len(intervals)} speech interval(s), {speech_sec:.1f}s of {buf.duration:.1f}s")
         except Exception as e:
             log_cb(f"[VAD] Error: {e}")
             
         return context
 
 class SpeakerIDProcessor(NodeProcessor):
-    def process(self, context, config, log_cb):
+    def __init__(self, engine=None):
+        # [优化] 复用服务器的常驻 SpeakerEngine，避免每个任务重新加载 ECAPA 模型
+        self.engine = engine
+
+    def process(self, context, config, log_cb, cancel_token=None):
         log_cb("[SpeakerID] Analyzing...")
+        if self.engine is None:
+            self.engine = SpeakerEngine()
         try:
-            audio, sr = sf.read(context['audio_path'])
-            timeline = SpeakerEngine().diarize(audio, sr=sr, 
+            buf = get_audio(context)
+            # [修改] 有 VAD 结果时只在语音区间内滑窗，时间戳仍对应原始录音
+            timeline = self.engine.diarize(buf.samples, sr=buf.sr, 
                                              window_sec=config.get('window', 1.5),
-                                             step_sec=config.get('step', 0.75))
+                                             step_sec=config.get('step', 0.75),
+                                             batch_size=config.get('batch_size', 32),
+                                             intervals=context.get('speech_intervals'),
+                                             cancel_token=cancel_token)
             context['timeline'] = timeline if timeline else []
             log_cb(f"[SpeakerID] Segments: {len(context['timeline'])}")
         finally:
@@ -176,98 +164,105 @@ class SpeakerIDProcessor(NodeProcessor):
 
 class ASRProcessor(NodeProcessor):
     def __init__(self, res_dir):
-        # [修改] 使用 uploads/temp_segments 目录
-        self.temp_dir = os.path.join(res_dir, "uploads", "temp_segments")
-        os.makedirs(self.temp_dir, exist_ok=True)
+        # [修改] 分段音频直接以内存视图送入 Whisper，不再写 uploads/temp_segments
+        self.upload_dir = os.path.join(res_dir, "uploads")
 
-    def process(self, context, config, log_cb):
+    def process(self, context, config, log_cb, cancel_token=None):
         model_size = config.get('model', 'small')
         full_correction = config.get('full_text_correction', False)
         enhanced_opt = config.get('enhanced_audio', False)
         
+        check_cancelled(cancel_token)
         log_cb(f"[ASR] Transcribing ({model_size})...")
-        engine = AsyncWhisperEngine(model_size=model_size)
+        # [优化] 从进程级模型池获取常驻引擎，不再每次任务重新加载模型
+        engine = GLOBAL_WHISPER_POOL.acquire(model_size)
+        tasks = []
         
         try:
             # --- 1. 处理 Segmented Audio ---
-            input_path = context['audio_path']
+            input_buf = get_audio(context)
             
             # [自动增强]
-            if enhanced_opt and "_clean" not in os.path.basename(input_path):
+            if enhanced_opt and not input_buf.has_step("enhance"):
                 log_cb("[ASR] Enhancing segmented input...")
                 try:
-                    audio_data, rate = sf.read(input_path)
-                    if len(audio_data.shape) > 1: audio_data = np.mean(audio_data, axis=1)
-                    clean_audio = AudioEnhancer(sr=rate).reduce_noise(audio_data)
-                    clean_path = input_path.replace(".wav", "_asr_clean.wav")
-                    sf.write(clean_path, clean_audio, rate)
-                    input_path = clean_path
+                    clean_audio = AudioEnhancer(sr=input_buf.sr, cache=GLOBAL_ENHANCE_CACHE).reduce_noise(input_buf.samples)
+                    input_buf = input_buf.derive(clean_audio, "enhance")
                 except Exception as e:
                     log_cb(f"[ASR] Enhancement failed: {e}, using original.")
             
-            audio, sr = sf.read(input_path)
+            audio, sr = input_buf.samples, input_buf.sr
             timeline = context.get('timeline', [])
-            tasks = []
+            check_cancelled(cancel_token)
 
-            # 提交分段任务
+            # 提交分段任务 (audio[s:e] 是原缓冲区的视图，不落盘)
             if timeline and len(timeline) > 0:
                 for i, seg in enumerate(timeline):
+                    check_cancelled(cancel_token)
                     s, e = int(seg['start']*sr), int(seg['end']*sr)
                     if e <= s: continue
-                    chunk_path = os.path.join(self.temp_dir, f"chunk_{i}.wav")
-                    sf.write(chunk_path, audio[s:e], sr)
-                    tid = engine.submit_task(chunk_path)
-                    tasks.append({'id': tid, 'type': 'segment', 'info': seg, 'path': chunk_path})
+                    fut = engine.submit_task(audio[s:e], sr=sr)
+                    tasks.append({'future': fut, 'type': 'segment', 'info': seg})
+            elif context.get('speech_intervals'):
+                # [新增] 没有说话人时间线时按 VAD 语音区间识别，跳过静音
+                log_cb(f"[ASR] No timeline. Transcribing {len(context['speech_intervals'])} speech interval(s).")
+                for start, end in context['speech_intervals']:
+                    check_cancelled(cancel_token)
+                    fut = engine.submit_task(audio[int(start*sr):int(end*sr)], sr=sr)
+                    tasks.append({'future': fut, 'type': 'segment', 'info': {'start':start,'end':end,'speaker':'?'}})
             else:
                 log_cb("[ASR] No timeline. Forcing full transcription.")
-                tid = engine.submit_task(input_path)
-                tasks.append({'id': tid, 'type': 'segment', 'info': {'start':0,'end':len(audio)/sr,'speaker':'?'}, 'path':None})
+                fut = engine.submit_task(audio, sr=sr)
+                tasks.append({'future': fut, 'type': 'segment', 'info': {'start':0,'end':len(audio)/sr,'speaker':'?'}})
 
             # --- 2. 处理 Full Text Audio ---
             full_text_result = ""
             if full_correction:
-                original_input = context.get('orig_audio_path', context['audio_path'])
-                if enhanced_opt and "_clean" not in os.path.basename(original_input):
-                    if os.path.basename(original_input) == os.path.basename(context['audio_path']) and "_asr_clean" in input_path:
-                         log_cb("[ASR] Reusing enhanced audio for full text.")
-                         original_input = input_path
+                original_buf = context.get('orig_audio', context['audio'])
+                if enhanced_opt and not original_buf.has_step("enhance"):
+                    if original_buf is context['audio'] and input_buf is not original_buf:
+                        # 当前音频就是原始音频，上面已做过增强，直接复用
+                        log_cb("[ASR] Reusing enhanced audio for full text.")
+                        original_buf = input_buf
                     else:
                         log_cb("[ASR] Enhancing full input...")
                         try:
-                            orig_data, orig_rate = sf.read(original_input)
-                            if len(orig_data.shape) > 1: orig_data = np.mean(orig_data, axis=1)
-                            clean_orig = AudioEnhancer(sr=orig_rate).reduce_noise(orig_data)
-                            clean_orig_path = original_input.replace(".wav", "_full_clean.wav")
-                            sf.write(clean_orig_path, clean_orig, orig_rate)
-                            original_input = clean_orig_path
+                            clean_orig = AudioEnhancer(sr=original_buf.sr, cache=GLOBAL_ENHANCE_CACHE).reduce_noise(original_buf.samples)
+                            original_buf = original_buf.derive(clean_orig, "enhance")
                         except Exception as e:
                             log_cb(f"[ASR] Full Enhancement failed: {e}")
 
-                log_cb(f"[ASR] + Full Correction: {os.path.basename(original_input)}")
-                full_text_tid = engine.submit_task(original_input)
-                tasks.append({'id': full_text_tid, 'type': 'full', 'info': None, 'path': None})
-
-            # 3. 等待结果
-            results_text = []
-            while True:
-                done = sum(1 for t in tasks if engine.get_task_status(t['id'])['status'] in ['COMPLETED', 'FAILED'])
-                if done == len(tasks): break
-                time.sleep(0.5)
+                log_cb(f"[ASR] + Full Correction: {' -> '.join(original_buf.provenance)}")
+                full_audio = original_buf.samples
+                if context.get('speech_intervals'):
+                    # 全文参考不需要时间轴，只拼接语音区间
+                    full_audio = gather_intervals(full_audio, context['speech_intervals'], original_buf.sr)
+                fut = engine.submit_task(full_audio, sr=original_buf.sr)
+                tasks.append({'future': fut, 'type': 'full', 'info': None})
 
-            # 4. 收集
-            for t in tasks:
-                res = engine.get_task_status(t['id'])
-                if res['status'] == 'COMPLETED':
-                    text = res['result'].strip()
+            # 3. 按完成顺序收集结果，分段结果一出来就推送；等待期间定期检查取消
+            order = {t['future']: i for i, t in enumerate(tasks)}
+            segment_lines = {}
+            pending = set(order)
+            while pending:
+                done, pending = wait(pending, timeout=CANCEL_CHECK_SEC, return_when=FIRST_COMPLETED)
+                check_cancelled(cancel_token)
+                for fut in sorted(done, key=order.get):
+                    t = tasks[order[fut]]
+                    engine.discard_task(fut.task_id)
+                    if fut.exception():
+                        log_cb(f"[ASR] Segment failed: {fut.exception()}")
+                        continue
+                    text = fut.result().strip()
                     if t['type'] == 'segment':
                         line = f"[{t['info']['start']:.1f}s] {t['info']['speaker']}: {text}"
-                        results_text.append(line)
+                        segment_lines[order[fut]] = line
                         log_cb(line, is_result=True)
                     elif t['type'] == 'full':
                         full_text_result = text
-                if t['path']: 
-                    try: os.remove(t['path'])
-                    except: pass
+
+            # 4. 按时间顺序整理
+            results_text = [segment_lines[i] for i in sorted(segment_lines)]
 
             # 5. 生成日志
             final_log_content = "=== Segmented Transcript ===\n" + "\n".join(results_text)
@@ -279,15 +274,23 @@ class ASRProcessor(NodeProcessor):
             
             # 保存 Log (建议也放到 uploads 下的 logs 目录)
             ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            log_dir = os.path.join(os.path.dirname(self.temp_dir), "meeting_logs") # 实际上是 resource/uploads/meeting_logs
+            log_dir = os.path.join(self.upload_dir, "meeting_logs") # resource/uploads/meeting_logs
             os.makedirs(log_dir, exist_ok=True)
             log_path = os.path.join(log_dir, f"Log_{ts}.txt")
             with open(log_path, 'w', encoding='utf-8') as f: f.write(final_log_content)
             
             context['log_path'] = log_path
             
+        except TaskCancelled:
+            # 丢弃本任务仍在 Whisper 队列中排队的分段，正在解码的分段无法中断
+            dropped = engine.cancel_pending([t['future'].task_id for t in tasks])
+            # [修复] 正在解码的分段完成后同样删除任务记录 (已完成/已取消的 Future 会立即回调)
+            for t in tasks:
+                t['future'].add_done_callback(lambda f: engine.discard_task(f.task_id))
+            log_cb(f"[ASR] Cancelled. Dropped {dropped} queued segment(s).")
+            raise
         finally:
-            del engine
+            GLOBAL_WHISPER_POOL.release(engine)
             gc.collect()
             if torch and torch.cuda.is_available():
                 torch.cuda.empty_cache()
@@ -295,8 +298,10 @@ class ASRProcessor(NodeProcessor):
         return context
 
 class LLMProcessor(NodeProcessor):
-    def process(self, context, config, log_cb):
+    def process(self, context, config, log_cb, cancel_token=None):
         if not config.get('enable', False) or not HAS_LLM: return context
+        # LLM 调用无法中途打断，调用前最后检查一次
+        check_cancelled(cancel_token)
         log_cb("[LLM] Summarizing...")
         
         backend = config.get('backend', 'Local')
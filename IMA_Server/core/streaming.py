@@ -0,0 +1,334 @@
+import os
+import time
+import queue
+import threading
+from collections import deque
+import numpy as np
+
+from core.audio_buffer import CANONICAL_SR
+from utilities.audio_processor.vad_engine import VADEngine, VAD_HANGOVER_MS, VAD_PAD_MS
+from utilities.audio_processor.enhancer import AudioEnhancer
+
+# 单句最长时长 (秒)：持续说话时到达该长度强制断句送入 ASR，保证转写延迟有上限
+LIVE_MAX_UTTERANCE_SEC = float(os.environ.get("IMA_LIVE_MAX_UTTERANCE_SEC", "15"))
+# [新增] 实时降噪的块长 (秒) 与每块前面拼接的上一块尾部 (秒)，避免块边界处的降噪突变
+LIVE_ENHANCE_BLOCK_SEC = float(os.environ.get("IMA_LIVE_ENHANCE_BLOCK_SEC", "3"))
+LIVE_ENHANCE_CONTEXT_SEC = 0.5
+# 未登记说话人的会话内聚类阈值 (与滚动平均声纹的余弦相似度)
+LIVE_CLUSTER_THRESHOLD = 0.5
+
+
+class Utterance:
+    """一句话：原始时间轴上的 [start, end) 秒与对应样本"""
+    __slots__ = ("index", "start", "end", "samples", "speaker")
+
+    def __init__(self, index, start, end, samples, speaker="?"):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.samples = samples
+        self.speaker = speaker
+
+    def __repr__(self):
+        return f"Utterance(#{self.index} {self.start:.2f}-{self.end:.2f}s {self.speaker})"
+
+
+class SpeakerTracker:
+    """
+    [新增] 流式说话人标注：每句话取滑窗声纹的平均值，先与声纹库匹配；
+    未登记的说话人在会话内按余弦相似度聚类，类中心为滚动平均声纹 ("Speaker 1"、"Speaker 2" ...)
+    """
+    def __init__(self, engine, window_sec=1.5, step_sec=0.75, sr=CANONICAL_SR,
+                 threshold=0.30, cluster_threshold=LIVE_CLUSTER_THRESHOLD):
+        self.engine = engine
+        self.window_samples = int(window_sec * sr)
+        self.step_samples = int(step_sec * sr)
+        self.threshold = threshold
+        self.cluster_threshold = cluster_threshold
+        self._centroids = []    # [(滚动平均声纹, 累计句数)]
+
+    def embed(self, samples):
+        if len(samples) < self.window_samples:
+            samples = np.pad(samples, (0, self.window_samples - len(samples)))
+        windows = self.engine.sliding_windows(samples, self.window_samples, self.step_samples)
+        emb = self.engine.db.extract_embeddings_batch(windows).mean(axis=0)
+        return emb / (np.linalg.norm(emb) + 1e-9)
+
+    def label(self, samples):
+        emb = self.embed(samples)
+        name, title, _ = self.engine.db.match_speakers(emb[None, :], threshold=self.threshold)[0]
+        if name != "Unknown":
+            return f"{name} ({title})" if title else name
+
+        if self._centroids:
+            sims = np.array([c @ emb for c, _ in self._centroids])
+            k = int(np.argmax(sims))
+            if sims[k] > self.cluster_threshold:
+                c, n = self._centroids[k]
+                c = c * n + emb
+                self._centroids[k] = (c / (np.linalg.norm(c) + 1e-9), n + 1)
+                return f"Speaker {k + 1}"
+        self._centroids.append((emb, 1))
+        return f"Speaker {len(self._centroids)}"
+
+
+class StreamingPipeline:
+    """
+    [新增] 实时流水线：录音过程中逐帧处理，不等会议结束。
+    由生成器串联：PCM 块 -> 30ms 帧 -> VAD 断句 (挂起 + 外扩，与离线 VAD 参数一致)
+    (-> 可选的分块降噪) -> 滚动声纹标注说话人 -> 句子结束即提交 ASR，结果按句子顺序通过 on_line 回调推送。
+    - push() 可在任意线程调用 (如录音线程的 on_frame 回调)，处理在内部线程中进行
+    - 单句超过 max_utterance_sec 时强制断句，转写延迟 ≈ 句长 + 挂起时长 + 解码时间
+    - close() 只需处理最后一句未结束的尾巴，并等待在途的 ASR 结果
+    """
+    def __init__(self, sr=CANONICAL_SR, frame_ms=30, vad_agg=3, hangover_ms=VAD_HANGOVER_MS, pad_ms=VAD_PAD_MS,
+                 max_utterance_sec=LIVE_MAX_UTTERANCE_SEC, speaker_engine=None, asr_engine=None, on_line=None,
+                 enhance=False):
+        self.sr = sr
+        self.enhancer = AudioEnhancer(sr=sr) if enhance else None
+        self.vad = VADEngine(aggressiveness=vad_agg, sr=sr, frame_ms=frame_ms)
+        self.frame_len = self.vad.frame_len
+        self.frame_sec = frame_ms / 1000
+        self.hangover_frames = int(round(hangover_ms / frame_ms))
+        self.pad_frames = int(round(pad_ms / frame_ms))
+        self.max_frames = max(1, int(max_utterance_sec / self.frame_sec))
+        self.speakers = SpeakerTracker(speaker_engine, sr=sr) if speaker_engine is not None else None
+        self.speaker_engine = speaker_engine
+        self.asr = asr_engine
+        self.on_line = on_line
+
+        self.segments = []          # 已完成转写的句子 {"start", "end", "speaker", "text"}，按时间顺序
+        self.samples_in = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._results = {}          # 句子序号 -> (utterance, text)，等待按顺序输出
+        self._next_emit = 0
+        self._submitted = 0
+        self._all_emitted = threading.Event()
+        self._done_feeding = False
+        self._error = None
+        self._thread = None
+
+    # --- 生成器各阶段 ---
+
+    def _chunks(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            yield chunk
+
+    @staticmethod
+    def samples(chunks):
+        """PCM16 字节块或 float32 数组 -> float32 数组"""
+        for chunk in chunks:
+            if isinstance(chunk, np.ndarray):
+                yield chunk.astype(np.float32, copy=False)
+            else:
+                yield np.frombuffer(chunk, dtype="<i2").astype(np.float32) / 32768.0
+
+    def enhance(self, blocks):
+        """
+        [新增] 分块降噪：攒够 LIVE_ENHANCE_BLOCK_SEC 后处理一次，每块前面拼上上一块的原始尾部作为上下文，
+        只输出本块对应的部分；未启用降噪时原样透传
+        """
+        if self.enhancer is None:
+            yield from blocks
+            return
+        block_len = int(LIVE_ENHANCE_BLOCK_SEC * self.sr)
+        context_len = int(LIVE_ENHANCE_CONTEXT_SEC * self.sr)
+        pending, context = [], np.zeros(0, dtype=np.float32)
+        size = 0
+
+        def run():
+            nonlocal context
+            raw = np.concatenate(pending)
+            if len(context) + len(raw) < self.sr // 4:
+                return raw      # 太短 (录音结尾的零头)，不足以估计噪声
+            clean = self.enhancer.reduce_noise(np.concatenate((context, raw)))[len(context):]
+            context = raw[-context_len:]
+            return clean.astype(np.float32, copy=False)
+
+        for block in blocks:
+            pending.append(block)
+            size += len(block)
+            if size >= block_len:
+                yield run()
+                pending, size = [], 0
+        if size:
+            yield run()
+
+    def frames(self, blocks):
+        """float32 数组 -> (帧序号, 帧样本)，跨块拼接不足一帧的余量"""
+        pending = np.zeros(0, dtype=np.float32)
+        idx = 0
+        for block in blocks:
+            pending = np.concatenate((pending, block))
+            n = len(pending) // self.frame_len
+            if n == 0:
+                continue
+            for frame in pending[:n * self.frame_len].reshape(n, self.frame_len):
+                yield idx, frame
+                idx += 1
+            pending = pending[n * self.frame_len:]
+
+    def utterances(self, frames):
+        """
+        流式断句：语音开始时带上之前 pad 帧作为前导，连续静音达到 hangover + pad 帧时结束一句；
+        输入结束时输出尚未结束的最后一句
+        """
+        preroll = deque(maxlen=max(self.pad_frames, 1))
+        current, start_idx, silence, count = None, 0, 0, 0
+
+        def emit():
+            nonlocal count
+            samples = np.concatenate(current)
+            u = Utterance(count, start_idx * self.frame_sec, (start_idx + len(current)) * self.frame_sec, samples)
+            count += 1
+            return u
+
+        for idx, frame in frames:
+            speech = self.vad.is_speech(frame)
+            if current is None:
+                if speech:
+                    lead = list(preroll) if self.pad_frames else []
+                    current, start_idx, silence = lead + [frame], idx - len(lead), 0
+                    preroll.clear()
+                else:
+                    preroll.append(frame)
+                continue
+            current.append(frame)
+            silence = 0 if speech else silence + 1
+            if silence >= self.hangover_frames + self.pad_frames or len(current) >= self.max_frames:
+                yield emit()
+                current = None
+        if current:
+            yield emit()
+
+    def label_speakers(self, utterances):
+        for u in utterances:
+            if self.speakers is not None:
+                u.speaker = self.speakers.label(u.samples)
+            yield u
+
+    # --- ASR 提交与按序输出 ---
+
+    def _submit(self, u):
+        if self.asr is None:
+            with self._lock:
+                self._submitted += 1
+            self._on_result(u, "")
+            return
+        # [修复] 提交成功后才计数：submit_task 抛出异常 (引擎已关闭/被回收) 时不会留下永远等不到的句子
+        fut = self.asr.submit_task(u.samples, sr=self.sr)
+        with self._lock:
+            self._submitted += 1
+        fut.add_done_callback(lambda f, u=u: self._on_done(u, f))
+
+    def _on_done(self, u, fut):
+        discard = getattr(self.asr, "discard_task", None)
+        if discard is not None:
+            discard(fut.task_id)
+        try:
+            text = fut.result().strip()
+        except Exception as e:
+            print(f"[Streaming] Utterance {u.index} failed: {e}")
+            text = ""
+        self._on_result(u, text)
+
+    def _on_result(self, u, text):
+        """结果可能乱序完成，只输出从 _next_emit 开始连续就绪的句子"""
+        with self._lock:
+            self._results[u.index] = (u, text)
+            while self._next_emit in self._results:
+                u, text = self._results.pop(self._next_emit)
+                self._next_emit += 1
+                # 未启用 ASR 时也输出句子 (只有说话人与时间)
+                if text or self.asr is None:
+                    seg = {"start": round(u.start, 2), "end": round(u.end, 2), "speaker": u.speaker, "text": text}
+                    self.segments.append(seg)
+                    if self.on_line is not None:
+                        try:
+                            self.on_line(self.format_line(seg), seg)
+                        except Exception as e:
+                            print(f"[Streaming] on_line callback failed: {e}")
+            if self._done_feeding and self._next_emit == self._submitted:
+                self._all_emitted.set()
+
+    @staticmethod
+    def format_line(seg):
+        # 与离线 ASRProcessor 的分段格式一致
+        return f"[{seg['start']:.1f}s] {seg['speaker']}: {seg['text']}"
+
+    # --- 生命周期 ---
+
+    def _run(self):
+        if self.speaker_engine is not None:
+            self.speaker_engine.db.acquire_model()
+        try:
+            for u in self.label_speakers(self.utterances(self.frames(self.enhance(self.samples(self._chunks()))))):
+                self._submit(u)
+        except Exception as e:
+            self._error = e
+            print(f"[Streaming] Pipeline error: {e}")
+            # 丢弃出错前已排队的音频；close() 不再等待在途结果 (出错时直接抛出)
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._all_emitted.set()
+        finally:
+            if self.speaker_engine is not None:
+                self.speaker_engine.db.release_model()
+            with self._lock:
+                self._done_feeding = True
+                if self._next_emit == self._submitted:
+                    self._all_emitted.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def push(self, chunk):
+        """
+        送入一块 PCM16 字节 (或 float32 数组)，可在任意线程调用。
+        [修复] 处理线程已出错退出时抛出 RuntimeError，不再向无人读取的队列堆积音频
+        """
+        if self._error is not None:
+            raise RuntimeError(f"Streaming pipeline stopped: {self._error}")
+        n = len(chunk) // 2 if isinstance(chunk, (bytes, bytearray, memoryview)) else len(chunk)
+        self.samples_in += n
+        self._queue.put(chunk)
+
+    @property
+    def duration(self):
+        return self.samples_in / self.sr
+
+    @property
+    def lag_sec(self):
+        """当前已接收音频与最后输出的句子结尾之间的差距"""
+        with self._lock:
+            last_end = self.segments[-1]["end"] if self.segments else 0.0
+        return max(0.0, self.duration - last_end)
+
+    def close(self, timeout=None):
+        """
+        输入结束：处理最后一句并等待在途的 ASR 结果
+        :param timeout: [新增] 总等待时长上限 (秒)；超时后返回已输出的句子，不再等待剩余结果
+        :return: 全部句子 (按时间顺序)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        remaining = lambda: None if deadline is None else max(0.0, deadline - time.monotonic())
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(remaining())
+        if not self._all_emitted.wait(remaining()):
+            with self._lock:
+                pending = self._submitted - self._next_emit
+            print(f"[Streaming] Gave up waiting for {pending} utterance(s) after {timeout:.0f}s")
+        if self._error is not None:
+            raise self._error
+        with self._lock:
+            return list(self.segments)
+
+    def transcript(self):
+        return "=== Segmented Transcript ===\n" + "\n".join(self.format_line(s) for s in self.segments)
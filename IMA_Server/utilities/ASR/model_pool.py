@@ -0,0 +1,110 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from .whisper_engine import AsyncWhisperEngine
+
+# 常驻模型内存预算 (MB)，超出后按 LRU 淘汰空闲模型
+WHISPER_POOL_RAM_BUDGET_MB = int(os.environ.get("IMA_WHISPER_RAM_BUDGET_MB", "4096"))
+
+
+class WhisperModelPool:
+    """
+    进程级 Whisper 模型池：按 model_size 缓存已加载的 AsyncWhisperEngine，
+    供并发的 /tasks/create 流水线共享，避免每个任务重新 load_model。
+    """
+    def __init__(self, ram_budget_mb=WHISPER_POOL_RAM_BUDGET_MB, engine_factory=AsyncWhisperEngine):
+        self.ram_budget = int(ram_budget_mb * 1024 * 1024)
+        self.engine_factory = engine_factory
+
+        self._lock = threading.Lock()
+        # { model_size: {"engine": AsyncWhisperEngine, "refs": int, "bytes": int} }，顺序即 LRU 顺序
+        self._entries = OrderedDict()
+        # 正在加载中的模型，防止并发请求重复加载同一个模型
+        self._loading = {}
+
+        self._stats = {"hits": 0, "misses": 0, "loads": 0, "evictions": 0, "load_time_total": 0.0, "load_time_last": 0.0}
+
+    def acquire(self, model_size="small"):
+        """
+        获取 (必要时加载) 指定大小的引擎，引用计数 +1。
+        用完后必须调用 release()。
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(model_size)
+                if entry:
+                    entry["refs"] += 1
+                    self._entries.move_to_end(model_size)
+                    self._stats["hits"] += 1
+                    return entry["engine"]
+
+                pending = self._loading.get(model_size)
+                if pending is None:
+                    # 由当前线程负责加载
+                    pending = threading.Event()
+                    self._loading[model_size] = pending
+                    self._stats["misses"] += 1
+                    break
+            # 其他线程正在加载，等待后重试
+            pending.wait()
+
+        try:
+            t0 = time.perf_counter()
+            engine = self.engine_factory(model_size=model_size)
+            elapsed = time.perf_counter() - t0
+
+            with self._lock:
+                self._entries[model_size] = {"engine": engine, "refs": 1, "bytes": engine.memory_bytes()}
+                self._stats["loads"] += 1
+                self._stats["load_time_total"] += elapsed
+                self._stats["load_time_last"] = elapsed
+                self._evict_locked()
+            print(f"[ModelPool] Loaded whisper '{model_size}' in {elapsed:.2f}s")
+            return engine
+        finally:
+            with self._lock:
+                self._loading.pop(model_size, None)
+            pending.set()
+
+    def release(self, engine):
+        """归还引擎，引用计数 -1；空闲模型保持常驻，直到超出预算被淘汰"""
+        with self._lock:
+            for entry in self._entries.values():
+                if entry["engine"] is engine:
+                    entry["refs"] = max(0, entry["refs"] - 1)
+                    break
+            self._evict_locked()
+
+    def _evict_locked(self):
+        """按 LRU 淘汰空闲模型，直到总占用回到预算以内 (调用方需持有锁)"""
+        total = sum(e["bytes"] for e in self._entries.values())
+        for size in list(self._entries.keys()):
+            if total <= self.ram_budget:
+                break
+            entry = self._entries[size]
+            if entry["refs"] > 0:
+                continue # 正在使用的模型不能淘汰
+            del self._entries[size]
+            total -= entry["bytes"]
+            entry["engine"].shutdown()
+            self._stats["evictions"] += 1
+            print(f"[ModelPool] Evicted whisper '{size}' (LRU)")
+
+    def stats(self):
+        """命中/未命中/加载耗时等计数器"""
+        with self._lock:
+            data = dict(self._stats)
+            data["resident"] = {
+                size: {"refs": e["refs"], "mb": round(e["bytes"] / 1024 / 1024, 1)}
+                for size, e in self._entries.items()
+            }
+            data["resident_mb"] = round(sum(e["bytes"] for e in self._entries.values()) / 1024 / 1024, 1)
+            data["budget_mb"] = round(self.ram_budget / 1024 / 1024, 1)
+        data["load_time_avg"] = data["load_time_total"] / data["loads"] if data["loads"] else 0.0
+        return data
+
+
+# 全局单例 (服务器进程内共享)
+GLOBAL_WHISPER_POOL = WhisperModelPool()
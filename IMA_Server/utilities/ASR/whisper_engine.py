@@ -6,18 +6,47 @@ import uuid
 import time
 import os
 import warnings
+from concurrent.futures import Future, as_completed
+from math import gcd
+import numpy as np
+from scipy.signal import resample_poly
 
 # 过滤显存警告
 warnings.filterwarnings("ignore")
 
+# Whisper 模型要求的输入采样率
+WHISPER_SR = whisper.audio.SAMPLE_RATE
+
+# 批量解码配置：单批最多分段数 / 凑批最长等待时间 (秒)
+WHISPER_BATCH_SIZE = int(os.environ.get("IMA_WHISPER_BATCH_SIZE", "8"))
+WHISPER_BATCH_WAIT = float(os.environ.get("IMA_WHISPER_BATCH_WAIT_MS", "50")) / 1000.0
+
+def to_whisper_input(audio, sr=WHISPER_SR):
+    """
+    [新增] 将内存中的音频转换为 Whisper 可直接使用的 16kHz float32 单声道数组。
+    已经是 16kHz float32 的一维切片会原样返回 (零拷贝视图)。
+    """
+    audio = np.asarray(audio)
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+    audio = audio.astype(np.float32, copy=False)
+    if sr != WHISPER_SR:
+        g = gcd(int(sr), WHISPER_SR)
+        audio = resample_poly(audio, WHISPER_SR // g, int(sr) // g).astype(np.float32, copy=False)
+    return audio
+
 class AsyncWhisperEngine:
-    def __init__(self, model_size="small"):
+    def __init__(self, model_size="small", batch_size=WHISPER_BATCH_SIZE, max_wait=WHISPER_BATCH_WAIT):
         """
         初始化 Whisper 引擎
         :param model_size: 模型大小 (tiny, base, small, medium, large)
                            RTX 4060 推荐使用 'small' 或 'medium'
+        :param batch_size: 批量解码的最大分段数，1 表示逐段 transcribe (原有行为)
+        :param max_wait: 凑批时最多等待后续分段的时间 (秒)
         """
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait = max(0.0, float(max_wait))
         print(f"[Engine] 正在加载 Whisper 模型 ({model_size}) 到 {self.device.upper()}...")
         
         # 加载模型 (耗时操作，只做一次)
@@ -37,59 +66,185 @@ class AsyncWhisperEngine:
         self.worker_thread = threading.Thread(target=self._worker, daemon=True)
         self.worker_thread.start()
 
+    def _batchable(self, audio):
+        """只有不超过一个 30s mel 窗口的内存分段可以合批解码"""
+        return self.batch_size > 1 and isinstance(audio, np.ndarray) and len(audio) <= whisper.audio.N_SAMPLES
+
+    def _collect_batch(self, first):
+        """
+        以 first 为起点，在 max_wait 内从队列继续取可合批的分段，最多 batch_size 个。
+        :return: (batch, singles, stop) singles 为不可合批的任务，stop 表示收到退出信号
+        """
+        batch, singles, stop = [first], [], False
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.task_queue.get(timeout=remaining) if remaining > 0 else self.task_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            if self._batchable(item[1]):
+                batch.append(item)
+            else:
+                singles.append(item)
+                break
+        return batch, singles, stop
+
     def _worker(self):
         """
         后台工作线程：不断从队列取任务并执行推理
         """
         while True:
             # 阻塞等待任务
-            task_id, file_path = self.task_queue.get()
-            
-            try:
-                # 更新状态为进行中
-                self.tasks[task_id]["status"] = "PROCESSING"
-                print(f"[Worker] 开始处理任务: {task_id} | 文件: {os.path.basename(file_path)}")
-
-                # 执行推理 (核心耗时步骤)
-                # fp16=True 在 GPU 上更快
-                result = self.model.transcribe(file_path, fp16=(self.device == "cuda"))
-                text = result["text"].strip()
-
-                # 更新结果
-                self.tasks[task_id]["status"] = "COMPLETED"
-                self.tasks[task_id]["result"] = text
-                print(f"[Worker] 任务完成: {task_id}")
-
-            except Exception as e:
-                self.tasks[task_id]["status"] = "FAILED"
-                self.tasks[task_id]["error"] = str(e)
-                print(f"[Worker] 任务失败: {task_id} | 原因: {e}")
-            
-            finally:
-                # 标记队列任务完成
+            item = self.task_queue.get()
+            if item is None:
+                # 收到退出信号 (shutdown)
                 self.task_queue.task_done()
+                break
+
+            if self._batchable(item[1]):
+                batch, singles, stop = self._collect_batch(item)
+            else:
+                batch, singles, stop = [], [item], False
+
+            if batch:
+                self._run_batch(batch)
+            for single in singles:
+                self._run_single(*single)
+
+            if stop:
+                self.task_queue.task_done()
+                break
+
+    def _start(self, task_id):
+        """
+        [新增] 标记任务开始执行；已被 cancel_pending 取消的任务返回 False 并清理记录
+        """
+        task = self.tasks.get(task_id)
+        if task is not None and task["status"] == "PROCESSING":
+            return True
+        if task is None or not task["future"].set_running_or_notify_cancel():
+            self.tasks.pop(task_id, None)
+            return False
+        task["status"] = "PROCESSING"
+        return True
+
+    def _run_single(self, task_id, audio):
+        """逐段推理 (文件输入、超过 30s 的分段或未开启批量模式)"""
+        try:
+            # 更新状态为进行中 (已取消的任务直接跳过)
+            if not self._start(task_id):
+                return
+            print(f"[Worker] 开始处理任务: {task_id} | 输入: {self.tasks[task_id]['file']}")
+
+            # 执行推理 (核心耗时步骤)
+            # audio 可以是文件路径，也可以是 16kHz float32 数组 (无需落盘/ffmpeg)
+            # fp16=True 在 GPU 上更快
+            result = self.model.transcribe(audio, fp16=(self.device == "cuda"))
+            text = result["text"].strip()
+
+            # 更新结果
+            self._complete(task_id, text)
+            print(f"[Worker] 任务完成: {task_id}")
+
+        except Exception as e:
+            self._fail(task_id, e)
+            print(f"[Worker] 任务失败: {task_id} | 原因: {e}")
+        
+        finally:
+            # 标记队列任务完成
+            self.task_queue.task_done()
+
+    def _run_batch(self, batch):
+        """
+        [新增] 批量推理：各分段补齐到 30s mel 窗口后堆叠，一次前向解码整批。
+        使用贪心解码 (temperature=0)，不做 transcribe 的温度回退。
+        """
+        # 跳过已取消的分段
+        live = [item for item in batch if self._start(item[0])]
+        for _ in range(len(batch) - len(live)):
+            self.task_queue.task_done()
+        batch = live
+        if not batch:
+            return
+        if len(batch) == 1:
+            self._run_single(*batch[0])
+            return
+
+        ids = [task_id for task_id, _ in batch]
+        print(f"[Worker] 批量处理 {len(ids)} 个分段: {', '.join(ids)}")
 
-    def submit_task(self, audio_file_path):
+        try:
+            n_mels = self.model.dims.n_mels
+            mel = torch.stack([
+                whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), n_mels=n_mels)
+                for _, audio in batch
+            ]).to(self.model.device)
+            options = whisper.DecodingOptions(fp16=(self.device == "cuda"), without_timestamps=True)
+            with torch.inference_mode():
+                results = whisper.decode(self.model, mel, options)
+        except Exception as e:
+            # 整批失败时退回逐段处理，避免一个坏分段拖垮整批
+            print(f"[Worker] 批量解码失败，退回逐段处理: {e}")
+            for item in batch:
+                self._run_single(*item)
+            return
+
+        for task_id, res in zip(ids, results):
+            # 与 transcribe 相同的静音判定
+            silent = res.no_speech_prob > 0.6 and res.avg_logprob < -1.0
+            self._complete(task_id, "" if silent else res.text.strip())
+            self.task_queue.task_done()
+        print(f"[Worker] 批量任务完成: {len(ids)} 个分段")
+
+    def _complete(self, task_id, text):
+        """写入结果并唤醒等待该任务 Future 的调用方"""
+        task = self.tasks[task_id]
+        task["status"] = "COMPLETED"
+        task["result"] = text
+        task["future"].set_result(text)
+
+    def _fail(self, task_id, error):
+        task = self.tasks[task_id]
+        task["status"] = "FAILED"
+        task["error"] = str(error)
+        task["future"].set_exception(error)
+
+    def submit_task(self, audio, sr=WHISPER_SR):
         """
-        提交一个音频文件进行转录
-        :return: task_id (str) 用于后续查询
+        提交一段音频进行转录
+        :param audio: 音频文件路径，或内存中的 numpy 数组 (可以是原始缓冲区的切片视图)
+        :param sr: audio 为数组时的采样率，非 16kHz 会自动重采样
+        :return: concurrent.futures.Future，完成时 result() 为转录文本；
+                 future.task_id 可用于 get_task_status 查询
         """
-        if not os.path.exists(audio_file_path):
-            raise FileNotFoundError(f"文件未找到: {audio_file_path}")
+        if isinstance(audio, (str, os.PathLike)):
+            if not os.path.exists(audio):
+                raise FileNotFoundError(f"文件未找到: {audio}")
+            label = os.path.basename(audio)
+        else:
+            audio = to_whisper_input(audio, sr)
+            label = f"<memory {len(audio) / WHISPER_SR:.1f}s>"
 
         task_id = str(uuid.uuid4())[:8] # 生成简短 ID
+        future = Future()
+        future.task_id = task_id
         
         # 初始化任务状态
         self.tasks[task_id] = {
             "status": "QUEUED",
-            "file": audio_file_path,
+            "file": label,
             "result": None,
-            "error": None
+            "error": None,
+            "future": future
         }
         
         # 放入队列
-        self.task_queue.put((task_id, audio_file_path))
-        return task_id
+        self.task_queue.put((task_id, audio))
+        return future
 
     def get_task_status(self, task_id):
         """
@@ -107,8 +262,95 @@ class AsyncWhisperEngine:
             return True
         return False
 
+    @staticmethod
+    def as_completed(futures, timeout=None):
+        """
+        [新增] 按完成顺序迭代 submit_task 返回的 Future，便于结果一出来就流式输出
+        """
+        yield from as_completed(futures, timeout=timeout)
+
+    def cancel_pending(self, task_ids):
+        """
+        [新增] 取消仍在队列中等待的任务 (Future 标记为 cancelled，worker 取出时直接丢弃)；
+        正在解码的任务不受影响。
+        :return: 实际取消的数量
+        """
+        cancelled = 0
+        for task_id in task_ids:
+            task = self.tasks.get(task_id)
+            if task is not None and task["status"] == "QUEUED" and task["future"].cancel():
+                task["status"] = "CANCELLED"
+                cancelled += 1
+        return cancelled
+
+    def discard_task(self, task_id):
+        """
+        [新增] 结果取走后删除任务记录，防止共享引擎的 tasks 字典无限增长
+        """
+        self.tasks.pop(task_id, None)
+
+    def memory_bytes(self):
+        """
+        [新增] 估算模型占用内存 (参数 + buffer)，供模型池做预算淘汰
+        """
+        if self.model is None:
+            return 0
+        params = sum(p.numel() * p.element_size() for p in self.model.parameters())
+        buffers = sum(b.numel() * b.element_size() for b in self.model.buffers())
+        return params + buffers
+
+    def shutdown(self):
+        """
+        [新增] 停止后台线程并释放模型 (模型池淘汰时调用)
+        """
+        self.task_queue.put(None)
+        self.worker_thread.join(timeout=5)
+        self.model = None
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+def benchmark_throughput(model_size="small", audio_path=None, n_segments=64, seg_sec=4.0, batch_sizes=(1, 8)):
+    """
+    [新增] 吞吐量对比：相同的一批分段分别用逐段模式 (batch_size=1) 与批量模式解码，输出 segments/sec。
+    :param audio_path: 用于切分段的真实录音 (推荐)，为空时使用合成噪声
+    """
+    if audio_path:
+        import soundfile as sf
+        data, rate = sf.read(audio_path, dtype='float32')
+        data = to_whisper_input(data, rate)
+    else:
+        data = np.random.uniform(-0.1, 0.1, int(WHISPER_SR * seg_sec * n_segments)).astype(np.float32)
+    seg_len = int(WHISPER_SR * seg_sec)
+    segments = [data[i:i + seg_len] for i in range(0, len(data) - seg_len + 1, seg_len)][:n_segments]
+
+    results = {}
+    for bs in batch_sizes:
+        engine = AsyncWhisperEngine(model_size=model_size, batch_size=bs)
+        t0 = time.perf_counter()
+        futures = [engine.submit_task(seg) for seg in segments]
+        failed = sum(1 for f in AsyncWhisperEngine.as_completed(futures) if f.exception())
+        elapsed = time.perf_counter() - t0
+        results[bs] = len(segments) / elapsed
+        print(f"[Bench] batch_size={bs:<3} segments={len(segments)} time={elapsed:.1f}s "
+              f"throughput={results[bs]:.2f} seg/s failed={failed}")
+        engine.shutdown()
+
+    base = results.get(1)
+    if base:
+        for bs, tput in results.items():
+            if bs != 1:
+                print(f"[Bench] batch_size={bs} speedup vs per-segment: {tput / base:.2f}x")
+    return results
+
 # --- 模拟主程序调用 (Example Usage) ---
+# python whisper_engine.py --bench [model_size] [audio.wav]  运行吞吐量对比
 if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        benchmark_throughput(model_size=sys.argv[2] if len(sys.argv) > 2 else "small",
+                             audio_path=sys.argv[3] if len(sys.argv) > 3 else None)
+        sys.exit(0)
+
     # 1. 实例化引擎 (这一步会加载模型，稍微花点时间)
     engine = AsyncWhisperEngine(model_size="small")
 
@@ -123,29 +365,19 @@ if __name__ == "__main__":
 
     print("\n--- 主程序继续运行 ---")
     
-    # 3. 提交任务 (非阻塞，立即返回 ID)
+    # 3. 提交任务 (非阻塞，立即返回 Future)
     print(">>> 提交任务...")
-    t_id = engine.submit_task(test_file)
-    print(f">>> 任务已提交，ID: {t_id}")
-
-    # 4. 模拟主程序做其他事情，同时轮询状态
-    start_time = time.time()
-    while True:
-        status_info = engine.get_task_status(t_id)
-        status = status_info["status"]
-        
-        print(f"主程序正在忙... 任务状态: {status}")
-        
-        if status == "COMPLETED":
-            print("\n✅ 转换成功!")
-            print(f"识别内容: {status_info['result']}")
-            break
-        elif status == "FAILED":
-            print("\n❌ 转换失败")
-            print(f"错误信息: {status_info['error']}")
-            break
-        
-        time.sleep(0.5) # 模拟做其他操作
+    future = engine.submit_task(test_file)
+    print(f">>> 任务已提交，ID: {future.task_id}")
+
+    # 4. 主程序可以继续做其他事情，需要结果时等待 Future 即可 (无需轮询)
+    try:
+        text = future.result()
+        print("\n✅ 转换成功!")
+        print(f"识别内容: {text}")
+    except Exception as e:
+        print("\n❌ 转换失败")
+        print(f"错误信息: {e}")
 
     # 清理测试文件
     if os.path.exists(test_file):
@@ -0,0 +1,164 @@
+import io
+import os
+import time
+from math import gcd
+import numpy as np
+import soundfile as sf
+from scipy.signal import resample_poly
+
+# 传输格式 -> (soundfile 容器, 编码, 扩展名, MIME)
+FORMATS = {
+    "wav": ("WAV", "PCM_16", ".wav", "audio/wav"),
+    "flac": ("FLAC", "PCM_16", ".flac", "audio/flac"),
+    "opus": ("OGG", "OPUS", ".opus", "audio/ogg; codecs=opus"),
+}
+# 需要在入库时解码的压缩格式
+COMPRESSED_EXTS = {".flac", ".ogg", ".opus"}
+# Opus 编码器只接受这些采样率，其他采样率先重采样到 48 kHz
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+# libsndfile 的压缩级别对 Opus 即码率档位 (0 最高码率，1 最低)，0.9 约合 30 kbps，语音足够清晰
+OPUS_COMPRESSION_LEVEL = 0.9
+
+# Accept 头中的 MIME -> 传输格式
+_MIME_FORMATS = {
+    "audio/wav": "wav", "audio/x-wav": "wav", "audio/wave": "wav",
+    "audio/flac": "flac", "audio/x-flac": "flac",
+    "audio/ogg": "opus", "audio/opus": "opus",
+}
+
+
+def resample(samples, sr, target_sr):
+    """多相滤波重采样 (整数比例 up/down)"""
+    if sr == target_sr:
+        return samples
+    g = gcd(int(sr), int(target_sr))
+    return resample_poly(samples, target_sr // g, sr // g, axis=0).astype(np.float32)
+
+
+def encode(samples, sr, dst_path, fmt):
+    """把样本编码为 fmt 格式写入 dst_path，返回写入的字节数"""
+    container, subtype, _, _ = FORMATS[fmt]
+    if fmt == "opus" and sr not in OPUS_RATES:
+        samples, sr = resample(samples, sr, 48000), 48000
+    extra = {"compression_level": OPUS_COMPRESSION_LEVEL} if fmt == "opus" else {}
+    sf.write(dst_path, samples, sr, format=container, subtype=subtype, **extra)
+    return os.path.getsize(dst_path)
+
+
+def decode_to_wav(src_path, dst_path):
+    """
+    [新增] 入库时把压缩上传 (FLAC / Opus) 解码为流水线使用的 PCM wav，只解码一次
+    :return: dst_path
+    """
+    samples, sr = sf.read(src_path, dtype='float32')
+    tmp_path = dst_path + ".part"
+    sf.write(tmp_path, samples, sr, format="WAV", subtype="PCM_16")
+    os.replace(tmp_path, dst_path)
+    return dst_path
+
+
+def decode_chunk(data, target_sr):
+    """
+    [新增] 解码一个自包含的压缩音频块 (FLAC / Ogg Opus 的完整小文件)，下混并重采样到 target_sr
+    :return: float32 单声道样本
+    """
+    samples, sr = sf.read(io.BytesIO(data), dtype='float32', always_2d=True)
+    return resample(samples.mean(axis=1), sr, target_sr)
+
+
+def mime_format(content_type):
+    """Content-Type -> 传输格式 (wav / flac / opus)，无法识别时返回 None"""
+    return _MIME_FORMATS.get((content_type or "").split(";")[0].strip().lower())
+
+
+def negotiate(accept, default="wav"):
+    """
+    根据 Accept 头选择下载格式 (按 q 值，q 相同时按出现顺序)；
+    未指定或只接受 */*、audio/* 时返回 default
+    """
+    best, best_q = None, 0.0
+    for part in (accept or "").split(","):
+        fields = [f.strip() for f in part.split(";")]
+        mime = fields[0].lower()
+        q = 1.0
+        for f in fields[1:]:
+            if f.startswith("q="):
+                try: q = float(f[2:])
+                except ValueError: q = 0.0
+        fmt = _MIME_FORMATS.get(mime)
+        if fmt and q > best_q:
+            best, best_q = fmt, q
+    return best or default
+
+
+def get_representation(audio_path, fmt):
+    """
+    [新增] 返回 audio_path 的 fmt 格式版本路径：与原文件同名不同扩展名，
+    不存在时编码一次并缓存在原文件旁边 (入库后的音频不会再修改，缓存无需失效)
+    """
+    ext = FORMATS[fmt][2]
+    base, src_ext = os.path.splitext(audio_path)
+    if src_ext.lower() == ext:
+        return audio_path
+    target = base + ext
+    if os.path.exists(target):
+        return target
+    samples, sr = sf.read(audio_path, dtype='float32')
+    tmp_path = target + ".part"
+    encode(samples, sr, tmp_path, fmt)
+    os.replace(tmp_path, target)
+    return target
+
+
+def _speech_like(seconds, sr):
+    """合成近似语音的测试信号：带谐波的基频 + 音节节奏包络 + 停顿 + 底噪"""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * sr)) / sr
+    f0 = 120 + 30 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) * (np.sin(2 * np.pi * 0.1 * t) > -0.3)
+    return (0.2 * voice * envelope + 0.005 * rng.standard_normal(len(t))).astype(np.float32)
+
+
+def benchmark_transport(audio_path=None, seconds=600, sr=16000, work_dir="resource/bench_codec"):
+    """
+    [新增] 传输格式对比：每种格式的文件大小 (传输字节数)、客户端编码耗时、服务器入库解码耗时
+    :param audio_path: 真实录音 (推荐)，为空时使用 seconds 秒的合成语音信号
+    """
+    if audio_path:
+        samples, sr = sf.read(audio_path, dtype='float32')
+    else:
+        samples = _speech_like(seconds, sr)
+    os.makedirs(work_dir, exist_ok=True)
+    duration = len(samples) / sr
+
+    results = {}
+    for fmt in FORMATS:
+        path = os.path.join(work_dir, f"bench{FORMATS[fmt][2]}")
+        t0 = time.perf_counter()
+        size = encode(samples, sr, path, fmt)
+        t_enc = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        if fmt == "wav":
+            sf.read(path, dtype='float32')
+        else:
+            decode_to_wav(path, os.path.join(work_dir, "bench_ingest.wav"))
+        t_ingest = time.perf_counter() - t0
+        results[fmt] = {"bytes": size, "encode_sec": t_enc, "ingest_sec": t_ingest}
+
+    wav_bytes = results["wav"]["bytes"]
+    for fmt, r in results.items():
+        print(f"[Bench] {fmt:<5} {duration:.0f}s audio: {r['bytes'] / 1e6:7.2f} MB "
+              f"({wav_bytes / r['bytes']:5.1f}x smaller) encode={r['encode_sec']:.2f}s ingest={r['ingest_sec']:.2f}s")
+    for name in os.listdir(work_dir):
+        os.remove(os.path.join(work_dir, name))
+    os.rmdir(work_dir)
+    return results
+
+
+# python -m utilities.audio_processor.audio_codec --bench [audio.wav]
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        benchmark_transport(audio_path=sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,173 @@
+import os
+import time
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# 内存层容量 (MB)，按样本字节数计
+ENHANCE_CACHE_MB = int(os.environ.get("IMA_ENHANCE_CACHE_MB", "512"))
+# 磁盘层目录与容量 (MB)，容量设为 0 关闭磁盘层；磁盘层让任务重试 / 服务重启后也能命中
+ENHANCE_CACHE_DIR = os.environ.get("IMA_ENHANCE_CACHE_DIR", os.path.join("resource", "cache", "enhanced"))
+ENHANCE_CACHE_DISK_MB = int(os.environ.get("IMA_ENHANCE_CACHE_DISK_MB", "2048"))
+
+
+def audio_digest(samples, sr, params):
+    """
+    内容寻址键：blake2b(样本字节 + 采样率 + 增强参数)，与文件名无关
+    """
+    samples = np.ascontiguousarray(samples, dtype=np.float32)
+    h = hashlib.blake2b(digest_size=20)
+    h.update(json.dumps({"sr": int(sr), "params": params}, sort_keys=True).encode("utf-8"))
+    h.update(memoryview(samples).cast("B"))
+    return h.hexdigest()
+
+
+class EnhanceCache:
+    """
+    降噪结果缓存：内存 LRU (按字节数限额) + 可选磁盘层 (.npy，按 mtime 淘汰)。
+    同一段音频在同一任务内或跨任务重试都只降噪一次。
+    """
+    def __init__(self, max_bytes=ENHANCE_CACHE_MB * 1024 * 1024,
+                 disk_dir=ENHANCE_CACHE_DIR, disk_max_bytes=ENHANCE_CACHE_DISK_MB * 1024 * 1024):
+        self.max_bytes = int(max_bytes)
+        self.disk_dir = disk_dir if disk_max_bytes > 0 else None
+        self.disk_max_bytes = int(disk_max_bytes)
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # 正在计算中的键，避免并发任务重复降噪同一段音频
+        self._pending = {}
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    # --- 内存层 ---
+    def _mem_get(self, key):
+        item = self._items.get(key)
+        if item is not None:
+            self._items.move_to_end(key)
+        return item
+
+    def _mem_put(self, key, value):
+        if value.nbytes > self.max_bytes:
+            return
+        if key in self._items:
+            self._bytes -= self._items.pop(key).nbytes
+        self._items[key] = value
+        self._bytes += value.nbytes
+        while self._bytes > self.max_bytes and self._items:
+            _, old = self._items.popitem(last=False)
+            self._bytes -= old.nbytes
+            self._stats["evictions"] += 1
+
+    # --- 磁盘层 ---
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.npy")
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            value = np.load(path, allow_pickle=False)
+            os.utime(path)
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def _disk_put(self, key, value):
+        if not self.disk_dir or value.nbytes > self.disk_max_bytes:
+            return
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            # [修复] 临时文件名每次唯一：多个 worker 进程可能同时写入同一个键
+            fd, tmp = tempfile.mkstemp(dir=self.disk_dir, prefix=f"{key}.", suffix=".tmp")
+        except OSError as e:
+            print(f"[EnhanceCache] Disk write failed: {e}")
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, value, allow_pickle=False)
+            os.replace(tmp, self._disk_path(key))
+            self._disk_evict()
+        except OSError as e:
+            print(f"[EnhanceCache] Disk write failed: {e}")
+            try: os.remove(tmp)
+            except OSError: pass
+
+    def _disk_evict(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".npy"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    # --- 对外接口 ---
+    def get_or_compute(self, samples, sr, params, compute):
+        """
+        :param compute: 未命中时调用 compute(samples) 得到增强结果
+        :return: 增强后的 float32 数组 (与缓存共享内存，调用方不要原地修改)
+        """
+        key = audio_digest(samples, sr, params)
+        while True:
+            with self._lock:
+                value = self._mem_get(key)
+                if value is not None:
+                    self._stats["hits"] += 1
+                    return value
+                event = self._pending.get(key)
+                if event is None:
+                    self._pending[key] = threading.Event()
+                    break
+            # 其他线程正在处理同一段音频，等待其结果
+            event.wait()
+
+        try:
+            value = self._disk_get(key)
+            if value is not None:
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+            else:
+                with self._lock:
+                    self._stats["misses"] += 1
+                t0 = time.perf_counter()
+                value = np.asarray(compute(samples), dtype=np.float32)
+                print(f"[EnhanceCache] Enhanced {len(value) / sr:.1f}s audio in {time.perf_counter() - t0:.2f}s")
+                self._disk_put(key, value)
+            with self._lock:
+                self._mem_put(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._pending.pop(key).set()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data.update({"entries": len(self._items), "mem_bytes": self._bytes,
+                         "mem_budget_bytes": self.max_bytes, "disk_dir": self.disk_dir})
+        return data
+
+
+# 全局单例
+GLOBAL_ENHANCE_CACHE = EnhanceCache()
@@ -4,14 +4,33 @@ import noisereduce as nr
 import soundfile as sf
 from pydub import AudioSegment
 
+try:
+    from importlib.metadata import version as _pkg_version
+    NR_VERSION = _pkg_version("noisereduce")
+except Exception:
+    NR_VERSION = "unknown"
+
 class AudioEnhancer:
-    def __init__(self, sr=16000):
+    def __init__(self, sr=16000, cache=None):
+        """
+        :param cache: 可选的 EnhanceCache，命中时直接返回之前的降噪结果
+        """
         self.sr = sr
+        self.cache = cache
+
+    def cache_params(self):
+        """参与缓存键计算的增强参数 (算法或参数变化时缓存自动失效)"""
+        return {"algo": "noisereduce", "version": NR_VERSION, "stationary": False}
 
     def reduce_noise(self, audio_data):
         """
         [新增] 直接对 numpy 数组进行降噪处理，符合项目缓解复杂环境噪声的策略 [cite: 31, 32]
         """
+        if self.cache is not None:
+            return self.cache.get_or_compute(audio_data, self.sr, self.cache_params(), self._reduce_noise)
+        return self._reduce_noise(audio_data)
+
+    def _reduce_noise(self, audio_data):
         # 使用 noisereduce 库处理平稳噪声 
         reduced_audio = nr.reduce_noise(y=audio_data, sr=self.sr)
         return reduced_audio
@@ -1,65 +1,74 @@
 import os
-import wave
 import threading
 import pyaudio
 import webrtcvad
 from datetime import datetime
 
+from .wav_spill import SpillingWavWriter, recover_recordings
+
 class RealTimeAudioProvider:
     def __init__(self, sr=16000, chunk_ms=30, resource_path="resource"):
         self.sr = sr
         self.chunk_size = int(sr * chunk_ms / 1000)
         self.vad = webrtcvad.Vad(3)
         self.is_running = False
-        self.all_frames = []
         self.resource_path = resource_path
         self.custom_filename = None
+        # [新增] 每个 30ms 帧的回调 (实时流水线 / 边录边传)，在录音线程中调用
+        self.on_frame = None
 
     def _record_loop(self):
         p = pyaudio.PyAudio()
         stream = p.open(format=pyaudio.paInt16, channels=1, rate=self.sr,
                         input=True, frames_per_buffer=self.chunk_size)
+        # [优化] 帧写入固定大小的环形缓冲区并定期追加到磁盘，内存占用与会议时长无关
+        writer = SpillingWavWriter(self._target_path(), self.sr)
         
-        while self.is_running:
-            data = stream.read(self.chunk_size, exception_on_overflow=False)
-            self.all_frames.append(data)
-                
-        stream.stop_stream()
-        stream.close()
-        p.terminate()
-        self._save_to_file()
+        try:
+            while self.is_running:
+                data = stream.read(self.chunk_size, exception_on_overflow=False)
+                writer.write(data)
+                if self.on_frame is not None:
+                    try:
+                        self.on_frame(data)
+                    except Exception as e:
+                        print(f"[Recorder] on_frame callback failed: {e}")
+        finally:
+            stream.stop_stream()
+            stream.close()
+            p.terminate()
+            full_path = writer.close()
+            if full_path:
+                print(f"\n>>> 录音已妥善保存至: {full_path} ")
+            self.custom_filename = None
 
-    def _save_to_file(self):
-        if not self.all_frames:
-            return
-            
-        # --- 修改开始: 确保保存到 resource/raw 目录 ---
+    def _raw_dir(self):
+        # --- 确保保存到 resource/raw 目录 ---
         raw_dir = os.path.join(self.resource_path, "raw")
-        if not os.path.exists(raw_dir):
-            os.makedirs(raw_dir)
-            
+        os.makedirs(raw_dir, exist_ok=True)
+        return raw_dir
+
+    def _target_path(self):
         if self.custom_filename:
             file_name = self.custom_filename if self.custom_filename.endswith('.wav') else f"{self.custom_filename}.wav"
         else:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             file_name = f"meeting_{timestamp}.wav"
-            
-        full_path = os.path.join(raw_dir, file_name)
-        # --- 修改结束 ---
-        
-        with wave.open(full_path, 'wb') as wf:
-            wf.setnchannels(1)
-            wf.setsampwidth(2)
-            wf.setframerate(self.sr)
-            wf.writeframes(b''.join(self.all_frames))
-        
-        print(f"\n>>> 录音已妥善保存至: {full_path} ")
-        self.all_frames = []
-        self.custom_filename = None 
+        return os.path.join(self._raw_dir(), file_name)
+
+    def recover(self):
+        """[新增] 找回上次崩溃时未正常结束的录音 (.wav.part -> .wav)"""
+        recovered = recover_recordings(self._raw_dir())
+        for path in recovered:
+            print(f">>> 已找回中断的录音: {path}")
+        return recovered
 
-    def start(self, filename=None):
+    def start(self, filename=None, on_frame=None):
+        """on_frame: 可选，接收每个 PCM16 帧 (bytes) 的回调，录音的同时送入实时处理"""
+        self.recover()
         self.is_running = True
         self.custom_filename = filename
+        self.on_frame = on_frame
         self.thread = threading.Thread(target=self._record_loop, daemon=True)
         self.thread.start()
 
@@ -0,0 +1,151 @@
+import os
+import numpy as np
+
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
+
+# WebRTC VAD 支持的采样率与帧长
+WEBRTC_RATES = (8000, 16000, 32000, 48000)
+WEBRTC_FRAME_MS = (10, 20, 30)
+# [新增] 语音区间平滑：语音结束后的挂起时长 (短于它的停顿不切断)，以及区间两端各外扩的时长
+VAD_HANGOVER_MS = int(os.environ.get("IMA_VAD_HANGOVER_MS", "300"))
+VAD_PAD_MS = int(os.environ.get("IMA_VAD_PAD_MS", "200"))
+
+
+def frame_matrix(audio, sr, frame_ms=30):
+    """
+    把一维信号切成 (n_frames, frame_len) 的二维帧矩阵 (对原数组的零拷贝视图)，
+    末尾不足一帧的样本丢弃
+    """
+    audio = np.ascontiguousarray(audio, dtype=np.float32)
+    frame_len = int(sr * frame_ms / 1000)
+    n_frames = len(audio) // frame_len
+    return audio[:n_frames * frame_len].reshape(n_frames, frame_len)
+
+
+def frame_energy(frames):
+    """每帧的平均能量，一次向量化计算"""
+    return np.einsum("ij,ij->i", frames, frames) / frames.shape[1]
+
+
+def mask_to_intervals(mask):
+    """
+    把逐帧的语音掩码合并为连续区间
+    :return: (n, 2) int 数组，每行为 [起始帧, 结束帧)
+    """
+    padded = np.concatenate(([False], np.asarray(mask, dtype=bool), [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return edges.reshape(-1, 2)
+
+
+def _merge_runs(starts, ends, max_gap):
+    """合并间隙 <= max_gap 的相邻区间 (starts/ends 已按时间排序)"""
+    keep = np.concatenate(([True], starts[1:] - ends[:-1] > max_gap))
+    heads = np.flatnonzero(keep)
+    return starts[heads], np.maximum.reduceat(ends, heads)
+
+
+def smooth_intervals(runs, frame_sec, total_sec, hangover_sec=VAD_HANGOVER_MS / 1000, pad_sec=VAD_PAD_MS / 1000):
+    """
+    [新增] 帧区间 -> 平滑后的时间区间 (秒，原始时间轴)：
+    1. 挂起：停顿不超过 hangover_sec 的相邻语音段合并，每段末尾再延长 hangover_sec
+    2. 外扩：每段两端各加 pad_sec (不超出音频范围)，外扩后重叠的区间再合并
+    :param runs: mask_to_intervals 的结果
+    """
+    if len(runs) == 0:
+        return []
+    starts = runs[:, 0] * frame_sec
+    ends = runs[:, 1] * frame_sec
+    starts, ends = _merge_runs(starts, ends, hangover_sec)
+    ends = ends + hangover_sec
+    starts = np.maximum(starts - pad_sec, 0.0)
+    ends = np.minimum(ends + pad_sec, total_sec)
+    starts, ends = _merge_runs(starts, ends, 0.0)
+    return [(round(float(s), 3), round(float(e), 3)) for s, e in zip(starts, ends)]
+
+
+def gather_intervals(audio, intervals, sr):
+    """把各语音区间的样本按顺序拼接 (用于不需要时间轴的全文识别)"""
+    if not intervals:
+        return np.asarray(audio)[:0]
+    return np.concatenate([audio[int(s * sr):int(e * sr)] for s, e in intervals])
+
+
+class VADEngine:
+    """
+    [新增] 共享的 VAD 引擎：
+    - 信号先整理成二维帧矩阵 (零拷贝)，能量后端的逐帧能量一次向量化算完
+    - WebRTC 后端的 PCM 转换整体完成一次，逐帧传入内存视图不复制
+      (WebRTC VAD 内部有自适应状态，所有帧都必须按顺序送入，不能跳过)
+    - 输出逐帧布尔掩码与合并后的语音区间，调用方用一次花式索引即可拼出有声部分
+    未安装 webrtcvad 或采样率不受支持时退回能量阈值判决。
+    """
+    def __init__(self, aggressiveness=3, sr=16000, frame_ms=30, energy_threshold=None):
+        self.aggressiveness = int(aggressiveness)
+        self.sr = int(sr)
+        self.frame_ms = frame_ms
+        # 能量后端阈值，默认随灵敏度提高 (与原 SimpleEnergyVAD 一致)
+        self.energy_threshold = energy_threshold if energy_threshold is not None else 0.005 * (self.aggressiveness + 1)
+        self._vad = None
+        if webrtcvad is not None and self.sr in WEBRTC_RATES and frame_ms in WEBRTC_FRAME_MS:
+            self._vad = webrtcvad.Vad(self.aggressiveness)
+
+    @property
+    def backend(self):
+        return "webrtc" if self._vad is not None else "energy"
+
+    @property
+    def frame_len(self):
+        return int(self.sr * self.frame_ms / 1000)
+
+    def classify(self, audio):
+        """:return: (frames, mask) 帧矩阵与逐帧语音掩码"""
+        frames = frame_matrix(audio, self.sr, self.frame_ms)
+        if self._vad is None:
+            return frames, frame_energy(frames) > self.energy_threshold
+        if len(frames) == 0:
+            return frames, np.zeros(0, dtype=bool)
+
+        pcm = (np.clip(frames, -1.0, 1.0) * 32767).astype(np.int16)
+        view = memoryview(pcm).cast("B")
+        n_bytes = frames.shape[1] * 2
+        is_speech, sr = self._vad.is_speech, self.sr
+        mask = np.fromiter((is_speech(view[o:o + n_bytes], sr) for o in range(0, len(view), n_bytes)),
+                           dtype=bool, count=len(frames))
+        return frames, mask
+
+    def is_speech(self, frame):
+        """
+        [新增] 单帧判决 (流式处理时逐帧调用)；frame 为 frame_len 个 float32 样本。
+        WebRTC 后端沿用同一个有状态的 Vad 实例，结果与整段 classify 一致
+        """
+        if self._vad is None:
+            return float(np.dot(frame, frame)) / len(frame) > self.energy_threshold
+        pcm = (np.clip(frame, -1.0, 1.0) * 32767).astype(np.int16)
+        return self._vad.is_speech(pcm.tobytes(), self.sr)
+
+    def process(self, audio):
+        """
+        :return: (mask, intervals) intervals 为 [(start_sec, end_sec), ...]
+        """
+        _, mask = self.classify(audio)
+        return mask, self.intervals_sec(mask)
+
+    def intervals_sec(self, mask):
+        frame_sec = self.frame_ms / 1000
+        return [(int(s) * frame_sec, int(e) * frame_sec) for s, e in mask_to_intervals(mask)]
+
+    def speech_intervals(self, audio, hangover_ms=VAD_HANGOVER_MS, pad_ms=VAD_PAD_MS):
+        """
+        [新增] 平滑后的语音区间 [(start_sec, end_sec), ...]，时间以输入音频开头为 0，不拼接音频
+        """
+        _, mask = self.classify(audio)
+        return smooth_intervals(mask_to_intervals(mask), self.frame_ms / 1000, len(audio) / self.sr,
+                                hangover_ms / 1000, pad_ms / 1000)
+
+    def extract(self, audio):
+        """只保留有声帧并拼接 (一次花式索引)，全部为静音时返回空数组"""
+        frames, mask = self.classify(audio)
+        return frames[mask].reshape(-1)
@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# 写锁被占用时的等待时间 (毫秒)
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("IMA_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# 每条连接缓存的已编译语句数 (重复执行的 SQL 只编译一次)
+SQLITE_STATEMENT_CACHE = 256
+
+_REGISTRY = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+class Database:
+    """
+    SQLite 数据访问层：
+    - 每个线程复用一条长连接 (thread-local)，不再每次调用都 connect/close
+    - WAL 日志模式：读不阻塞写、写不阻塞读，适合高频轮询
+    - 连接级语句缓存 (prepared statements)
+    - schema 初始化每个进程只执行一次
+    连接为自动提交模式，需要原子性的多条写入使用 transaction()。
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = set()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+                               isolation_level=None, cached_statements=SQLITE_STATEMENT_CACHE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        return conn
+
+    @property
+    def conn(self):
+        """当前线程的连接 (进程 fork 后自动重建)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.depth = 0
+        return conn
+
+    def init_schema(self, name, init_fn):
+        """
+        执行一次 schema 初始化 (建表/迁移)，同名初始化在本进程内只运行一次
+        :param init_fn: init_fn(conn)
+        """
+        if name in self._schema_ready:
+            return
+        with self._schema_lock:
+            if name in self._schema_ready:
+                return
+            with self.transaction() as conn:
+                init_fn(conn)
+            self._schema_ready.add(name)
+
+    # --- 读写接口 ---
+    def execute(self, sql, params=()):
+        return self.conn.execute(sql, params)
+
+    def query(self, sql, params=()):
+        return self.conn.execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        return self.conn.execute(sql, params).fetchone()
+
+    def executemany(self, sql, seq_of_params):
+        """批量写入：在一个事务内执行，只提交一次"""
+        with self.transaction() as conn:
+            return conn.executemany(sql, seq_of_params)
+
+    @contextmanager
+    def transaction(self):
+        """
+        BEGIN IMMEDIATE 事务 (立即占用写锁，避免读后写升级时的死锁)；支持嵌套，只有最外层提交
+        """
+        conn = self.conn
+        if self._local.depth == 0:
+            conn.execute("BEGIN IMMEDIATE")
+        self._local.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                conn.execute("ROLLBACK")
+            raise
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            conn.execute("COMMIT")
+
+    def close(self):
+        """关闭当前线程的连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def get_database(path):
+    """同一路径在进程内共享一个 Database 实例"""
+    key = os.path.abspath(path)
+    with _REGISTRY_LOCK:
+        db = _REGISTRY.get(key)
+        if db is None:
+            db = _REGISTRY[key] = Database(path)
+        return db
@@ -1,43 +1,104 @@
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from .speaker_db import SpeakerDB
 
+# 每次送入 ECAPA 的滑窗数量
+DIARIZE_BATCH_SIZE = 32
+
+class _WindowIndex:
+    """
+    [新增] 按起点索引取滑窗的惰性序列：只有被切片的批次才物化，
+    配合 extract_embeddings_batch 使用，避免一次性复制所有语音区间内的窗口
+    """
+    def __init__(self, view, starts):
+        self.view = view
+        self.starts = starts
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, sl):
+        return self.view[self.starts[sl]]
+
+
 class SpeakerEngine:
     def __init__(self):
         # 实例化 DB 时会自动加载模型 (init -> load_model)
         self.db = SpeakerDB()
 
-    def diarize(self, audio_np, sr=16000, window_sec=1.5, step_sec=0.75):
+    @staticmethod
+    def sliding_windows(audio_np, window_samples, step_samples):
+        """
+        [新增] 以 strided 视图构造所有滑窗 (N, window_samples)，不复制音频数据
+        """
+        if len(audio_np) < window_samples:
+            return np.zeros((0, window_samples), dtype=audio_np.dtype)
+        return sliding_window_view(audio_np, window_samples)[::step_samples]
+
+    @staticmethod
+    def interval_windows(intervals, n_samples, sr, window_samples, step_samples):
+        """
+        [新增] 只在语音区间内放置滑窗：
+        - 区间内按步长滑动，最后补一个与区间末尾对齐的窗口，保证尾部也被覆盖
+        - 短于窗长的区间以区间中心放置一个窗口 (受音频边界限制)
+        :return: (starts, spans) 窗口起点 (样本) 与每个窗口在原始时间轴上对应的 [start, end) 秒
+        """
+        starts, spans = [], []
+        for s_sec, e_sec in intervals:
+            s, e = int(s_sec * sr), min(int(e_sec * sr), n_samples)
+            if e - s <= window_samples:
+                c = min(max((s + e) // 2 - window_samples // 2, 0), n_samples - window_samples)
+                starts.append(c)
+                spans.append((s / sr, e / sr))
+                continue
+            offs = list(range(s, e - window_samples + 1, step_samples))
+            if offs[-1] + window_samples < e:
+                offs.append(e - window_samples)
+            starts.extend(offs)
+            spans.extend(((o / sr, (o + window_samples) / sr) for o in offs))
+        return np.asarray(starts, dtype=np.int64), spans
+
+    def diarize(self, audio_np, sr=16000, window_sec=1.5, step_sec=0.75, batch_size=DIARIZE_BATCH_SIZE,
+                intervals=None, cancel_token=None):
         """
-        对音频进行滑窗识别，并在结束后释放显存。
+        对音频进行滑窗识别，结束后按常驻策略处理模型 (常驻 / 空闲超时卸载 / 立即卸载)。
+        cancel_token 在每个批次之间检查，取消时抛出 TaskCancelled。
+        :param intervals: [新增] VAD 语音区间 [(start_sec, end_sec), ...]，给出时只在区间内提取声纹，
+                          跳过静音，返回的时间戳仍对应原始音频
         """
         if len(audio_np) == 0:
-            self.db.unload_model() # 安全起见
             return []
 
         window_samples = int(window_sec * sr)
         step_samples = int(step_sec * sr)
-        total_samples = len(audio_np)
+        audio_np = np.asarray(audio_np, dtype=np.float32)
+        if intervals is not None and len(audio_np) < window_samples:
+            intervals = None
         
         segments = []
         
+        self.db.acquire_model()
         try:
-            # 1. 滑动窗口遍历
-            for i in range(0, total_samples - window_samples + 1, step_samples):
-                chunk = audio_np[i : i + window_samples]
-                
-                # 提取声纹 (如果模型被卸载，这里会自动重载)
-                embedding = self.db.extract_embedding_from_memory(chunk)
-                
-                # 数据库匹配 (纯 CPU)
-                name, title = self.db.match_speaker(embedding, threshold=0.30)
+            # 1. 滑窗视图 + 批量提取声纹 (如果模型被卸载，这里会自动重载)
+            if intervals is not None:
+                starts, spans = self.interval_windows(intervals, len(audio_np), sr, window_samples, step_samples)
+                windows = _WindowIndex(sliding_window_view(audio_np, window_samples), starts)
+            else:
+                windows = self.sliding_windows(audio_np, window_samples, step_samples)
+                spans = [(i * step_samples / sr, (i * step_samples + window_samples) / sr) for i in range(len(windows))]
+            embeddings = self.db.extract_embeddings_batch(windows, batch_size=batch_size, cancel_token=cancel_token)
+            
+            # 数据库匹配 (纯 CPU，整批一次矩阵乘法)
+            matches = self.db.match_speakers(embeddings, threshold=0.30)
+            
+            for idx, (name, title, _) in enumerate(matches):
                 
                 if name != "Unknown":
                     display_name = f"{name} ({title})" if title else name
                 else:
                     display_name = "Unknown"
                 
-                start_t = i / sr
-                end_t = (i + window_samples) / sr
+                start_t, end_t = spans[idx]
                 
                 segments.append({
                     "start": float(f"{start_t:.2f}"),
@@ -45,11 +106,10 @@ class SpeakerEngine:
                     "speaker": display_name
                 })
         finally:
-            # [关键] 任务完成或出错后，立即卸载模型，释放 GPU
-            # print("[SpeakerEngine] Task done, unloading model...")
-            self.db.unload_model()
+            # [修改] 不再无条件卸载，交给 lifecycle 按策略决定
+            self.db.release_model()
 
-        # 2. 合并连续的相同说话人
+        # 2. 合并连续的相同说话人 (中间隔着静音的区间不合并)
         if not segments:
             return []
             
@@ -57,11 +117,54 @@ class SpeakerEngine:
         current = segments[0]
         
         for next_seg in segments[1:]:
-            if next_seg['speaker'] == current['speaker']:
-                current['end'] = next_seg['end']
+            if next_seg['speaker'] == current['speaker'] and next_seg['start'] <= current['end']:
+                current['end'] = max(current['end'], next_seg['end'])
             else:
                 merged.append(current)
                 current = next_seg
         merged.append(current)
         
-        return merged
\ No newline at end of file
+        return merged
+
+
+def benchmark_diarize(minutes=60, sr=16000, window_sec=1.5, step_sec=0.75, batch_sizes=(1, 16, 32, 64)):
+    """
+    [新增] 在合成的长录音上对比逐窗提取与批量提取声纹的耗时
+    """
+    import time
+    rng = np.random.default_rng(0)
+    # 合成录音：若干"说话人"的带限噪声交替出现
+    n = int(minutes * 60 * sr)
+    audio = (rng.standard_normal(n) * 0.05).astype(np.float32)
+    turn = int(8 * sr)
+    for k, s in enumerate(range(0, n, turn)):
+        t = np.arange(min(turn, n - s)) / sr
+        audio[s:s + len(t)] += 0.1 * np.sin(2 * np.pi * (120 + 40 * (k % 4)) * t).astype(np.float32)
+
+    engine = SpeakerEngine()
+    window_samples, step_samples = int(window_sec * sr), int(step_sec * sr)
+    windows = engine.sliding_windows(audio, window_samples, step_samples)
+    print(f"[Bench] {minutes} min synthetic audio -> {len(windows)} windows")
+
+    # 旧路径：逐窗调用 extract_embedding_from_memory
+    t0 = time.perf_counter()
+    for w in windows:
+        engine.db.extract_embedding_from_memory(np.array(w))
+    base = time.perf_counter() - t0
+    print(f"[Bench] per-window loop : {base:.1f}s ({len(windows) / base:.1f} win/s)")
+
+    for bs in batch_sizes:
+        t0 = time.perf_counter()
+        engine.db.extract_embeddings_batch(windows, batch_size=bs)
+        elapsed = time.perf_counter() - t0
+        print(f"[Bench] batch_size={bs:<4}: {elapsed:.1f}s ({len(windows) / elapsed:.1f} win/s, {base / elapsed:.2f}x)")
+
+    t0 = time.perf_counter()
+    timeline = engine.diarize(audio, sr=sr, window_sec=window_sec, step_sec=step_sec)
+    print(f"[Bench] full diarize     : {time.perf_counter() - t0:.1f}s, {len(timeline)} segments")
+
+
+# python -m utilities.diarization.engine [minutes]
+if __name__ == "__main__":
+    import sys
+    benchmark_diarize(minutes=float(sys.argv[1]) if len(sys.argv) > 1 else 60)
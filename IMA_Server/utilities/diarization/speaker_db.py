@@ -4,6 +4,10 @@ import os
 import datetime
 import io
 import gc
+import threading
+from ..model_lifecycle import ModelLifecycle, policy_from_env
+from ..database import get_database
+from .speaker_index import SpeakerIndex, SPEAKER_INDEX_BACKEND, create_index, resolve_backend
 
 # 尝试导入声纹提取模型 (SpeechBrain)
 try:
@@ -14,17 +18,34 @@ except ImportError:
     HAS_MODEL = False
     print("[Warning] SpeechBrain not found. Voiceprint extraction will be simulated.")
 
+# 声纹模型常驻策略：IMA_SPEAKER_MODEL_POLICY=always|idle|after_use, IMA_SPEAKER_MODEL_IDLE_SEC
+SPEAKER_MODEL_POLICY, SPEAKER_MODEL_IDLE_SEC = policy_from_env("IMA_SPEAKER_MODEL")
+
 class SpeakerDB:
-    def __init__(self, db_path="resource/speakers.db"):
+    def __init__(self, db_path="resource/speakers.db", index_backend=SPEAKER_INDEX_BACKEND,
+                 model_policy=SPEAKER_MODEL_POLICY, idle_timeout=SPEAKER_MODEL_IDLE_SEC):
         self.db_path = db_path
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        self._init_db()
+        # [优化] 共享的线程本地 WAL 连接，建表/迁移只执行一次
+        self.db = get_database(db_path)
+        self.db.init_schema("speakers", self._init_db)
         self.classifier = None
+        # [新增] 由生命周期管理器决定模型何时加载/卸载
+        self.lifecycle = ModelLifecycle("speaker_encoder", self._load_classifier, self._unload_classifier,
+                                        policy=model_policy, idle_timeout=idle_timeout)
         self._load_model() # 初始化时加载，保证 UI 响应快
 
-    def _init_db(self):
+        # [新增] 声纹检索索引 (持久化在 speakers.db 旁边)，以及 id -> (name, title) 元数据
+        self.index_backend = index_backend
+        self.index_path = os.path.splitext(db_path)[0] + ".index.npz"
+        self._index_lock = threading.RLock()
+        self._index = None
+        self._meta = {}
+        # 常驻连接仅用于 PRAGMA data_version，感知其他连接/进程对库的修改
+        self._version_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._index_version = None
+
+    def _init_db(self, conn):
         """初始化 SQLite 数据库"""
-        conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS speakers (
@@ -41,14 +62,11 @@ class SpeakerDB:
         if "title" not in columns:
             try:
                 cursor.execute("ALTER TABLE speakers ADD COLUMN title TEXT")
-                conn.commit()
             except Exception as e:
                 print(f"[Error] Migration failed: {e}")
-        conn.commit()
-        conn.close()
 
-    def _load_model(self):
-        """加载声纹提取模型"""
+    def _load_classifier(self):
+        """加载声纹提取模型 (由 lifecycle 调用)"""
         if self.classifier is not None:
             return # 避免重复加载
 
@@ -63,8 +81,8 @@ class SpeakerDB:
             except Exception as e:
                 print(f"Error loading speaker model: {e}")
 
-    def unload_model(self):
-        """[新增] 卸载模型并释放显存"""
+    def _unload_classifier(self):
+        """卸载模型并释放显存 (由 lifecycle 调用)"""
         if self.classifier:
             del self.classifier
             self.classifier = None
@@ -75,9 +93,24 @@ class SpeakerDB:
                 torch.cuda.empty_cache()
         # print("[SpeakerDB] Model unloaded and GPU memory cleared.")
 
+    def _load_model(self):
+        self.lifecycle.load()
+
+    def unload_model(self):
+        """[新增] 立即卸载模型并释放显存"""
+        self.lifecycle.unload()
+
+    def acquire_model(self):
+        """推理前调用：确保模型已加载，使用期间不会被空闲策略卸载"""
+        self.lifecycle.acquire()
+
+    def release_model(self):
+        """推理结束后调用：按常驻策略 (always / idle / after_use) 处理模型"""
+        self.lifecycle.release()
+
     def _ensure_model(self):
         """确保模型已加载（懒加载机制）"""
-        if self.classifier is None:
+        if not self.lifecycle.loaded:
             self._load_model()
 
     def extract_embedding_from_memory(self, audio_np):
@@ -93,6 +126,31 @@ class SpeakerDB:
         embedding = self.classifier.encode_batch(signal)
         return embedding.squeeze().cpu().numpy()
 
+    def extract_embeddings_batch(self, windows, batch_size=32, cancel_token=None):
+        """
+        [新增] 批量提取声纹：windows 为 (N, samples) 数组 (可以是滑窗的 strided 视图)，
+        按 batch_size 分批送入 encode_batch，返回 (N, dim) 的 float32 矩阵
+        cancel_token: 可选，每个批次前调用 raise_if_cancelled()
+        """
+        self._ensure_model()
+        if not self.classifier:
+            return np.random.rand(len(windows), 192).astype(np.float32)
+
+        device = self.classifier.device
+        outputs = []
+        with torch.inference_mode():
+            for b in range(0, len(windows), batch_size):
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                # 仅在这里把当前小批次物化成连续内存，整段音频的滑窗本身不复制
+                chunk = np.ascontiguousarray(windows[b:b + batch_size], dtype=np.float32)
+                signal = torch.from_numpy(chunk).to(device)
+                emb = self.classifier.encode_batch(signal)
+                outputs.append(emb.squeeze(1).cpu().numpy())
+        if not outputs:
+            return np.zeros((0, 192), dtype=np.float32)
+        return np.concatenate(outputs).astype(np.float32, copy=False)
+
     def extract_embedding(self, audio_path):
         self._ensure_model()
         if not self.classifier:
@@ -103,14 +161,15 @@ class SpeakerDB:
 
     def add_speaker(self, name, title, audio_path):
         try:
-            vector = self.extract_embedding(audio_path)
+            self.acquire_model()
+            try:
+                vector = self.extract_embedding(audio_path)
+            finally:
+                self.release_model()
             vector_bytes = vector.tobytes()
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO speakers (name, title, embedding, created_at) VALUES (?, ?, ?, ?)",
-                           (name, title, vector_bytes, datetime.datetime.now().isoformat()))
-            conn.commit()
-            conn.close()
+            self.db.execute("INSERT INTO speakers (name, title, embedding, created_at) VALUES (?, ?, ?, ?)",
+                            (name, title, vector_bytes, datetime.datetime.now().isoformat()))
+            self._sync_index(force=True) # 增量加入新声纹并落盘
             return True, "Success"
         except sqlite3.IntegrityError:
             return False, f"Name '{name}' already exists."
@@ -118,61 +177,120 @@ class SpeakerDB:
             return False, str(e)
 
     def delete_speaker(self, name):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM speakers WHERE name=?", (name,))
-        conn.commit()
-        conn.close()
+        self.db.execute("DELETE FROM speakers WHERE name=?", (name,))
+        self._sync_index(force=True)
 
     def update_speaker_info(self, current_name, new_name=None, new_title=None):
         if not new_name and not new_title: return False, "Nothing to update."
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
         try:
             if new_name and new_title:
-                cursor.execute("UPDATE speakers SET name=?, title=? WHERE name=?", (new_name, new_title, current_name))
+                self.db.execute("UPDATE speakers SET name=?, title=? WHERE name=?", (new_name, new_title, current_name))
             elif new_name:
-                cursor.execute("UPDATE speakers SET name=? WHERE name=?", (new_name, current_name))
+                self.db.execute("UPDATE speakers SET name=? WHERE name=?", (new_name, current_name))
             elif new_title:
-                cursor.execute("UPDATE speakers SET title=? WHERE name=?", (new_title, current_name))
-            conn.commit()
+                self.db.execute("UPDATE speakers SET title=? WHERE name=?", (new_title, current_name))
+            self._sync_index(force=True)
             return True, "Success"
         except sqlite3.IntegrityError:
             return False, f"Name '{new_name}' already exists."
         except Exception as e:
             return False, str(e)
-        finally:
-            conn.close()
 
     def get_all_speakers(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name, title, created_at FROM speakers ORDER BY created_at DESC")
-        data = cursor.fetchall()
-        conn.close()
-        return data
+        return self.db.query("SELECT name, title, created_at FROM speakers ORDER BY created_at DESC")
 
-    def match_speaker(self, input_embedding, threshold=0.25):
-        # 匹配不需要加载模型，纯 CPU 计算
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name, title, embedding FROM speakers")
-        rows = cursor.fetchall()
-        conn.close()
+    def _data_version(self):
+        with self._index_lock:
+            return self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _load_index_file(self):
+        """读取持久化索引，文件缺失或损坏时返回 None"""
+        if not os.path.exists(self.index_path):
+            return None
+        try:
+            return SpeakerIndex.load(self.index_path)
+        except Exception as e:
+            print(f"[SpeakerDB] Index file unreadable ({e}), rebuilding.")
+            return None
 
-        best_score = -1.0
-        best_info = ("Unknown", "")
+    def _fetch_embeddings(self, cursor, ids):
+        rows = []
+        ids = [int(i) for i in ids]
+        for b in range(0, len(ids), 500):
+            part = ids[b:b + 500]
+            cursor.execute(f"SELECT id, embedding FROM speakers WHERE id IN ({','.join('?' * len(part))})", part)
+            rows.extend(cursor.fetchall())
+        return [r[0] for r in rows], [np.frombuffer(r[1], dtype=np.float32) for r in rows]
 
-        norm_input = np.linalg.norm(input_embedding)
-        
-        for name, title, blob in rows:
-            target_emb = np.frombuffer(blob, dtype=np.float32)
-            score = np.dot(input_embedding, target_emb) / (norm_input * np.linalg.norm(target_emb))
-            if score > best_score:
-                best_score = score
-                safe_title = title if title else ""
-                best_info = (name, safe_title)
-        
-        if best_score > threshold:
-            return best_info
-        return ("Unknown", "")
\ No newline at end of file
+    def _sync_index(self, force=False):
+        """
+        让索引与 speakers 表保持一致：只读取 id/name/title 元数据做比对，
+        新增的 id 才去取 embedding 增量加入，已删除的 id 从索引移除。
+        库未被修改 (data_version 不变) 时直接返回缓存。
+        """
+        with self._index_lock:
+            version = self._data_version()
+            if not force and self._index is not None and self._index_version == version:
+                return self._index
+
+            cursor = self.db.conn.cursor()
+            cursor.execute("SELECT id, name, title FROM speakers")
+            self._meta = {r[0]: (r[1], r[2] if r[2] else "") for r in cursor.fetchall()}
+
+            index = self._index if self._index is not None else self._load_index_file()
+            kind = resolve_backend(self.index_backend, len(self._meta))
+            changed = False
+            if index is None or index.kind != kind:
+                # 首次构建或后端切换：全量构建
+                index = create_index(kind)
+                ids, vectors = self._fetch_embeddings(cursor, list(self._meta.keys()))
+                index.build(ids, np.array(vectors) if vectors else np.zeros((0, 0), dtype=np.float32))
+                changed = True
+            else:
+                indexed = set(index.ids.tolist())
+                stale = indexed - self._meta.keys()
+                missing = self._meta.keys() - indexed
+                if stale:
+                    index.remove(list(stale))
+                    changed = True
+                if missing:
+                    ids, vectors = self._fetch_embeddings(cursor, list(missing))
+                    index.add(ids, np.array(vectors))
+                    changed = True
+
+            if changed:
+                try:
+                    index.save(self.index_path)
+                except Exception as e:
+                    print(f"[SpeakerDB] Failed to persist index: {e}")
+
+            self._index = index
+            self._index_version = version
+            return index
+
+    def match_speakers(self, embeddings, threshold=0.25):
+        """
+        [新增] 批量匹配：embeddings 为 (N, dim)，交由声纹索引一次检索。
+        :return: [(name, title, score), ...]，低于阈值的返回 ("Unknown", "", score)
+        """
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        with self._index_lock:
+            index = self._sync_index()
+            meta = self._meta
+            if len(index) == 0 or len(embeddings) == 0:
+                return [("Unknown", "", -1.0) for _ in range(len(embeddings))]
+            best_ids, best_scores = index.search(embeddings)
+
+        results = []
+        for sid, score in zip(best_ids.tolist(), best_scores.tolist()):
+            if sid in meta and score > threshold:
+                name, title = meta[sid]
+                results.append((name, title, float(score)))
+            else:
+                results.append(("Unknown", "", float(score)))
+        return results
+
+    def match_speaker(self, input_embedding, threshold=0.25):
+        # 匹配不需要加载模型，纯 CPU 计算 (走缓存矩阵)
+        name, title, _ = self.match_speakers(input_embedding, threshold=threshold)[0]
+        return (name, title)
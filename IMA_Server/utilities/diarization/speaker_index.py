@@ -0,0 +1,271 @@
+import os
+import tempfile
+import numpy as np
+
+# 索引后端："brute" (精确暴力检索) / "ivf" (倒排近似检索) / "auto" (按库规模自动选择)
+SPEAKER_INDEX_BACKEND = os.environ.get("IMA_SPEAKER_INDEX", "auto")
+# auto 模式下超过该规模切换到 IVF
+ANN_MIN_SPEAKERS = int(os.environ.get("IMA_SPEAKER_ANN_MIN", "5000"))
+
+
+def _normalize(matrix):
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+class SpeakerIndex:
+    """
+    声纹检索索引接口：以 speakers 表的 id 为键，存放 L2 归一化后的声纹向量，
+    search 返回余弦相似度最高的 id。
+    """
+    kind = None
+
+    def __init__(self):
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def build(self, ids, vectors):
+        """全量构建"""
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.vectors = _normalize(vectors) if len(self.ids) else np.zeros((0, 0), dtype=np.float32)
+
+    def add(self, ids, vectors):
+        """增量加入 (声纹注册时调用)"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        vectors = _normalize(vectors)
+        if len(self.ids) == 0:
+            self.ids, self.vectors = ids, vectors
+        else:
+            self.ids = np.concatenate([self.ids, ids])
+            self.vectors = np.concatenate([self.vectors, vectors])
+
+    def remove(self, ids):
+        keep = ~np.isin(self.ids, np.asarray(ids, dtype=np.int64))
+        self.ids, self.vectors = self.ids[keep], self.vectors[keep]
+
+    def search(self, queries):
+        """
+        :param queries: (N, dim) 未归一化的查询向量
+        :return: (best_ids, best_scores)，空索引时 id 为 -1
+        """
+        raise NotImplementedError
+
+    # --- 持久化 ---
+    def _state(self):
+        return {}
+
+    def _load_state(self, data):
+        pass
+
+    def save(self, path):
+        """
+        原子写入 .npz (先写临时文件再替换)
+        [修复] 临时文件名每次唯一：API 进程与各 worker 进程会同时保存同一个索引文件
+        """
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                   prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, kind=self.kind, ids=self.ids, vectors=self.vectors, **self._state())
+            os.replace(tmp, path)
+        except BaseException:
+            try: os.remove(tmp)
+            except OSError: pass
+            raise
+
+    @staticmethod
+    def load(path):
+        with np.load(path, allow_pickle=False) as data:
+            index = create_index(str(data["kind"]))
+            index.ids = data["ids"].astype(np.int64)
+            index.vectors = data["vectors"].astype(np.float32)
+            index._load_state(data)
+        return index
+
+
+class BruteForceIndex(SpeakerIndex):
+    """精确检索：一次矩阵乘法 + argmax"""
+    kind = "brute"
+
+    def search(self, queries):
+        queries = _normalize(queries)
+        if len(self.ids) == 0:
+            return np.full(len(queries), -1, dtype=np.int64), np.full(len(queries), -1.0, dtype=np.float32)
+        scores = queries @ self.vectors.T
+        best = np.argmax(scores, axis=1)
+        return self.ids[best], scores[np.arange(len(best)), best]
+
+
+class IVFIndex(SpeakerIndex):
+    """
+    倒排文件 (IVF) 近似检索，纯 numpy 实现：
+    球面 k-means 把声纹划分到 nlist 个簇，查询时只扫描最近的 nprobe 个簇。
+    新注册的声纹直接归入最近的簇；规模增长到训练时的 RETRAIN_GROWTH 倍后重新训练。
+    """
+    kind = "ivf"
+    RETRAIN_GROWTH = 2.0
+
+    def __init__(self, nlist=None, nprobe=8, train_iters=10):
+        super().__init__()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iters = train_iters
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self.assign = np.zeros(0, dtype=np.int32)
+        self.trained_size = 0
+        self._lists = None
+
+    def _train(self):
+        n = len(self.ids)
+        if n == 0:
+            self.centroids = np.zeros((0, 0), dtype=np.float32)
+            self.assign = np.zeros(0, dtype=np.int32)
+            self.trained_size = 0
+            self._lists = None
+            return
+        nlist = self.nlist or max(1, int(np.sqrt(n)))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(0)
+        centroids = self.vectors[rng.choice(n, nlist, replace=False)].copy()
+        for _ in range(self.train_iters):
+            assign = np.argmax(self.vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, self.vectors)
+            empty = ~np.any(sums, axis=1)
+            # 空簇重新随机取点，避免退化
+            sums[empty] = self.vectors[rng.choice(n, int(empty.sum()))]
+            centroids = _normalize(sums)
+        self.centroids = centroids
+        self.assign = np.argmax(self.vectors @ centroids.T, axis=1).astype(np.int32)
+        self.trained_size = n
+        self._lists = None
+
+    def _inverted_lists(self):
+        """簇 -> 行号 的倒排表 (惰性构建)"""
+        if self._lists is None:
+            order = np.argsort(self.assign, kind="stable")
+            bounds = np.searchsorted(self.assign[order], np.arange(len(self.centroids) + 1))
+            self._lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(self.centroids))]
+        return self._lists
+
+    def build(self, ids, vectors):
+        super().build(ids, vectors)
+        self._train()
+
+    def add(self, ids, vectors):
+        start = len(self.ids)
+        super().add(ids, vectors)
+        if len(self.ids) == start:
+            return
+        if len(self.centroids) == 0 or len(self.ids) > self.trained_size * self.RETRAIN_GROWTH:
+            self._train()
+            return
+        new_assign = np.argmax(self.vectors[start:] @ self.centroids.T, axis=1).astype(np.int32)
+        self.assign = np.concatenate([self.assign, new_assign])
+        self._lists = None
+
+    def remove(self, ids):
+        keep = ~np.isin(self.ids, np.asarray(ids, dtype=np.int64))
+        self.ids, self.vectors, self.assign = self.ids[keep], self.vectors[keep], self.assign[keep]
+        self._lists = None
+
+    def search(self, queries):
+        queries = _normalize(queries)
+        best_ids = np.full(len(queries), -1, dtype=np.int64)
+        best_scores = np.full(len(queries), -1.0, dtype=np.float32)
+        if len(self.ids) == 0:
+            return best_ids, best_scores
+
+        lists = self._inverted_lists()
+        nprobe = min(self.nprobe, len(self.centroids))
+        coarse = queries @ self.centroids.T
+        probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        # 按簇分组查询：每个簇只与探测到它的查询做一次矩阵乘法 (循环次数 = 簇数，而非查询数)
+        q_of = np.repeat(np.arange(len(queries)), nprobe)
+        c_of = probes.ravel()
+        order = np.argsort(c_of, kind="stable")
+        bounds = np.searchsorted(c_of[order], np.arange(len(self.centroids) + 1))
+        for c in range(len(self.centroids)):
+            rows = lists[c]
+            qs = q_of[order[bounds[c]:bounds[c + 1]]]
+            if len(rows) == 0 or len(qs) == 0:
+                continue
+            scores = queries[qs] @ self.vectors[rows].T
+            b = np.argmax(scores, axis=1)
+            top = scores[np.arange(len(qs)), b]
+            better = top > best_scores[qs]
+            best_scores[qs[better]] = top[better]
+            best_ids[qs[better]] = self.ids[rows[b[better]]]
+        return best_ids, best_scores
+
+    def _state(self):
+        return {"centroids": self.centroids, "assign": self.assign,
+                "trained_size": self.trained_size, "nprobe": self.nprobe}
+
+    def _load_state(self, data):
+        self.centroids = data["centroids"].astype(np.float32)
+        self.assign = data["assign"].astype(np.int32)
+        self.trained_size = int(data["trained_size"])
+        self.nprobe = int(data["nprobe"])
+
+
+INDEX_BACKENDS = {"brute": BruteForceIndex, "ivf": IVFIndex}
+
+
+def create_index(kind):
+    if kind not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown speaker index backend: {kind}")
+    return INDEX_BACKENDS[kind]()
+
+
+def resolve_backend(backend, n_speakers):
+    """auto 模式按规模选择后端"""
+    if backend == "auto":
+        return "ivf" if n_speakers >= ANN_MIN_SPEAKERS else "brute"
+    return backend
+
+
+def benchmark_index(sizes=(1000, 10000, 100000), dim=192, n_queries=2000, nprobe=8):
+    """
+    [新增] 在合成声纹库上测试 IVF 相对精确检索的 recall@1 与延迟
+    (声纹按"部门"成簇分布，查询为已注册声纹加噪声，模拟同一人的新录音)
+    """
+    import time
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        n_groups = max(8, n // 200)
+        centers = _normalize(rng.standard_normal((n_groups, dim)))
+        vectors = _normalize(centers[rng.integers(0, n_groups, n)] + rng.standard_normal((n, dim)) / np.sqrt(dim))
+        ids = np.arange(n)
+        targets = rng.integers(0, n, n_queries)
+        # 同一说话人新录音与注册声纹的余弦相似度约 0.8
+        queries = vectors[targets] + 0.75 * rng.standard_normal((n_queries, dim)).astype(np.float32) / np.sqrt(dim)
+
+        brute = BruteForceIndex()
+        brute.build(ids, vectors)
+        t0 = time.perf_counter()
+        exact_ids, _ = brute.search(queries)
+        t_brute = (time.perf_counter() - t0) / n_queries * 1000
+
+        ivf = IVFIndex(nprobe=nprobe)
+        t0 = time.perf_counter()
+        ivf.build(ids, vectors)
+        t_build = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        ann_ids, _ = ivf.search(queries)
+        t_ivf = (time.perf_counter() - t0) / n_queries * 1000
+
+        recall = float(np.mean(ann_ids == exact_ids))
+        print(f"[Bench] n={n:<7} brute={t_brute:.3f} ms/q  ivf={t_ivf:.3f} ms/q "
+              f"(nlist={len(ivf.centroids)}, nprobe={nprobe}, build={t_build:.1f}s)  recall@1={recall:.3f}")
+
+
+# python -m utilities.diarization.speaker_index
+if __name__ == "__main__":
+    benchmark_index()
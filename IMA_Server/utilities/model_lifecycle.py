@@ -0,0 +1,146 @@
+import os
+import time
+import threading
+import weakref
+
+# 常驻策略
+POLICY_ALWAYS = "always"        # 加载后常驻，不主动卸载
+POLICY_IDLE = "idle"            # 空闲超过 idle_timeout 秒后卸载
+POLICY_AFTER_USE = "after_use"  # 每次用完立即卸载 (原有行为)
+POLICIES = (POLICY_ALWAYS, POLICY_IDLE, POLICY_AFTER_USE)
+
+# 所有受管模型 (弱引用)，用于 /system/metrics 汇总
+_REGISTRY = weakref.WeakSet()
+_REGISTRY_LOCK = threading.Lock()
+
+
+class ModelLifecycle:
+    """
+    模型生命周期管理：统一负责加载/卸载时机，并记录加载、卸载事件。
+    loader() 负责真正加载模型，unloader() 负责释放；二者由模型持有方提供。
+    使用方在推理前后调用 acquire()/release()，策略决定 release 后模型是否常驻。
+    """
+    def __init__(self, name, loader, unloader, policy=POLICY_IDLE, idle_timeout=300):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown residency policy: {policy}")
+        self.name = name
+        self.loader = loader
+        self.unloader = unloader
+        self.policy = policy
+        self.idle_timeout = float(idle_timeout)
+
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._in_use = 0
+        self._last_used = 0.0
+        self._timer = None
+        self._stats = {"loads": 0, "unloads": 0, "load_time_total": 0.0, "load_time_last": 0.0,
+                       "acquires": 0, "cold_acquires": 0}
+
+        with _REGISTRY_LOCK:
+            _REGISTRY.add(self)
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def load(self):
+        """确保模型已加载 (幂等)"""
+        with self._lock:
+            if self._loaded:
+                return
+            t0 = time.perf_counter()
+            self.loader()
+            elapsed = time.perf_counter() - t0
+            self._loaded = True
+            self._last_used = time.monotonic()
+            self._stats["loads"] += 1
+            self._stats["load_time_total"] += elapsed
+            self._stats["load_time_last"] = elapsed
+            print(f"[Lifecycle] {self.name} loaded in {elapsed:.2f}s (policy={self.policy})")
+            if self._in_use == 0:
+                self._schedule_idle_unload()
+
+    def unload(self):
+        """立即卸载 (幂等)"""
+        with self._lock:
+            self._cancel_timer()
+            if not self._loaded:
+                return
+            self.unloader()
+            self._loaded = False
+            self._stats["unloads"] += 1
+            print(f"[Lifecycle] {self.name} unloaded")
+
+    def acquire(self):
+        """推理前调用：必要时加载，并在使用期间阻止卸载"""
+        with self._lock:
+            self._cancel_timer()
+            self._stats["acquires"] += 1
+            if not self._loaded:
+                self._stats["cold_acquires"] += 1
+            self._in_use += 1
+            try:
+                self.load()
+            except Exception:
+                self._in_use -= 1
+                raise
+
+    def release(self):
+        """推理结束后调用：按策略决定是否卸载"""
+        with self._lock:
+            self._in_use = max(0, self._in_use - 1)
+            self._last_used = time.monotonic()
+            if self._in_use > 0:
+                return
+            if self.policy == POLICY_AFTER_USE:
+                self.unload()
+            else:
+                self._schedule_idle_unload()
+
+    def _schedule_idle_unload(self):
+        if self.policy != POLICY_IDLE or not self._loaded:
+            return
+        self._cancel_timer()
+        self._timer = threading.Timer(self.idle_timeout, self._on_idle)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _on_idle(self):
+        with self._lock:
+            if self._in_use == 0 and time.monotonic() - self._last_used >= self.idle_timeout - 0.01:
+                self.unload()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data.update({
+                "name": self.name,
+                "policy": self.policy,
+                "idle_timeout": self.idle_timeout,
+                "loaded": self._loaded,
+                "in_use": self._in_use,
+            })
+        data["load_time_avg"] = data["load_time_total"] / data["loads"] if data["loads"] else 0.0
+        return data
+
+
+def lifecycle_metrics():
+    """所有受管模型的加载/卸载统计"""
+    with _REGISTRY_LOCK:
+        items = list(_REGISTRY)
+    return [m.stats() for m in items]
+
+
+def policy_from_env(prefix, default_policy=POLICY_IDLE, default_idle=300):
+    """
+    从环境变量读取策略：{prefix}_POLICY (always / idle / after_use) 与 {prefix}_IDLE_SEC
+    """
+    policy = os.environ.get(f"{prefix}_POLICY", default_policy)
+    idle = float(os.environ.get(f"{prefix}_IDLE_SEC", default_idle))
+    return policy, idle